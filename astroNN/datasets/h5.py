@@ -8,6 +8,8 @@ from functools import reduce
 import h5py
 import numpy as np
 
+from astroNN.nn.utilities.file_backed import FileBackedArray
+
 
 def h5name_check(h5name):
     if h5name is None:
@@ -16,6 +18,12 @@ def h5name_check(h5name):
 
 
 class H5Loader(object):
+    """
+    | Load spectra and labels from h5 file compiled by ``H5Compiler``
+    |
+    | With ``lazy=True``, spectra are ``FileBackedArray`` read from a h5 file kept opened by the loader, they are
+    | valid until ``close()`` is called, the loader is used as a context manager or garbage collected.
+    """
     def __init__(self, filename, target='all'):
         self.filename = filename
         self.target = target
@@ -23,6 +31,9 @@ class H5Loader(object):
         self.load_combined = True
         self.load_err = False
         self.exclude9999 = False
+        # whether to read spectra lazily from the h5 file when indexed for out-of-core training
+        self.lazy = False
+        self._h5file = None
 
         if os.path.isfile(os.path.join(self.currentdir, self.filename)) is True:
             self.h5path = os.path.join(self.currentdir, self.filename)
@@ -64,10 +75,17 @@ class H5Loader(object):
 
     def load(self):
         allowed_index = self.load_allowed_index()
+        if self.lazy is True and self._h5file is None:
+            # keep the file opened for spectra to be read lazily
+            self._h5file = h5py.File(self.h5path, 'r')
         with h5py.File(self.h5path) as F:  # ensure the file will be cleaned up
             allowed_index_list = allowed_index.tolist()
-            spectra = np.array(F['spectra'])[allowed_index_list]
-            spectra_err = np.array(F['spectra_err'])[allowed_index_list]
+            if self.lazy is True:
+                spectra = FileBackedArray(self._h5file['spectra'], index=allowed_index)
+                spectra_err = FileBackedArray(self._h5file['spectra_err'], index=allowed_index)
+            else:
+                spectra = np.array(F['spectra'])[allowed_index_list]
+                spectra_err = np.array(F['spectra_err'])[allowed_index_list]
 
             y = np.array((spectra.shape[1]))
             y_err = np.array((spectra.shape[1]))
@@ -89,6 +107,23 @@ class H5Loader(object):
         else:
             return spectra, y
 
+    def close(self):
+        """
+        Close the h5 file opened for lazily loaded spectra (if any), lazily loaded spectra cannot be read afterward
+        """
+        if self._h5file is not None:
+            self._h5file.close()
+            self._h5file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
     def load_entry(self, name):
         """
         NAME:
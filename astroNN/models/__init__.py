@@ -18,7 +18,10 @@ from astroNN.models.apogee_models import (
     ApokascEncoderDecoder,
     StarNet2017,
 )
+from astroNN.models.distributed import DistributedTrainer, benchmark_distributed_scaling
 from astroNN.models.misc_models import Cifar10CNN, MNIST_BCNN, SimplePolyNN
+from astroNN.models.parallel import ParallelPredictor
+from astroNN.models.server import InferenceServer
 from astroNN.nn.losses import losses_lookup
 from astroNN.nn.utilities import Normalizer
 from astroNN.shared.dict_tools import dict_list_to_dict_np, list_to_dict
@@ -38,7 +41,11 @@ __all__ = [
     "StarNet2017",
     "Cifar10CNN",
     "MNIST_BCNN",
-    "SimplePolyNN"
+    "SimplePolyNN",
+    "ParallelPredictor",
+    "InferenceServer",
+    "DistributedTrainer",
+    "benchmark_distributed_scaling"
 ]
 
 optimizers = tfk.optimizers
@@ -267,6 +274,18 @@ def load_folder(folder=None):
         astronn_model_obj.aux_length = parameter["aux_length"]
     except KeyError:
         pass
+    try:
+        astronn_model_obj.mc_seed = parameter["mc_seed"]
+    except KeyError:
+        pass
+    try:
+        astronn_model_obj.precision = parameter["precision"]
+    except KeyError:
+        pass
+    try:
+        astronn_model_obj.predict_batch_size = parameter["predict_batch_size"]
+    except KeyError:
+        pass
     with h5py.File(
         os.path.join(astronn_model_obj.fullfilepath, "model_weights.h5"), mode="r"
     ) as f:
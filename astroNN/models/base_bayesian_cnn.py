@@ -13,11 +13,12 @@ from astroNN.config import _astroNN_MODEL_NAME
 from astroNN.datasets import H5Loader
 from astroNN.models.base_master_nn import NeuralNetMaster
 from astroNN.nn.callbacks import VirutalCSVLogger
-from astroNN.nn.layers import FastMCInference
+from astroNN.nn.layers import FastMCInference, FastMCInferencePostProcess
 from astroNN.nn.losses import mean_absolute_error, mean_error, mean_squared_error, zeros_loss
 from astroNN.nn.metrics import categorical_accuracy, binary_accuracy
-from astroNN.nn.numpy import sigmoid
 from astroNN.nn.utilities import Normalizer
+from astroNN.nn.utilities.augmentation import GaussianNoiseAugmentation
+from astroNN.nn.utilities.file_backed import FileBackedArray, lazy_divide, lazy_zeros_like, take_rows
 from astroNN.nn.utilities.generator import GeneratorMaster
 from astroNN.shared.warnings import deprecated, deprecated_copy_signature
 from astroNN.shared.nn_tools import gpu_availability
@@ -79,12 +80,22 @@ class BayesianCNNDataGenerator(GeneratorMaster):
             return x, y
 
     def __getitem__(self, index):
-        return self._data_generation(self.idx_list[index * self.batch_size: (index + 1) * self.batch_size])
+        return self._augment(self._data_generation(self.idx_list[index * self.batch_size:
+                                                                 (index + 1) * self.batch_size]))
 
     def on_epoch_end(self):
         # shuffle the list when epoch ends for the next epoch
         self.idx_list = self._get_exploration_order(range(self.inputs['input'].shape[0]))
 
+    def _dataset_elements(self):
+        x = self._channel_view(self.inputs)
+        if "labels_err" in x.keys():
+            x.update({"labels_err": np.asarray(self.inputs["labels_err"])})
+        if self.sample_weight is not None:
+            return x, dict(self.labels), self.sample_weight
+        else:
+            return x, dict(self.labels)
+
 
 class BayesianCNNPredDataGenerator(GeneratorMaster):
     """
@@ -121,9 +132,11 @@ class BayesianCNNPredDataGenerator(GeneratorMaster):
         return x
 
     def __getitem__(self, index):
-        x = self._data_generation(self.idx_list[index * self.batch_size: (index + 1) * self.batch_size])
+        idx_list_temp = self.idx_list[index * self.batch_size: (index + 1) * self.batch_size]
+        # pad the last batch so all batches have the same shape
+        x = self._data_generation(self._pad_idx(idx_list_temp))
         if self.pbar and index > self.current_idx: 
-            self.pbar.update(self.batch_size)
+            self.pbar.update(len(idx_list_temp))
         self.current_idx = index
         return x
 
@@ -160,6 +173,15 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         self.dropout_rate = 0.2
         self.length_scale = 3  # prior length scale
         self.mc_num = 100  # increased to 100 due to high performance VI on GPU implemented on 14 April 2018 (Henry)
+        self.mc_strategy = "pfor"  # "pfor", "chunked" or "auto", see astroNN.nn.layers.FastMCInference
+        self.mc_chunk_size = 10  # number of Monte Carlo samples drawn at once for "chunked" strategy
+        self.mc_memory_budget = None  # memory budget in bytes to select strategy for "auto" strategy
+        # run layers before the first stochastic layer once in MC inference, only safe if astroNN knows every
+        # stochastic layer of the model (see astroNN.nn.layers.FastMCInference)
+        self.mc_deterministic_prefix = False
+        self.mc_fused_postprocess = False  # MC inference model returns de-normalized prediction and uncertainty directly
+        self.mc_seed = None  # if not None, MC noise is keyed on (seed, index of data, draw index) for reproducibility
+        self.input_noise_augmentation = False  # perturb training inputs with Gaussian noise drawn from inputs_err
         self.val_size = 0.1
         self.disable_dropout = False
         self.aux_length = 0
@@ -168,6 +190,7 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         self.labels_norm_mode = 2
 
         self.keras_model_predict = None
+        self._mc_model_cache = None
 
     def pre_training_checklist_child(self, input_data, labels, sample_weight):
         input_data, labels = self.pre_training_checklist_master(input_data, labels)
@@ -177,17 +200,17 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
             self.input_normalizer = Normalizer(mode=self.input_norm_mode, verbose=self.verbose)
             self.labels_normalizer = Normalizer(mode=self.labels_norm_mode, verbose=self.verbose)
 
-            norm_data = self.input_normalizer.normalize(input_data)
+            norm_data = self._normalize_data(self.input_normalizer, input_data)
             self.input_mean, self.input_std = self.input_normalizer.mean_labels, self.input_normalizer.std_labels
-            norm_labels = self.labels_normalizer.normalize(labels)
+            norm_labels = self._normalize_data(self.labels_normalizer, labels)
             self.labels_mean, self.labels_std = self.labels_normalizer.mean_labels, self.labels_normalizer.std_labels
         else:
-            norm_data = self.input_normalizer.normalize(input_data, calc=False)
-            norm_labels = self.labels_normalizer.normalize(labels, calc=False)
+            norm_data = self._normalize_data(self.input_normalizer, input_data, calc=False)
+            norm_labels = self._normalize_data(self.labels_normalizer, labels, calc=False)
 
         # No need to care about Magic number as loss function looks for magic num in y_true only
-        norm_data.update({"input_err": (input_data['input_err'] / self.input_std['input']),
-                          "labels_err": input_data['labels_err'] / self.labels_std['output']})
+        norm_data.update({"input_err": lazy_divide(input_data['input_err'], self.input_std['input']),
+                          "labels_err": lazy_divide(input_data['labels_err'], self.labels_std['output'])})
         norm_labels.update({"variance_output": norm_labels['output']})
 
         if self.keras_model is None:  # only compile if there is no keras_model, e.g. fine-tuning does not required
@@ -200,21 +223,23 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
             self.train_idx = np.arange(self.num_train + self.val_num)
             # just dummy, to minimize modification needed
             self.val_idx = np.arange(self.num_train + self.val_num)[:2]
+        # in storage order so file-backed data are read mostly sequentially
+        self.train_idx, self.val_idx = np.sort(self.train_idx), np.sort(self.val_idx)
 
         norm_data_training = {}
         norm_data_val = {}
         norm_labels_training = {}
         norm_labels_val = {}
         for name in norm_data.keys():
-            norm_data_training.update({name: norm_data[name][self.train_idx]})
-            norm_data_val.update({name: norm_data[name][self.val_idx]})
+            norm_data_training.update({name: take_rows(norm_data[name], self.train_idx)})
+            norm_data_val.update({name: take_rows(norm_data[name], self.val_idx)})
         for name in norm_labels.keys():
-            norm_labels_training.update({name: norm_labels[name][self.train_idx]})
-            norm_labels_val.update({name: norm_labels[name][self.val_idx]})
+            norm_labels_training.update({name: take_rows(norm_labels[name], self.train_idx)})
+            norm_labels_val.update({name: take_rows(norm_labels[name], self.val_idx)})
         
         if sample_weight is not None:        
-            sample_weight_training = sample_weight[self.train_idx]
-            sample_weight_val = sample_weight[self.val_idx]
+            sample_weight_training = take_rows(sample_weight, self.train_idx)
+            sample_weight_val = take_rows(sample_weight, self.val_idx)
         else:
             sample_weight_training = None
             sample_weight_val = None
@@ -228,6 +253,10 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
                                                                  norm_labels_training],
                                                            manual_reset=False, 
                                                            sample_weight=sample_weight_training)
+        if self.input_noise_augmentation:
+            # every batch is perturbed by worker threads of the generator or in parallel by tf.data pipeline
+            self.training_generator.augmentation = GaussianNoiseAugmentation(input_name="input",
+                                                                             err_name="input_err")
 
         if self.has_val:
             val_batchsize = self.batch_size if len(self.val_idx) > self.batch_size else len(self.val_idx)
@@ -266,7 +295,8 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         else:
             raise RuntimeError('Only "regression", "classification" and "binary_classification" are supported')
 
-        self.keras_model, self.keras_model_predict, self.output_loss, self.variance_loss = self.model()
+        with self._precision_scope(), self._strategy_scope():
+            self.keras_model, self.keras_model_predict, self.output_loss, self.variance_loss = self.model()
         
         if self.task == 'regression':
             self._output_loss = lambda predictive, labelerr: mse_lin_wrapper(predictive, labelerr)
@@ -407,16 +437,20 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         """
         Train a Bayesian neural network
 
-        :param input_data: Data to be trained with neural network
-        :type input_data: ndarray
+        :param input_data: Data to be trained with neural network, file-backed data (h5py dataset, numpy memmap or
+            FileBackedArray) are read lazily batch by batch
+        :type input_data: Union([ndarray, h5py.Dataset, numpy.memmap, FileBackedArray])
         :param labels: Labels to be trained with neural network
-        :type labels: ndarray
+        :type labels: Union([ndarray, h5py.Dataset, numpy.memmap, FileBackedArray])
         :param inputs_err: Error for input_data (if any), same shape with input_data.
-        :type inputs_err: Union([NoneType, ndarray])
+        :type inputs_err: Union([NoneType, ndarray, h5py.Dataset, numpy.memmap, FileBackedArray])
         :param labels_err: Labels error (if any)
-        :type labels_err: Union([NoneType, ndarray])
+        :type labels_err: Union([NoneType, ndarray, h5py.Dataset, numpy.memmap, FileBackedArray])
         :param sample_weight: Sample weights (if any)
         :type sample_weight: Union([NoneType, ndarray])
+        :param experimental: Whether to use tf.data pipeline, same as setting ``data_pipeline`` to "tf.data" for this
+            call only
+        :type experimental: bool
         :return: None
         :rtype: NoneType
         :History:
@@ -424,10 +458,10 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
             | 2018-Apr-12 - Updated - Henry Leung (University of Toronto)
         """
         if inputs_err is None:
-            inputs_err = np.zeros_like(input_data)
+            inputs_err = lazy_zeros_like(input_data)
 
         if labels_err is None:
-            labels_err = np.zeros_like(labels)
+            labels_err = lazy_zeros_like(labels)
 
         # TODO: allow named inputs too??
         input_data = {"input": input_data, "input_err": inputs_err, "labels_err": labels_err}
@@ -455,25 +489,25 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
 
         start_time = time.time()
 
+        # kept for backward compatibility, same as data_pipeline="tf.data" for this call only
+        data_pipeline = self.data_pipeline
         if experimental:
-            dataset = tf.data.Dataset.from_tensor_slices((norm_data_training, norm_labels_training, sample_weight_training)).batch(self.batch_size).shuffle(5000, reshuffle_each_iteration=True).prefetch(tf.data.AUTOTUNE)
-            val_dataset = tf.data.Dataset.from_tensor_slices((norm_data_val, norm_labels_val, sample_weight_val)).batch(self.batch_size).prefetch(tf.data.AUTOTUNE)
+            self.data_pipeline = "tf.data"
+        try:
+            training_data, validation_data = self._fit_data()
+        finally:
+            self.data_pipeline = data_pipeline
 
-            self.history = self.keras_model.fit(dataset,
-                                                validation_data=val_dataset,
-                                                epochs=self.max_epochs, 
-                                                verbose=self.verbose,
-                                                workers=os.cpu_count() // 2,
-                                                callbacks=self.__callbacks,
-                                                use_multiprocessing=MULTIPROCESS_FLAG)
-        else:
-            self.history = self.keras_model.fit(self.training_generator,
-                                                validation_data=self.validation_generator,
-                                                epochs=self.max_epochs, 
+        try:
+            self.history = self.keras_model.fit(training_data,
+                                                validation_data=validation_data,
+                                                epochs=self.max_epochs,
                                                 verbose=self.verbose,
                                                 workers=os.cpu_count() // 2,
                                                 callbacks=self.__callbacks,
                                                 use_multiprocessing=MULTIPROCESS_FLAG)
+        finally:
+            self._release_fit_data()
 
         print(f'Completed Training, {(time.time() - start_time):.{2}f}s in total')
         if self.autosave is True:
@@ -482,9 +516,9 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
 
         return None
 
-    def fit_on_batch(self, input_data, labels, inputs_err=None, labels_err=None, sample_weight=None):
+    def _on_batch_generator(self, input_data, labels, inputs_err=None, labels_err=None, sample_weight=None):
         """
-        Train a Bayesian neural network by running a single gradient update on all of your data, suitable for fine-tuning
+        Data generator of a single batch of all normalized data for fit_on_batch()
 
         :param input_data: Data to be trained with neural network
         :type input_data: ndarray
@@ -496,10 +530,8 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         :type labels_err: Union([NoneType, ndarray])
         :param sample_weight: Sample weights (if any)
         :type sample_weight: Union([NoneType, ndarray])
-        :return: None
-        :rtype: NoneType
-        :History:
-            | 2018-Aug-25 - Written - Henry Leung (University of Toronto)
+        :return: data generator
+        :rtype: BayesianCNNDataGenerator
         """
         self.has_model_check()
 
@@ -530,14 +562,34 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
                           "labels_err": input_data['labels_err'] / self.labels_std['output']})
         norm_labels.update({"variance_output": norm_labels['output']})
 
-        start_time = time.time()
+        return BayesianCNNDataGenerator(batch_size=input_data['input'].shape[0],
+                                        shuffle=False,
+                                        steps_per_epoch=1,
+                                        data=[norm_data,
+                                              norm_labels], 
+                                        sample_weight=sample_weight)
 
-        fit_generator = BayesianCNNDataGenerator(batch_size=input_data['input'].shape[0],
-                                                 shuffle=False,
-                                                 steps_per_epoch=1,
-                                                 data=[norm_data,
-                                                       norm_labels], 
-                                                 sample_weight=sample_weight)
+    def fit_on_batch(self, input_data, labels, inputs_err=None, labels_err=None, sample_weight=None):
+        """
+        Train a Bayesian neural network by running a single gradient update on all of your data, suitable for fine-tuning
+
+        :param input_data: Data to be trained with neural network
+        :type input_data: ndarray
+        :param labels: Labels to be trained with neural network
+        :type labels: ndarray
+        :param inputs_err: Error for input_data (if any), same shape with input_data.
+        :type inputs_err: Union([NoneType, ndarray])
+        :param labels_err: Labels error (if any)
+        :type labels_err: Union([NoneType, ndarray])
+        :param sample_weight: Sample weights (if any)
+        :type sample_weight: Union([NoneType, ndarray])
+        :return: None
+        :rtype: NoneType
+        :History:
+            | 2018-Aug-25 - Written - Henry Leung (University of Toronto)
+        """
+        fit_generator = self._on_batch_generator(input_data, labels, inputs_err, labels_err, sample_weight)
+        start_time = time.time()
 
         score = self.keras_model.fit(fit_generator,
                                      epochs=1,
@@ -584,26 +636,15 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
                 'input_names': self.input_names,
                 'output_names': self.output_names,
                 'batch_size': self.batch_size,
-                'aux_length': self.aux_length}
+                'predict_batch_size': self.predict_batch_size,
+                'aux_length': self.aux_length,
+                'mc_seed': self.mc_seed,
+                'precision': self.precision}
 
         with open(self.fullfilepath + '/astroNN_model_parameter.json', 'w') as f:
             json.dump(data, f, indent=4, sort_keys=True)
 
-    def predict(self, input_data, inputs_err=None, batch_size=None):
-        """
-        Test model, High performance version designed for fast variational inference on GPU
-
-        :param input_data: Data to be inferred with neural network
-        :type input_data: ndarray
-        :param inputs_err: Error for input_data, same shape with input_data.
-        :type inputs_err: Union([NoneType, ndarray])
-        :return: prediction and prediction uncertainty
-        :History:
-            | 2018-Jan-06 - Written - Henry Leung (University of Toronto)
-            | 2018-Apr-12 - Updated - Henry Leung (University of Toronto)
-        """
-        self.has_model_check()
-
+    def _mc_num_check(self):
         if gpu_availability() is False and self.mc_num > 25:
             warnings.warn(f'You are using CPU version Tensorflow, doing {self.mc_num} times Monte Carlo Inference can '
                           f'potentially be very slow! \n '
@@ -612,13 +653,68 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
             if self.mc_num < 2:
                 raise AttributeError("mc_num cannot be smaller than 2")
 
+    def _get_mc_model(self, n=None, batch_size=None, postprocess=False):
+        """
+        | Get the Monte Carlo inference model of keras_model_predict.
+        |
+        | Models are cached so they are not rebuilt and their predict function are not retraced on every call. The cache
+        | is keyed on number of Monte Carlo samples, strategy and the input signature of keras_model_predict. The whole
+        | cache is invalidated when keras_model_predict is rebuilt (e.g. compile() or loading weights into a new model).
+        | Weights updated in-place (e.g. by fit() or set_weights()) are shared with the cached models.
+
+        :param n: Number of Monte Carlo samples, by default mc_num
+        :type n: Union([NoneType, int])
+        :param batch_size: batch size to be used, for strategy selection only
+        :type batch_size: Union([NoneType, int])
+        :param postprocess: whether to fuse post-processing into the model, see _mc_postprocess_layer()
+        :type postprocess: bool
+        :return: Monte Carlo inference model
+        :rtype: keras.Model
+        """
+        if n is None:
+            n = self.mc_num
+        if self._mc_model_cache is None or self._mc_model_cache["source"] is not self.keras_model_predict:
+            self._mc_model_cache = {"source": self.keras_model_predict, "models": {}}
+
+        strategy = FastMCInference(n, strategy=self.mc_strategy, memory_budget=self.mc_memory_budget,
+                                   batch_size=batch_size).select_strategy(self.keras_model_predict)
+        key = (n, strategy, self.mc_chunk_size, self.mc_deterministic_prefix, self.mc_seed, postprocess,
+               tuple((tuple(i.shape[1:]), i.dtype.name) for i in self.keras_model_predict.inputs))
+        models = self._mc_model_cache["models"]
+        if key in models:
+            self.inference_stats["cache_hits"] += 1
+        else:
+            self.inference_stats["cache_misses"] += 1
+            if len(models) >= 4:  # only keep a few recently built models
+                models.pop(next(iter(models)))
+            new = FastMCInference(n, strategy=strategy, chunk_size=self.mc_chunk_size,
+                                  deterministic_prefix=self.mc_deterministic_prefix,
+                                  seed=self.mc_seed)(self.keras_model_predict)
+            if postprocess:
+                new = tfk.models.Model(inputs=new.inputs, outputs=self._mc_postprocess_layer()(new.outputs[0]))
+            models[key] = new
+        return models[key]
+
+    def _prepare_predict_input(self, input_data, inputs_err=None, sample_index=None):
+        """
+        Put input data (and error) in a dictionary and normalize them for inference
+
+        :param input_data: Data to be inferred with neural network
+        :type input_data: ndarray
+        :param inputs_err: Error for input_data, same shape with input_data.
+        :type inputs_err: Union([NoneType, ndarray])
+        :param sample_index: Global index of input_data for seeded Monte Carlo inference, by default 0 to N-1
+        :type sample_index: Union([NoneType, ndarray])
+        :return: dictionary of normalized input data
+        :rtype: dict
+        """
         # if no error array then just zeros
         if inputs_err is None:
             inputs_err = np.zeros_like(input_data)
         else:
-            inputs_err = np.atleast_2d(inputs_err)
-            inputs_err /= self.input_std['input']
-            
+            # do not divide in-place to avoid modifying user's array
+            inputs_err = np.atleast_2d(inputs_err) / self.input_std['input']
+
         # TODO: better way to handle named input
         if "input_err" in self.keras_model.input_names:
             input_data = {"input": input_data, "input_err": inputs_err}
@@ -634,115 +730,336 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
             input_array -= self.input_mean['input']
             input_array /= self.input_std['input']
 
-        total_test_num = input_data['input'].shape[0]  # Number of testing data
-        
-        if batch_size is None:
-            batch_size = self.batch_size
+        if self.mc_seed is not None:
+            if sample_index is None:
+                sample_index = np.arange(input_array['input'].shape[0])
+            input_array['sample_index'] = np.asarray(sample_index, dtype=np.int64)
 
-        # for number of training data smaller than batch_size
-        batch_size = np.min([total_test_num, batch_size])
+        return input_array
 
-        # Due to the nature of how generator works, no overlapped prediction
-        data_gen_shape = (total_test_num // batch_size) * batch_size
-        remainder_shape = total_test_num - data_gen_shape  # Remainder from generator
+    def _mc_predict(self, input_array, batch_size=None, pbar=None, postprocess=False):
+        """
+        Run Monte Carlo inference on normalized data
+
+        :param input_array: dictionary of normalized input data
+        :type input_array: dict
+        :param batch_size: batch size
+        :type batch_size: int
+        :param pbar: tqdm progress bar
+        :type pbar: obj
+        :param postprocess: whether to post-process in the model
+        :type postprocess: bool
+        :return: array with shape (number of data, 2 * number of outputs, 2) of mean and variance, or list of arrays of
+            prediction, total, model and predictive uncertainty if postprocess
+        :rtype: Union([ndarray, list])
+        """
+        total_test_num = input_array['input'].shape[0]  # Number of testing data
 
-        norm_data_main = {}
-        norm_data_remainder = {}
-        for name in input_array.keys():
-            norm_data_main.update({name: input_array[name][:data_gen_shape]})
-            norm_data_remainder.update({name: input_array[name][data_gen_shape:]})
+        batch_size = self._inference_batch_size(batch_size)
+        # mean and variance of a batch of 1 data point have no batch dimension, so never use batch size of 1
+        batch_size = max(batch_size, 2)
 
-        # Data Generator for prediction
-        with tqdm(total=total_test_num, unit="sample") as pbar:
-            pbar.set_postfix({'Monte-Carlo': self.mc_num})
-            pbar.set_description_str("Prediction progress: ")
-            # suppress pfor warning from TF
-            old_level = tf.get_logger().level
-            tf.get_logger().setLevel('ERROR')
+        # suppress pfor warning from TF
+        old_level = tf.get_logger().level
+        tf.get_logger().setLevel('ERROR')
 
-            prediction_generator = BayesianCNNPredDataGenerator(batch_size=batch_size,
-                                                                shuffle=False,
-                                                                steps_per_epoch=data_gen_shape // batch_size,
-                                                                data=[norm_data_main], 
-                                                                pbar=pbar)
+        new = self._get_mc_model(batch_size=self._bucket_batch_size(total_test_num, batch_size),
+                                 postprocess=postprocess)
+        # the last batch is padded so no graph is traced for the remainder
+        result = self._bucketed_predict(new, BayesianCNNPredDataGenerator, input_array, batch_size, pbar=pbar)
+        tf.get_logger().setLevel(old_level)
 
-            new = FastMCInference(self.mc_num)(self.keras_model_predict)
-            
-            result = np.asarray(new.predict(prediction_generator, verbose=0))
-
-            if remainder_shape != 0:  # deal with remainder
-                remainder_generator = BayesianCNNPredDataGenerator(batch_size=remainder_shape,
-                                                                    shuffle=False,
-                                                                    steps_per_epoch=1,
-                                                                    data=[norm_data_remainder])
-                pbar.update(remainder_shape)
-                remainder_result = np.asarray(new.predict(remainder_generator, verbose=0))
-                if remainder_shape == 1:
-                    remainder_result = np.expand_dims(remainder_result, axis=0)
-                result = np.concatenate((result, remainder_result))
-            tf.get_logger().setLevel(old_level)
+        return result
 
-        # in case only 1 test data point, in such case we need to add a dimension
-        if result.ndim < 3 and batch_size == 1:
-            result = np.expand_dims(result, axis=0)
+    def _mc_predict_adaptive(self, input_array, batch_size=None, pbar=None, mc_tol=0.01, mc_block=10):
+        """
+        | Run Monte Carlo inference on normalized data with adaptive number of samples per data point
+        |
+        | Samples are drawn in blocks of mc_block for all unconverged data, running mean and variance are updated
+        | blockwise (Welford/Chan update). A data point is converged and no longer sampled once both the change in
+        | mean and in standard deviation after a block are within mc_tol times the standard deviation for all outputs.
+        | At most mc_num (rounded up to a multiple of mc_block) samples are drawn.
+
+        :param input_array: dictionary of normalized input data
+        :type input_array: dict
+        :param batch_size: batch size
+        :type batch_size: int
+        :param pbar: tqdm progress bar
+        :type pbar: obj
+        :param mc_tol: relative tolerance of convergence
+        :type mc_tol: float
+        :param mc_block: number of Monte Carlo samples drawn at once
+        :type mc_block: int
+        :return: array with shape (number of data, 2 * number of outputs, 2) of mean and variance, and an array of
+            number of samples used for every data point
+        :rtype: tuple
+        """
+        total_test_num = input_array['input'].shape[0]  # Number of testing data
 
-        half_first_dim = result.shape[1] // 2  # result.shape[1] is guarantee an even number, otherwise sth is wrong
+        batch_size = self._inference_batch_size(batch_size)
 
-        predictions = result[:, :half_first_dim, 0]  # mean prediction
-        mc_dropout_uncertainty = result[:, :half_first_dim, 1] * (self.labels_std['output'] ** 2)  # model uncertainty
-        predictions_var = np.exp(result[:, half_first_dim:, 0]) * (
-                self.labels_std['output'] ** 2)  # predictive uncertainty
+        # only used to assemble batches, batches are padded to the bucket size so no graph is traced for any size
+        batch_size = self._bucket_batch_size(total_test_num, max(batch_size, 2))
+        data_getter = BayesianCNNPredDataGenerator(batch_size=batch_size,
+                                                   shuffle=False,
+                                                   steps_per_epoch=1,
+                                                   data=[input_array])
 
-        if self.labels_normalizer is not None:
-            predictions = self.labels_normalizer.denormalize(
-                list_to_dict([self.keras_model.output_names[0]], predictions))
-            predictions = predictions['output']
-        else:
-            predictions *= self.labels_std['output']
-            predictions += self.labels_mean['output']
+        # suppress pfor warning from TF
+        old_level = tf.get_logger().level
+        tf.get_logger().setLevel('ERROR')
 
-        if self.task == 'regression':
-            # Predictive variance
-            pred_var = predictions_var + mc_dropout_uncertainty  # epistemic plus aleatoric uncertainty
-            pred_uncertainty = np.sqrt(pred_var)  # Convert back to std error
+        new = self._get_mc_model(mc_block, batch_size=batch_size)
+        with self._predict_function_scope(new, batch_size):
+            tracing_count = self._tracing_count(new)
+
+            mc_count = np.zeros(total_test_num, dtype=int)
+            mean, m2 = None, None
+            active = np.arange(total_test_num)
+            for mc_round in range(int(np.ceil(self.mc_num / mc_block))):
+                converged = np.zeros(active.shape[0], dtype=bool)
+                for i in range(0, active.shape[0], batch_size):
+                    idx = active[i:i + batch_size]
+                    block = np.asarray(new.predict_on_batch(data_getter.input_d_checking(input_array,
+                                                                                         data_getter._pad_idx(idx))))
+                    block = block[:idx.shape[0]]
+                    if mean is None:
+                        mean = np.zeros((total_test_num, block.shape[1]))
+                        m2 = np.zeros((total_test_num, block.shape[1]))
+                    # merge mean and sum of squared difference of the block into the running ones
+                    count = mc_count[idx, np.newaxis]
+                    new_count = count + mc_block
+                    delta = block[:, :, 0] - mean[idx]
+                    new_mean = mean[idx] + delta * mc_block / new_count
+                    new_m2 = m2[idx] + block[:, :, 1] * mc_block + delta ** 2 * count * mc_block / new_count
+                    if mc_round > 0:
+                        new_std = np.sqrt(new_m2 / new_count)
+                        mean_stable = np.abs(new_mean - mean[idx]) <= mc_tol * new_std
+                        std_stable = np.abs(new_std - np.sqrt(m2[idx] / count)) <= mc_tol * new_std
+                        converged[i:i + batch_size] = np.all(mean_stable & std_stable, axis=1)
+                    mean[idx], m2[idx], mc_count[idx] = new_mean, new_m2, new_count[:, 0]
+                if pbar:
+                    pbar.update(np.sum(converged))
+                active = active[~converged]
+                if active.shape[0] == 0:
+                    break
+            if pbar:
+                pbar.update(active.shape[0])  # the rest reached maximum number of samples
+
+            self.inference_stats["traces"] += self._tracing_count(new) - tracing_count
+        tf.get_logger().setLevel(old_level)
+        self.inference_stats["predict_calls"] += 1
 
-            # final correction from variance to standard derivation
-            mc_dropout_uncertainty = np.sqrt(mc_dropout_uncertainty)
-            predictive_uncertainty = np.sqrt(predictions_var)
+        return np.stack([mean, m2 / mc_count[:, np.newaxis]], axis=-1), mc_count
 
-        elif self.task == 'classification':
-            # we want entropy for classification uncertainty
-            predicted_class = np.argmax(predictions, axis=1)
-            mc_dropout_uncertainty = np.ones_like(predicted_class, dtype=float)
-            predictive_uncertainty = np.ones_like(predicted_class, dtype=float)
-
-            # center variance
-            predictions_var -= 1.
-            for i in range(predicted_class.shape[0]):
-                all_prediction = np.array(predictions[i, :])
-                mc_dropout_uncertainty[i] = - np.sum(all_prediction * np.log(all_prediction))
-                predictive_uncertainty[i] = predictions_var[i, predicted_class[i]]
-
-            pred_uncertainty = mc_dropout_uncertainty + predictive_uncertainty
-            # We only want the predicted class back
-            predictions = predicted_class
+    def _mc_postprocess_layer(self, **kwargs):
+        """
+        Post-processing layer which turns mean and variance from Monte Carlo inference to de-normalized prediction and
+        uncertainty, used by both eager post-processing and fused Monte Carlo inference model
 
-        elif self.task == 'binary_classification':
-            # we want entropy for classification uncertainty, so need prediction in logits space
-            mc_dropout_uncertainty = - np.sum(predictions * np.log(predictions), axis=0)
-            # need to activate before round to int so that the prediction is always 0 or 1
-            predictions = np.rint(sigmoid(predictions))
-            predictive_uncertainty = predictions_var
-            pred_uncertainty = mc_dropout_uncertainty + predictions_var
+        :return: post-processing layer
+        :rtype: astroNN.nn.layers.FastMCInferencePostProcess
+        """
+        return FastMCInferencePostProcess(task=self.task,
+                                          labels_mean=self.labels_mean['output'],
+                                          labels_std=self.labels_std['output'],
+                                          **kwargs)
+
+    def _export_model(self, mc_num=None):
+        """
+        Monte Carlo inference model with fixed number of samples to be exported, see NeuralNetMaster.export()
+        """
+        # pfor strategy so the Monte Carlo loop is a single graph without while loop
+        return FastMCInference(self.mc_num if mc_num is None else mc_num, strategy="pfor",
+                               deterministic_prefix=self.mc_deterministic_prefix,
+                               seed=self.mc_seed)(self.keras_model_predict)
 
+    def _export_outputs(self, model, norm_inputs):
+        """
+        De-normalized prediction and uncertainty of the exported Monte Carlo inference model
+        """
+        result = model(norm_inputs, training=False)
+        result = tf.reshape(result, [-1, result.shape[-2], 2])
+        norm_func = self._export_norm_func(self.labels_normalizer, 'output', inverse=True)
+        if norm_func is not None:
+            # custom normalization always come with zero mean and unity standard derivation
+            half_first_dim = result.shape[1] // 2
+            result = tf.concat([tf.stack([norm_func(result[:, :half_first_dim, 0]),
+                                          result[:, :half_first_dim, 1]], axis=-1),
+                                result[:, half_first_dim:]], axis=1)
+        predictions, pred_uncertainty, mc_dropout_uncertainty, predictive_uncertainty = \
+            self._mc_postprocess_layer()(result)
+        return {'prediction': predictions, 'total': pred_uncertainty, 'model': mc_dropout_uncertainty,
+                'predictive': predictive_uncertainty}
+
+    def _custom_denorm_func(self):
+        if self.labels_normalizer is not None:
+            return self.labels_normalizer._custom_denorm_func
         else:
-            raise AttributeError('Unknown Task')
+            return None
+
+    def _mc_postprocess(self, result):
+        """
+        Turn mean and variance from Monte Carlo inference to de-normalized prediction and uncertainty
+
+        :param result: array with shape (number of data, 2 * number of outputs, 2) of mean and variance
+        :type result: ndarray
+        :return: prediction and prediction uncertainty
+        """
+        # post-processing in double precision as we used to do in numpy
+        result = np.array(result, dtype=np.float64)
+        if self._custom_denorm_func() is not None:
+            # custom normalization always come with zero mean and unity standard derivation
+            half_first_dim = result.shape[1] // 2
+            result[:, :half_first_dim, 0] = self._custom_denorm_func()(result[:, :half_first_dim, 0])
+        predictions, pred_uncertainty, mc_dropout_uncertainty, predictive_uncertainty = \
+            [i.numpy() for i in self._mc_postprocess_layer(dtype='float64')(result)]
 
         return predictions, {'total': pred_uncertainty, 'model': mc_dropout_uncertainty,
                              'predictive': predictive_uncertainty}
 
+    def _mc_inference(self, input_array, batch_size=None, pbar=None, mc_tol=None, mc_block=10):
+        """
+        Monte Carlo inference with fixed (mc_tol is None) or adaptive number of samples and post-processing
+        """
+        if mc_tol is not None and self.mc_seed is not None:
+            raise ValueError("Adaptive Monte Carlo inference (mc_tol) cannot be used with seeded inference (mc_seed)")
+        if mc_tol is None:
+            if self.mc_fused_postprocess and self._custom_denorm_func() is None:
+                predictions, pred_uncertainty, mc_dropout_uncertainty, predictive_uncertainty = \
+                    self._mc_predict(input_array, batch_size=batch_size, pbar=pbar, postprocess=True)
+                return predictions, {'total': pred_uncertainty, 'model': mc_dropout_uncertainty,
+                                     'predictive': predictive_uncertainty}
+            return self._mc_postprocess(self._mc_predict(input_array, batch_size=batch_size, pbar=pbar))
+        else:
+            result, mc_count = self._mc_predict_adaptive(input_array, batch_size=batch_size, pbar=pbar,
+                                                         mc_tol=mc_tol, mc_block=mc_block)
+            predictions, uncertainty = self._mc_postprocess(result)
+            uncertainty.update({'mc_num': mc_count})
+            return predictions, uncertainty
+
+    def predict(self, input_data, inputs_err=None, batch_size=None, mc_tol=None, mc_block=10, sample_index=None):
+        """
+        Test model, High performance version designed for fast variational inference on GPU
+
+        :param input_data: Data to be inferred with neural network
+        :type input_data: ndarray
+        :param inputs_err: Error for input_data, same shape with input_data.
+        :type inputs_err: Union([NoneType, ndarray])
+        :param batch_size: batch size, by default the batch size of the model
+        :type batch_size: Union([NoneType, int])
+        :param mc_tol: If None, draw mc_num Monte Carlo samples for every data. Otherwise samples are drawn in blocks
+            until mean and standard deviation of every data are stable within mc_tol relative to standard deviation
+            (or mc_num samples reached), number of samples used is returned as 'mc_num' in the uncertainty dictionary
+        :type mc_tol: Union([NoneType, float])
+        :param mc_block: Number of Monte Carlo samples in a block if mc_tol is not None
+        :type mc_block: int
+        :param sample_index: Global index of input_data in the whole catalog if mc_seed is set, so results of a subset
+            of the catalog are identical to those of the whole catalog. By default 0 to N-1
+        :type sample_index: Union([NoneType, ndarray])
+        :return: prediction and prediction uncertainty
+        :History:
+            | 2018-Jan-06 - Written - Henry Leung (University of Toronto)
+            | 2018-Apr-12 - Updated - Henry Leung (University of Toronto)
+        """
+        self.has_model_check()
+        self._mc_num_check()
+
+        input_array = self._prepare_predict_input(input_data, inputs_err, sample_index=sample_index)
+
+        # Data Generator for prediction
+        with tqdm(total=input_array['input'].shape[0], unit="sample") as pbar:
+            pbar.set_postfix({'Monte-Carlo': self.mc_num})
+            pbar.set_description_str("Prediction progress: ")
+            return self._mc_inference(input_array, batch_size=batch_size, pbar=pbar, mc_tol=mc_tol, mc_block=mc_block)
+
+    def predict_stream(self, input_data, inputs_err=None, chunk_size=None, batch_size=None, output=None,
+                       mc_tol=None, mc_block=10):
+        """
+        | Test model chunk by chunk so the memory usage is bounded by chunk size instead of the number of data,
+        | suitable for catalogs which do not fit in memory
+        |
+        | This method is a generator, prediction and uncertainty of a chunk is yielded once it is inferred.
+        | If ``output`` is provided, results are also written in place, in such case you can simply exhaust the
+        | generator by ``for _ in neuralnet.predict_stream(data, output=output): pass``
+
+        :param input_data: Data to be inferred with neural network. Either an array-like which will be read chunk by
+            chunk (e.g. ndarray, np.memmap or h5py dataset) or an iterator of ndarray or (input, inputs_err) tuple
+        :type input_data: Union([ndarray, np.memmap, h5py.Dataset, iterator])
+        :param inputs_err: Error for input_data, same shape with input_data, only used for array-like input_data
+        :type inputs_err: Union([NoneType, ndarray, np.memmap, h5py.Dataset])
+        :param chunk_size: Number of data to be read at once for array-like input_data, by default 100 batches
+        :type chunk_size: Union([NoneType, int])
+        :param batch_size: batch size, by default the batch size of the model
+        :type batch_size: Union([NoneType, int])
+        :param output: Preallocated arrays (e.g. np.memmap) to write results to, with keys in "prediction", "total",
+            "model", "predictive" (and "mc_num" if mc_tol is not None)
+        :type output: Union([NoneType, dict])
+        :param mc_tol: Tolerance of adaptive Monte Carlo inference, see predict()
+        :type mc_tol: Union([NoneType, float])
+        :param mc_block: Number of Monte Carlo samples in a block if mc_tol is not None
+        :type mc_block: int
+        :return: generator of prediction and prediction uncertainty of every chunk
+        """
+        self.has_model_check()
+        self._mc_num_check()
+
+        batch_size = self._inference_batch_size(batch_size)
+        if chunk_size is None:
+            chunk_size = 100 * batch_size
+        if output is None:
+            output = {}
+
+        if hasattr(input_data, "shape") and hasattr(input_data, "__getitem__"):
+            total_test_num = input_data.shape[0]
+
+            def chunks_iterator():
+                for i in range(0, total_test_num, chunk_size):
+                    # always make an in-memory copy, memmap or h5py dataset should not be modified
+                    chunk_err = None if inputs_err is None else np.array(inputs_err[i:i + chunk_size])
+                    yield np.array(input_data[i:i + chunk_size]), chunk_err
+        else:
+            total_test_num = None
+
+            def chunks_iterator():
+                for chunk in input_data:
+                    if isinstance(chunk, (tuple, list)):
+                        yield np.array(chunk[0]), None if chunk[1] is None else np.array(chunk[1])
+                    else:
+                        yield np.array(chunk), None
 
-    def predict_dataset(self, file):
+        start_idx = 0
+        with tqdm(total=total_test_num, unit="sample") as pbar:
+            pbar.set_postfix({'Monte-Carlo': self.mc_num})
+            pbar.set_description_str("Prediction progress: ")
+            for chunk, chunk_err in chunks_iterator():
+                input_array = self._prepare_predict_input(chunk, chunk_err,
+                                                          sample_index=np.arange(start_idx, start_idx + chunk.shape[0]))
+                predictions, uncertainty = self._mc_inference(input_array, batch_size=batch_size, pbar=pbar,
+                                                              mc_tol=mc_tol, mc_block=mc_block)
+                end_idx = start_idx + input_array['input'].shape[0]
+                if "prediction" in output:
+                    output["prediction"][start_idx:end_idx] = predictions
+                for name in uncertainty.keys():
+                    if name in output:
+                        output[name][start_idx:end_idx] = uncertainty[name]
+                start_idx = end_idx
+                yield predictions, uncertainty
+
+        for name in output.keys():
+            if isinstance(output[name], np.memmap):
+                output[name].flush()
+
+    def predict_dataset(self, file, batch_size=None):
+        """
+        Test model on a dataset (e.g. h5py dataset) which is normalized and read batch by batch
+
+        :param file: Data to be inferred with neural network
+        :type file: Union([ndarray, h5py.Dataset])
+        :param batch_size: batch size, by default the batch size of the model
+        :type batch_size: Union([NoneType, int])
+        :return: prediction and prediction uncertainty
+        """
         class BayesianCNNPredDataGeneratorV2(GeneratorMaster):
             def __init__(self, batch_size, shuffle, steps_per_epoch, manual_reset=False, pbar=None, nn_model=None):
                 super().__init__(batch_size=batch_size, shuffle=shuffle, steps_per_epoch=steps_per_epoch, data=None,
@@ -753,16 +1070,25 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
                 self.idx_list = self._get_exploration_order(range(len(file)))
                 self.current_idx = 0
                 self.nn_model = nn_model
+                self.file = FileBackedArray(file)
 
             def _data_generation(self, idx_list_temp):
                 # Generate data
-                inputs = self.nn_model.input_normalizer.normalize({"input": file[idx_list_temp], "input_err": np.zeros_like(file[idx_list_temp])}, calc=False)
+                # padded indices are not strictly increasing as h5py requires, FileBackedArray reads the unique rows
+                # and pads the batch in memory
+                data = self.file[idx_list_temp]
+                inputs = self.nn_model.input_normalizer.normalize({"input": data, "input_err": np.zeros_like(data)},
+                                                                  calc=False)
                 x = self.input_d_checking(inputs, np.arange(len(idx_list_temp)))
+                if self.nn_model.mc_seed is not None:
+                    x["sample_index"] = np.asarray(idx_list_temp, dtype=np.int64)
                 return x
 
             def __getitem__(self, index):
-                x = self._data_generation(self.idx_list[index * self.batch_size: (index + 1) * self.batch_size])
-                if self.pbar: self.pbar.update(self.batch_size)
+                idx_list_temp = self.idx_list[index * self.batch_size: (index + 1) * self.batch_size]
+                # pad the last batch so all batches have the same shape
+                x = self._data_generation(self._pad_idx(idx_list_temp))
+                if self.pbar: self.pbar.update(len(idx_list_temp))
                 return x
 
             def on_epoch_end(self):
@@ -770,28 +1096,17 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
                 self.idx_list = self._get_exploration_order(range(len(file)))
             
         self.has_model_check()
+        self._mc_num_check()
 
-        if gpu_availability() is False and self.mc_num > 25:
-            warnings.warn(f'You are using CPU version Tensorflow, doing {self.mc_num} times Monte Carlo Inference can '
-                          f'potentially be very slow! \n '
-                          f'A possible fix is to decrease the mc_num parameter of the model to do less MC Inference \n'
-                          f'This is just a warning, and will not shown if mc_num < 25 on CPU')
-            if self.mc_num < 2:
-                raise AttributeError("mc_num cannot be smaller than 2")
-        
         total_test_num = len(file)  # Number of testing data
 
-        # for number of training data smaller than batch_size
-        if total_test_num < self.batch_size:
-            batch_size = total_test_num
-        else:
-            batch_size = self.batch_size
-
-        # Due to the nature of how generator works, no overlapped prediction
-        data_gen_shape = (total_test_num // batch_size) * batch_size
-        remainder_shape = total_test_num - data_gen_shape  # Remainder from generator
+        # for number of training data smaller than batch_size, use a bucket of fixed size
+        # mean and variance of a batch of 1 data point have no batch dimension, so never use batch size of 1
+        batch_size = self._inference_batch_size(batch_size)
+        batch_size = self._bucket_batch_size(total_test_num, max(batch_size, 2))
+        steps = int(np.ceil(total_test_num / batch_size))
 
-        # Data Generator for prediction
+        # Data Generator for prediction, the last batch is padded so no graph is traced for the remainder
         with tqdm(total=total_test_num, unit="sample") as pbar:
             pbar.set_postfix({'Monte-Carlo': self.mc_num})
             # suppress pfor warning from TF
@@ -799,86 +1114,18 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
             tf.get_logger().setLevel('ERROR')
             prediction_generator = BayesianCNNPredDataGeneratorV2(batch_size=batch_size,
                                                                 shuffle=False,
-                                                                steps_per_epoch=data_gen_shape // batch_size,
+                                                                steps_per_epoch=steps,
                                                                 pbar=pbar, 
                                                                 nn_model=self)
 
-            new = FastMCInference(self.mc_num)(self.keras_model_predict)
-            
-            result = np.asarray(new.predict(prediction_generator))
-
-            if remainder_shape != 0:  # deal with remainder
-                remainder_generator = BayesianCNNPredDataGeneratorV2(batch_size=remainder_shape,
-                                                                    shuffle=False,
-                                                                    steps_per_epoch=1,
-                                                                    pbar=pbar, 
-                                                                    nn_model=self)
-                remainder_result = np.asarray(new.predict(remainder_generator))
-                if remainder_shape == 1:
-                    remainder_result = np.expand_dims(remainder_result, axis=0)
-                result = np.concatenate((result, remainder_result))
-                
-            tf.get_logger().setLevel(old_level)
-
-        # in case only 1 test data point, in such case we need to add a dimension
-        if result.ndim < 3 and batch_size == 1:
-            result = np.expand_dims(result, axis=0)
-
-        half_first_dim = result.shape[1] // 2  # result.shape[1] is guarantee an even number, otherwise sth is wrong
-
-        predictions = result[:, :half_first_dim, 0]  # mean prediction
-        mc_dropout_uncertainty = result[:, :half_first_dim, 1] * (self.labels_std['output'] ** 2)  # model uncertainty
-        predictions_var = np.exp(result[:, half_first_dim:, 0]) * (
-                self.labels_std['output'] ** 2)  # predictive uncertainty
-
-        if self.labels_normalizer is not None:
-            predictions = self.labels_normalizer.denormalize(
-                list_to_dict([self.keras_model.output_names[0]], predictions))
-            predictions = predictions['output']
-        else:
-            predictions *= self.labels_std['output']
-            predictions += self.labels_mean['output']
+            new = self._get_mc_model(batch_size=batch_size)
+            with self._predict_function_scope(new, batch_size):
+                result = np.asarray(self._prefetched_predict(new, prediction_generator))[:total_test_num]
 
-        if self.task == 'regression':
-            # Predictive variance
-            pred_var = predictions_var + mc_dropout_uncertainty  # epistemic plus aleatoric uncertainty
-            pred_uncertainty = np.sqrt(pred_var)  # Convert back to std error
-
-            # final correction from variance to standard derivation
-            mc_dropout_uncertainty = np.sqrt(mc_dropout_uncertainty)
-            predictive_uncertainty = np.sqrt(predictions_var)
-
-        elif self.task == 'classification':
-            # we want entropy for classification uncertainty
-            predicted_class = np.argmax(predictions, axis=1)
-            mc_dropout_uncertainty = np.ones_like(predicted_class, dtype=float)
-            predictive_uncertainty = np.ones_like(predicted_class, dtype=float)
-
-            # center variance
-            predictions_var -= 1.
-            for i in range(predicted_class.shape[0]):
-                all_prediction = np.array(predictions[i, :])
-                mc_dropout_uncertainty[i] = - np.sum(all_prediction * np.log(all_prediction))
-                predictive_uncertainty[i] = predictions_var[i, predicted_class[i]]
-
-            pred_uncertainty = mc_dropout_uncertainty + predictive_uncertainty
-            # We only want the predicted class back
-            predictions = predicted_class
-
-        elif self.task == 'binary_classification':
-            # we want entropy for classification uncertainty, so need prediction in logits space
-            mc_dropout_uncertainty = - np.sum(predictions * np.log(predictions), axis=0)
-            # need to activate before round to int so that the prediction is always 0 or 1
-            predictions = np.rint(sigmoid(predictions))
-            predictive_uncertainty = predictions_var
-            pred_uncertainty = mc_dropout_uncertainty + predictions_var
+            tf.get_logger().setLevel(old_level)
 
-        else:
-            raise AttributeError('Unknown Task')
+        return self._mc_postprocess(result)
 
-        return predictions, {'total': pred_uncertainty, 'model': mc_dropout_uncertainty,
-                             'predictive': predictive_uncertainty}
-        
     def evaluate(self, input_data, labels, inputs_err=None, labels_err=None, batch_size=None):
         """
         Evaluate neural network by provided input data and labels and get back a metrics score
@@ -891,6 +1138,8 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         :type inputs_err: Union([NoneType, ndarray])
         :param labels_err: Labels error (if any)
         :type labels_err: Union([NoneType, ndarray])
+        :param batch_size: batch size, by default the batch size of the model
+        :type batch_size: Union([NoneType, int])
         :return: metrics score dictionary
         :rtype: dict
         :History: 2018-May-20 - Written - Henry Leung (University of Toronto)
@@ -930,10 +1179,9 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         norm_labels.update({"variance_output": norm_labels["output"]})
 
         total_num = input_data['input'].shape[0]
-        if batch_size is None:
-            batch_size = self.batch_size
+        batch_size = self._inference_batch_size(batch_size)
+        steps = total_num // batch_size if total_num > batch_size else 1
         batch_size = np.min([total_num, batch_size])
-        steps = total_num // self.batch_size if total_num > self.batch_size else 1
 
         start_time = time.time()
         print("Starting Evaluation")
@@ -14,6 +14,7 @@ from astroNN.nn.losses import categorical_crossentropy, binary_crossentropy
 from astroNN.nn.losses import mean_squared_error, mean_absolute_error, mean_error
 from astroNN.nn.metrics import categorical_accuracy, binary_accuracy
 from astroNN.nn.utilities import Normalizer
+from astroNN.nn.utilities.file_backed import take_rows
 from astroNN.nn.utilities.generator import GeneratorMaster
 from astroNN.shared.dict_tools import dict_np_to_dict_list, list_to_dict
 from astroNN.shared.warnings import deprecated, deprecated_copy_signature
@@ -64,12 +65,20 @@ class CNNDataGenerator(GeneratorMaster):
             return x, y
 
     def __getitem__(self, index):
-        return self._data_generation(self.idx_list[index * self.batch_size: (index + 1) * self.batch_size])
+        return self._augment(self._data_generation(self.idx_list[index * self.batch_size:
+                                                                 (index + 1) * self.batch_size]))
 
     def on_epoch_end(self):
         # shuffle the list when epoch ends for the next epoch
         self.idx_list = self._get_exploration_order(range(self.inputs['input'].shape[0]))
 
+    def _dataset_elements(self):
+        x = self._channel_view(self.inputs)
+        if self.sample_weight is not None:
+            return x, dict(self.labels), self.sample_weight
+        else:
+            return x, dict(self.labels)
+
 
 class CNNPredDataGenerator(GeneratorMaster):
     """
@@ -106,9 +115,11 @@ class CNNPredDataGenerator(GeneratorMaster):
         return x
 
     def __getitem__(self, index):
-        x = self._data_generation(self.idx_list[index * self.batch_size: (index + 1) * self.batch_size])
+        idx_list_temp = self.idx_list[index * self.batch_size: (index + 1) * self.batch_size]
+        # pad the last batch so all batches have the same shape
+        x = self._data_generation(self._pad_idx(idx_list_temp))
         if self.pbar and index > self.current_idx: 
-            self.pbar.update(self.batch_size)
+            self.pbar.update(len(idx_list_temp))
         self.current_idx = index
         return x
 
@@ -185,7 +196,8 @@ class CNNBase(NeuralNetMaster, ABC):
         else:
             raise RuntimeError('Only "regression", "classification" and "binary_classification" are supported')
 
-        self.keras_model = self.model()
+        with self._precision_scope(), self._strategy_scope():
+            self.keras_model = self.model()
 
         self.keras_model.compile(loss=loss_func,
                                  optimizer=self.optimizer,
@@ -240,13 +252,13 @@ class CNNBase(NeuralNetMaster, ABC):
         if self.input_normalizer is None:
             self.input_normalizer = Normalizer(mode=self.input_norm_mode, verbose=self.verbose)
             self.labels_normalizer = Normalizer(mode=self.labels_norm_mode, verbose=self.verbose)
-            norm_data = self.input_normalizer.normalize(input_data)
+            norm_data = self._normalize_data(self.input_normalizer, input_data)
             self.input_mean, self.input_std = self.input_normalizer.mean_labels, self.input_normalizer.std_labels
-            norm_labels = self.labels_normalizer.normalize(labels)
+            norm_labels = self._normalize_data(self.labels_normalizer, labels)
             self.labels_mean, self.labels_std = self.labels_normalizer.mean_labels, self.labels_normalizer.std_labels
         else:
-            norm_data = self.input_normalizer.normalize(input_data, calc=False)
-            norm_labels = self.labels_normalizer.normalize(labels, calc=False)
+            norm_data = self._normalize_data(self.input_normalizer, input_data, calc=False)
+            norm_labels = self._normalize_data(self.labels_normalizer, labels, calc=False)
         if self.keras_model is None:  # only compile if there is no keras_model, e.g. fine-tuning does not required
             self.compile()
         
@@ -260,21 +272,23 @@ class CNNBase(NeuralNetMaster, ABC):
             self.train_idx = np.arange(self.num_train + self.val_num)
             # just dummy, to minimize modification needed
             self.val_idx = np.arange(self.num_train + self.val_num)[:2]
+        # in storage order so file-backed data are read mostly sequentially
+        self.train_idx, self.val_idx = np.sort(self.train_idx), np.sort(self.val_idx)
 
         norm_data_training = {}
         norm_data_val = {}
         norm_labels_training = {}
         norm_labels_val = {}
         for name in norm_data.keys():
-            norm_data_training.update({name: norm_data[name][self.train_idx]})
-            norm_data_val.update({name: norm_data[name][self.val_idx]})
+            norm_data_training.update({name: take_rows(norm_data[name], self.train_idx)})
+            norm_data_val.update({name: take_rows(norm_data[name], self.val_idx)})
         for name in norm_labels.keys():
-            norm_labels_training.update({name: norm_labels[name][self.train_idx]})
-            norm_labels_val.update({name: norm_labels[name][self.val_idx]})
+            norm_labels_training.update({name: take_rows(norm_labels[name], self.train_idx)})
+            norm_labels_val.update({name: take_rows(norm_labels[name], self.val_idx)})
 
         if sample_weight is not None:        
-            sample_weight_training = sample_weight[self.train_idx]
-            sample_weight_val = sample_weight[self.val_idx]
+            sample_weight_training = take_rows(sample_weight, self.train_idx)
+            sample_weight_val = take_rows(sample_weight, self.val_idx)
         else:
             sample_weight_training = None
             sample_weight_val = None
@@ -303,10 +317,11 @@ class CNNBase(NeuralNetMaster, ABC):
         """
         Train a Convolutional neural network
 
-        :param input_data: Data to be trained with neural network
-        :type input_data: ndarray
+        :param input_data: Data to be trained with neural network, file-backed data (h5py dataset, numpy memmap or
+            FileBackedArray) are read lazily batch by batch
+        :type input_data: Union([ndarray, h5py.Dataset, numpy.memmap, FileBackedArray])
         :param labels: Labels to be trained with neural network
-        :type labels: ndarray
+        :type labels: Union([ndarray, h5py.Dataset, numpy.memmap, FileBackedArray])
         :param sample_weight: Sample weights (if any)
         :type sample_weight: Union([NoneType, ndarray])
         :return: None
@@ -336,12 +351,17 @@ class CNNBase(NeuralNetMaster, ABC):
 
         start_time = time.time()
 
-        self.history = self.keras_model.fit(x=self.training_generator,
-                                            validation_data=self.validation_generator,
-                                            epochs=self.max_epochs, verbose=self.verbose,
-                                            workers=os.cpu_count(),
-                                            callbacks=self.__callbacks,
-                                            use_multiprocessing=MULTIPROCESS_FLAG)
+        training_data, validation_data = self._fit_data()
+
+        try:
+            self.history = self.keras_model.fit(x=training_data,
+                                                validation_data=validation_data,
+                                                epochs=self.max_epochs, verbose=self.verbose,
+                                                workers=os.cpu_count(),
+                                                callbacks=self.__callbacks,
+                                                use_multiprocessing=MULTIPROCESS_FLAG)
+        finally:
+            self._release_fit_data()
 
         print(f'Completed Training, {(time.time() - start_time):.{2}f}s in total')
 
@@ -351,9 +371,9 @@ class CNNBase(NeuralNetMaster, ABC):
 
         return None
 
-    def fit_on_batch(self, input_data, labels, sample_weight=None):
+    def _on_batch_generator(self, input_data, labels, sample_weight=None):
         """
-        Train a neural network by running a single gradient update on all of your data, suitable for fine-tuning
+        Data generator of a single batch of all normalized data for fit_on_batch()
 
         :param input_data: Data to be trained with neural network
         :type input_data: ndarray
@@ -361,11 +381,9 @@ class CNNBase(NeuralNetMaster, ABC):
         :type labels: ndarray
         :param sample_weight: Sample weights (if any)
         :type sample_weight: Union([NoneType, ndarray])
-        :return: None
-        :rtype: NoneType
-        :History: 2018-Aug-22 - Written - Henry Leung (University of Toronto)
+        :return: data generator
+        :rtype: CNNDataGenerator
         """
-
         input_data, labels = self.pre_training_checklist_master(input_data, labels)
 
         # check if exists (existing means the model has already been trained (e.g. fine-tuning),
@@ -382,13 +400,28 @@ class CNNBase(NeuralNetMaster, ABC):
             norm_data = self.input_normalizer.normalize(input_data, calc=False)
             norm_labels = self.labels_normalizer.normalize(labels, calc=False)
 
-        start_time = time.time()
+        return CNNDataGenerator(batch_size=input_data['input'].shape[0],
+                                shuffle=False,
+                                steps_per_epoch=1,
+                                data=[norm_data, norm_labels], 
+                                sample_weight=sample_weight)
+
+    def fit_on_batch(self, input_data, labels, sample_weight=None):
+        """
+        Train a neural network by running a single gradient update on all of your data, suitable for fine-tuning
 
-        fit_generator = CNNDataGenerator(batch_size=input_data['input'].shape[0],
-                                         shuffle=False,
-                                         steps_per_epoch=1,
-                                         data=[norm_data, norm_labels], 
-                                         sample_weight=sample_weight)
+        :param input_data: Data to be trained with neural network
+        :type input_data: ndarray
+        :param labels: Labels to be trained with neural network
+        :type labels: ndarray
+        :param sample_weight: Sample weights (if any)
+        :type sample_weight: Union([NoneType, ndarray])
+        :return: None
+        :rtype: NoneType
+        :History: 2018-Aug-22 - Written - Henry Leung (University of Toronto)
+        """
+        fit_generator = self._on_batch_generator(input_data, labels, sample_weight)
+        start_time = time.time()
 
         scores = self.keras_model.fit(x=fit_generator,
                                       epochs=1,
@@ -432,17 +465,21 @@ class CNNBase(NeuralNetMaster, ABC):
                 'labels_norm_mode': self.labels_normalizer.normalization_mode,
                 'input_names': self.input_names,
                 'output_names': self.output_names,
-                'batch_size': self.batch_size}
+                'batch_size': self.batch_size,
+                'predict_batch_size': self.predict_batch_size,
+                'precision': self.precision}
 
         with open(self.fullfilepath + '/astroNN_model_parameter.json', 'w') as f:
             json.dump(data, f, indent=4, sort_keys=True)
 
-    def predict(self, input_data):
+    def predict(self, input_data, batch_size=None):
         """
         Use the neural network to do inference
 
         :param input_data: Data to be inferred with neural network
         :type input_data: ndarray
+        :param batch_size: batch size, by default the batch size of the model
+        :type batch_size: Union([NoneType, int])
         :return: prediction and prediction uncertainty
         :rtype: ndarry
         :History: 2017-Dec-06 - Written - Henry Leung (University of Toronto)
@@ -453,43 +490,16 @@ class CNNBase(NeuralNetMaster, ABC):
         input_array = self.input_normalizer.normalize(input_data, calc=False)
         total_test_num = input_data['input'].shape[0]  # Number of testing data
 
-        # for number of training data smaller than batch_size
-        if total_test_num < self.batch_size:
-            self.batch_size = total_test_num
-
-        # Due to the nature of how generator works, no overlapped prediction
-        data_gen_shape = (total_test_num // self.batch_size) * self.batch_size
-        remainder_shape = total_test_num - data_gen_shape  # Remainder from generator
-
         # TODO: named output????
         predictions = np.zeros((total_test_num, self._labels_shape['output']))
 
-        norm_data_main = {}
-        norm_data_remainder = {}
-        for name in input_array.keys():
-            norm_data_main.update({name: input_array[name][:data_gen_shape]})
-            norm_data_remainder.update({name: input_array[name][data_gen_shape:]})
-            
-        norm_data_main = self._tensor_dict_sanitize(norm_data_main, self.keras_model.input_names)
-        norm_data_remainder = self._tensor_dict_sanitize(norm_data_remainder, self.keras_model.input_names)
+        input_array = self._tensor_dict_sanitize(input_array, self.keras_model.input_names)
 
-        # Data Generator for prediction
+        # Data Generator for prediction, the last batch is padded so no graph is traced for the remainder
         with tqdm(total=total_test_num, unit="sample") as pbar:
             pbar.set_description_str("Prediction progress: ")
-            prediction_generator = CNNPredDataGenerator(batch_size=self.batch_size,
-                                                        shuffle=False,
-                                                        steps_per_epoch=total_test_num // self.batch_size,
-                                                        data=[norm_data_main],
-                                                        pbar=pbar)
-            predictions[:data_gen_shape] = np.asarray(self.keras_model.predict(prediction_generator, verbose=0))
-
-            if remainder_shape != 0:
-                remainder_generator = CNNPredDataGenerator(batch_size=remainder_shape,
-                                                           shuffle=False,
-                                                           steps_per_epoch=1,
-                                                           data=[norm_data_remainder])
-                pbar.update(remainder_shape)
-                predictions[data_gen_shape:] = np.asarray(self.keras_model.predict(remainder_generator, verbose=0))
+            predictions[:] = self._bucketed_predict(self.keras_model, CNNPredDataGenerator, input_array,
+                                                    self._inference_batch_size(batch_size), pbar=pbar)
 
         if self.labels_normalizer is not None:
             predictions = self.labels_normalizer.denormalize(list_to_dict(self.keras_model.output_names, predictions))
@@ -499,7 +509,7 @@ class CNNBase(NeuralNetMaster, ABC):
 
         return predictions['output']
 
-    def evaluate(self, input_data, labels):
+    def evaluate(self, input_data, labels, batch_size=None):
         """
         Evaluate neural network by provided input data and labels and get back a metrics score
 
@@ -507,6 +517,8 @@ class CNNBase(NeuralNetMaster, ABC):
         :type input_data: ndarray
         :param labels: labels
         :type labels: ndarray
+        :param batch_size: batch size, by default the batch size of the model
+        :type batch_size: Union([NoneType, int])
         :return: metrics score dictionary
         :rtype: dict
         :History: 2018-May-20 - Written - Henry Leung (University of Toronto)
@@ -532,8 +544,9 @@ class CNNBase(NeuralNetMaster, ABC):
         norm_labels = self._tensor_dict_sanitize(norm_labels, self.keras_model.output_names)
 
         total_num = input_data['input'].shape[0]
-        eval_batchsize = self.batch_size if total_num > self.batch_size else total_num
-        steps = total_num // self.batch_size if total_num > self.batch_size else 1
+        batch_size = self._inference_batch_size(batch_size)
+        eval_batchsize = batch_size if total_num > batch_size else total_num
+        steps = total_num // batch_size if total_num > batch_size else 1
 
         start_time = time.time()
         print("Starting Evaluation")
@@ -2,11 +2,15 @@
 #   base_master_nn.py: top-level class for a neural network
 ###############################################################################
 from distutils.log import warn
+import json
 import os
 import sys
+import tempfile
 import time
 import warnings
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
 
 import numpy as np
 import pylab as plt
@@ -18,13 +22,44 @@ from packaging import version
 import astroNN
 from astroNN.config import _astroNN_MODEL_NAME
 from astroNN.config import cpu_gpu_check
+from astroNN.config import MAGIC_NUMBER, MULTIPROCESS_FLAG
 from astroNN.shared.warnings import deprecated
 from astroNN.shared.nn_tools import folder_runnum
 from astroNN.shared.dict_tools import dict_np_to_dict_list, list_to_dict
+from astroNN.nn.numpy import sigmoid, sigmoid_inv
+from astroNN.nn.utilities.file_backed import FileBackedArray, is_file_backed
+from astroNN.nn.utilities.generator import ChunkShuffleSampler, GeneratorPrefetcher
+from astroNN.nn.utilities.norm_cache import NormalizationCache
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 epsilon, plot_model = tfk.backend.epsilon, tfk.utils.plot_model
 
 
+def _physical_memory():
+    """
+    Physical memory of the machine in bytes, None if unknown
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _peak_memory():
+    """
+    Peak resident memory of the process in bytes, 0 if unknown
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # in bytes on macOS, in kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
 class NeuralNetMaster(ABC):
     """
     Top-level class for an astroNN neural network
@@ -42,6 +77,26 @@ class NeuralNetMaster(ABC):
     :ivar fullfilepath: Full file path
     :ivar batch_size: Batch size for training, by default 64
     :ivar autosave: Boolean to flag whether autosave model or not
+    :ivar precision: Keras dtype policy of the model, "float32" (default), "mixed_float16" or "mixed_bfloat16" to
+        compute in float16 or bfloat16 with float32 variables
+    :ivar data_pipeline: Training data pipeline, "generator" (default) for Keras ``Sequence`` data generator or
+        "tf.data" for tf.data pipeline with element-level shuffling, optional caching, parallel map and prefetch.
+        File-backed training data are still read batch by batch by the data generator with "tf.data"
+    :ivar data_cache: tf.data pipeline only, None (default) to not cache, "memory" or a filename to cache on disk
+    :ivar data_shuffle_buffer: tf.data pipeline only, size of shuffle buffer, by default all training data
+    :ivar data_augmentation: tf.data pipeline only, function applied to every training batch in parallel, takes and
+        returns (inputs, labels) or (inputs, labels, sample weight) in the same structure as the data generator
+    :ivar data_shuffle_pool: Data generator with file-backed data only, number of storage chunks kept in memory and
+        shuffled together (see ``ChunkShuffleSampler``) so reading is mostly sequential, None (default) for fully
+        random shuffling
+    :ivar data_chunk_size: Number of rows of a storage chunk for ``data_shuffle_pool``, by default the HDF5 chunk size
+        of chunked h5py dataset, otherwise about 4MB of rows
+    :ivar data_shared_memory: Data generator only, whether to copy in-memory training and validation data into shared
+        memory so worker processes attach to them by name instead of getting their own copies, by default True if
+        multiprocessing is enabled (``MULTIPROCESS_FLAG`` in astroNN configuration). Shared memory is released when
+        fit() returns
+    :ivar norm_cache: On-disk cache of normalized training data with fitted mean and std, True for the default
+        ``NormalizationCache`` under astroNN cache folder or a ``NormalizationCache``, None (default) to not cache
 
     :ivar task: Task
     :ivar lr: Learning rate
@@ -56,6 +111,12 @@ class NeuralNetMaster(ABC):
 
     :ivar targetname: Full name for every output neurones
 
+    :ivar predict_batch_size: Batch size for inference, by default the same as batch_size (see tune_batch_size())
+    :ivar predict_prefetch: Number of batches prepared ahead in a background thread during inference, 0 to disable
+    :ivar inference_stats: Counters of inference model cache hits/misses, inference calls and retracing of predict
+        functions (traces per call is traces / predict_calls), and seconds spent on waiting for data and on
+        computation during inference (data_wait_time and compute_time)
+
     :History:
         | 2017-Dec-23 - Written - Henry Leung (University of Toronto)
         | 2018-Jan-05 - Updated - Henry Leung (University of Toronto)
@@ -75,6 +136,16 @@ class NeuralNetMaster(ABC):
         self.fullfilepath = None
         self.batch_size = 64
         self.autosave = False
+        self.precision = "float32"
+        self.strategy = None
+        self.data_pipeline = "generator"
+        self.data_cache = None
+        self.data_shuffle_buffer = None
+        self.data_augmentation = None
+        self.data_shuffle_pool = None
+        self.data_chunk_size = None
+        self.data_shared_memory = None
+        self.norm_cache = None
 
         # Hyperparameter
         self.task = None
@@ -125,6 +196,15 @@ class NeuralNetMaster(ABC):
         self.virtual_cvslogger = None
         self.hyper_txt = None
 
+        # counters to monitor inference overhead
+        self.predict_batch_size = None
+        self.predict_prefetch = 2
+        self.inference_stats = {"cache_hits": 0, "cache_misses": 0, "traces": 0, "predict_calls": 0,
+                                "data_wait_time": 0., "compute_time": 0.}
+        # compiled predict functions of recently used (keras model, batch size)
+        self._predict_function_cache = OrderedDict()
+        self._predict_function_cache_size = 8
+
         cpu_gpu_check()
 
     def __str__(self):
@@ -194,6 +274,325 @@ class NeuralNetMaster(ABC):
         return tensor_dict
 
 
+    @contextmanager
+    def _precision_scope(self):
+        """
+        Context in which Keras models are built with the dtype policy of ``precision``
+        """
+        if self.precision not in ["float32", "mixed_float16", "mixed_bfloat16"]:
+            raise ValueError(f"Unknown precision {self.precision}, only 'float32', 'mixed_float16' and "
+                             f"'mixed_bfloat16' are supported")
+        old_policy = tfk.mixed_precision.global_policy()
+        tfk.mixed_precision.set_global_policy(self.precision)
+        try:
+            yield
+        finally:
+            tfk.mixed_precision.set_global_policy(old_policy)
+
+    @contextmanager
+    def _strategy_scope(self):
+        """
+        Context in which Keras models are built under the distribution strategy ``strategy`` (if any)
+        """
+        if self.strategy is None:
+            yield
+        else:
+            with self.strategy.scope():
+                yield
+
+    def _worker_shard(self):
+        """
+        Number of workers and index of this worker of multi-worker distribution strategy, (1, 0) otherwise
+
+        :return: number of workers and index of this worker
+        :rtype: tuple
+        """
+        cluster_resolver = getattr(self.strategy, "cluster_resolver", None)
+        if cluster_resolver is None or not cluster_resolver.cluster_spec().as_dict():
+            return 1, 0
+        return cluster_resolver.cluster_spec().num_tasks("worker"), cluster_resolver.task_id
+
+    def _normalize_data(self, normalizer, data, calc=True):
+        """
+        | Normalize a dictionary of data for training
+        |
+        | If any of data are file-backed (h5py dataset, numpy memmap or FileBackedArray), mean and std are fitted in a
+        | streaming pass and file-backed data are normalized batch by batch when read, so they are never loaded into
+        | memory as a whole. Otherwise if ``norm_cache`` is set (True for the default ``NormalizationCache``), normalized
+        | data with mean and std are loaded from the on-disk cache if the same data have been normalized before.
+
+        :param normalizer: normalizer
+        :type normalizer: Normalizer
+        :param data: dictionary of data
+        :type data: dict
+        :param calc: Whether to fit mean and std
+        :type calc: bool
+        :return: dictionary of normalized data
+        :rtype: dict
+        """
+        if any(is_file_backed(data[name]) for name in data.keys()):
+            return normalizer.normalize_lazy(data, calc=calc)
+        elif self.norm_cache is not None and self.norm_cache is not False:
+            if self.norm_cache is True:
+                self.norm_cache = NormalizationCache()
+            return self.norm_cache.normalize(normalizer, data, calc=calc)
+        else:
+            return normalizer.normalize(data, calc=calc)
+
+    def _fit_data(self):
+        """
+        Training and validation data for keras fit() from the data generators according to ``data_pipeline``
+
+        | With multi-worker distribution strategy (e.g. ``tf.distribute.MultiWorkerMirroredStrategy``), every worker only
+        | reads its own shard of data through the generators with a batch size of ``batch_size`` divided by the number
+        | of workers, so the global batch size stays the same and gradients are all-reduced across workers.
+
+        :return: training data and validation data (None if no validation)
+        :rtype: tuple
+        """
+        num_workers, worker_index = self._worker_shard()
+        if num_workers > 1:
+            worker_batch_size = max(self.batch_size // num_workers, 1)
+            for generator in [self.training_generator, self.validation_generator]:
+                if generator is not None:
+                    generator.shard(num_workers, worker_index, batch_size=worker_batch_size)
+            if self.data_pipeline == "generator":
+                # Keras would shard batches of a generator again across workers, so feed them as sharded datasets
+                return self._generator_datasets()
+
+        file_backed = any(is_file_backed(data) for data_dict in self.training_generator.data[:2]
+                          if isinstance(data_dict, dict) for data in data_dict.values())
+        if self.data_pipeline == "tf.data" and file_backed:
+            # element-level tf.data pipeline would read all file-backed data into memory, so batches are still read by
+            # the data generator
+            if self.data_cache is not None or self.data_shuffle_buffer is not None:
+                warnings.warn("data_cache and data_shuffle_buffer are ignored because training data are file-backed")
+            return self._generator_datasets(map_func=self.data_augmentation)
+
+        if self.data_pipeline == "generator":
+            if self.data_shuffle_pool is not None:
+                self._chunk_aware_shuffle(self.training_generator)
+            if self.data_shared_memory or (self.data_shared_memory is None and MULTIPROCESS_FLAG):
+                for generator in [self.training_generator, self.validation_generator]:
+                    if generator is not None:
+                        generator.to_shared_memory()
+            return self.training_generator, self.validation_generator
+        elif self.data_pipeline == "tf.data":
+            training_data = self.training_generator.as_dataset(shuffle_buffer=self.data_shuffle_buffer,
+                                                               cache=self.data_cache,
+                                                               map_func=self.data_augmentation)
+            if self.validation_generator is not None:
+                # validation data are neither shuffled nor augmented, cache only in memory to not clash with
+                # the cache file of training data
+                validation_data = self.validation_generator.as_dataset(
+                    shuffle=False, cache=None if self.data_cache is None else "memory")
+            else:
+                validation_data = None
+            return training_data, validation_data
+        else:
+            raise ValueError(f"Unknown data_pipeline {self.data_pipeline}, only 'generator' and 'tf.data' are "
+                             f"supported")
+
+    def _generator_datasets(self, map_func=None):
+        """
+        Training and validation data as tf.data datasets which yield batches of the data generators
+
+        :param map_func: Function applied to every training batch in parallel (e.g. augmentation)
+        :type map_func: Union([NoneType, callable])
+        :return: training data and validation data (None if no validation)
+        :rtype: tuple
+        """
+        if self.data_shuffle_pool is not None:
+            self._chunk_aware_shuffle(self.training_generator)
+        training_data = self.training_generator.as_generator_dataset()
+        if map_func is not None:
+            training_data = training_data.map(lambda *batch: map_func(*batch), num_parallel_calls=tf.data.AUTOTUNE)
+        validation_data = None
+        if self.validation_generator is not None:
+            validation_data = self.validation_generator.as_generator_dataset()
+        return training_data, validation_data
+
+    def _release_fit_data(self):
+        """
+        Release shared memory of training and validation data created by _fit_data() (if any) once training is done,
+        so repeated fit() do not accumulate shared memory blocks
+        """
+        for generator in [self.training_generator, self.validation_generator]:
+            if generator is not None:
+                generator.release_shared_memory()
+
+    def _chunk_aware_shuffle(self, generator):
+        """
+        Set up chunk-aware shuffling and in-memory chunk pools for file-backed data of a data generator
+
+        :param generator: data generator
+        :type generator: GeneratorMaster
+        """
+        inputs, labels = generator.data[0], generator.data[1]
+        reference = inputs["input"]
+        if not isinstance(reference, FileBackedArray):
+            warnings.warn("data_shuffle_pool is ignored because training data are not file-backed")
+            return None
+        chunk_size = reference.default_chunk_size() if self.data_chunk_size is None else self.data_chunk_size
+        for data in list(inputs.values()) + list(labels.values()):
+            # other data of the same data points (e.g. input_err) usually share the same chunk layout
+            if isinstance(data, FileBackedArray):
+                data.set_chunk_pool(chunk_size=chunk_size, pool_size=self.data_shuffle_pool)
+        generator.sampler = ChunkShuffleSampler(reference.storage_rows, chunk_size, pool_size=self.data_shuffle_pool)
+        generator.on_epoch_end()  # exploration order of the first epoch with the sampler
+
+    def data_read_stats(self):
+        """
+        Read throughput of file-backed training and validation data, for tuning ``data_shuffle_pool``
+
+        :return: dictionary of read statistics (rows, bytes, seconds spent on reading, chunks read, rows and megabytes
+            per second) of every file-backed data
+        :rtype: dict
+        """
+        stats = {}
+        for prefix, generator in [("training", self.training_generator), ("validation", self.validation_generator)]:
+            if generator is None:
+                continue
+            for data_dict in generator.data[:2]:
+                for name, data in data_dict.items():
+                    if isinstance(data, FileBackedArray):
+                        stats.update({f"{prefix}_{name}": data.read_throughput()})
+        return stats
+
+    @staticmethod
+    def _tracing_count(keras_model):
+        """
+        Number of times the predict function of a keras model has been traced
+
+        :param keras_model: Keras model
+        :type keras_model: keras.Model
+        :return: number of tracing, 0 if the predict function has not been created or is not a tf.function
+        :rtype: int
+        """
+        try:
+            return keras_model.predict_function.experimental_get_tracing_count()
+        except AttributeError:
+            return 0
+
+    def _prefetched_predict(self, keras_model, generator):
+        """
+        Keras predict over batches of a generator which are prepared ahead in a background thread, with number of
+        tracing, time spent on waiting for data and on computation recorded in inference_stats
+
+        :param keras_model: Keras model
+        :type keras_model: keras.Model
+        :param generator: astroNN data generator
+        :type generator: GeneratorMaster
+        :return: outputs of keras_model
+        :rtype: Union([ndarray, list])
+        """
+        prefetcher = GeneratorPrefetcher(generator, prefetch=self.predict_prefetch)
+        tracing_count = self._tracing_count(keras_model)
+        start_time = time.perf_counter()
+        result = keras_model.predict(iter(prefetcher), steps=len(prefetcher), verbose=0)
+        elapsed_time = time.perf_counter() - start_time
+        self.inference_stats["traces"] += self._tracing_count(keras_model) - tracing_count
+        self.inference_stats["predict_calls"] += 1
+        self.inference_stats["data_wait_time"] += prefetcher.data_wait_time
+        self.inference_stats["compute_time"] += elapsed_time - prefetcher.data_wait_time
+        return result
+
+    @contextmanager
+    def _predict_function_scope(self, keras_model, batch_size):
+        """
+        | Context in which keras_model uses its compiled predict function for batch_size
+        |
+        | Keras keeps only one predict function per model which has to be retraced (or relaxed to unknown shape) when
+        | batch shape changes, so predict functions are kept in a small LRU cache keyed on keras model and batch size
+        | to keep alternating batch sizes fast.
+
+        :param keras_model: Keras model
+        :type keras_model: keras.Model
+        :param batch_size: Batch size
+        :type batch_size: int
+        """
+        key = (id(keras_model), batch_size)
+        cached = self._predict_function_cache.pop(key, None)
+        # make sure the id is not reused by another keras model
+        keras_model.predict_function = cached[1] if cached is not None and cached[0] is keras_model else None
+        try:
+            yield
+        finally:
+            if keras_model.predict_function is not None:
+                self._predict_function_cache[key] = (keras_model, keras_model.predict_function)
+                while len(self._predict_function_cache) > self._predict_function_cache_size:
+                    self._predict_function_cache.popitem(last=False)
+
+    def _inference_batch_size(self, batch_size=None):
+        """
+        Batch size for inference, the given one or predict_batch_size or batch_size of the model in this order
+
+        :param batch_size: Batch size given to inference
+        :type batch_size: Union([NoneType, int])
+        :return: Batch size
+        :rtype: int
+        """
+        if batch_size is not None:
+            return batch_size
+        return self.batch_size if self.predict_batch_size is None else self.predict_batch_size
+
+    @staticmethod
+    def _bucket_batch_size(total_num, batch_size):
+        """
+        Batch size of the shape bucket for inference, which is batch_size unless there are fewer data than batch_size,
+        in such case the smallest power of two (at least 2) not fewer than the number of data
+
+        :param total_num: Number of data
+        :type total_num: int
+        :param batch_size: Batch size
+        :type batch_size: int
+        :return: Batch size of the bucket
+        :rtype: int
+        """
+        if total_num >= batch_size:
+            return batch_size
+        bucket_size = 2
+        while bucket_size < total_num:
+            bucket_size *= 2
+        return min(bucket_size, batch_size)
+
+    def _bucketed_predict(self, keras_model, generator_class, input_array, batch_size, pbar=None):
+        """
+        | Run inference with a single Keras predict call over batches of the same shape
+        |
+        | The last batch is padded up to the bucket size by the generator and outputs of the padding are trimmed, so no
+        | extra graph is traced for the remainder of the data. Batches are prepared ahead in a background thread to
+        | overlap with computation. Number of tracing and time spent are recorded in inference_stats.
+
+        :param keras_model: Keras model
+        :type keras_model: keras.Model
+        :param generator_class: Prediction data generator class which pads the last batch
+        :type generator_class: type
+        :param input_array: dictionary of normalized input data
+        :type input_array: dict
+        :param batch_size: Batch size
+        :type batch_size: int
+        :param pbar: tqdm progress bar
+        :type pbar: obj
+        :return: outputs of keras_model
+        :rtype: Union([ndarray, list])
+        """
+        total_num = input_array[list(input_array.keys())[0]].shape[0]
+        batch_size = self._bucket_batch_size(total_num, batch_size)
+        generator = generator_class(batch_size=batch_size,
+                                    shuffle=False,
+                                    steps_per_epoch=int(np.ceil(total_num / batch_size)),
+                                    data=[input_array],
+                                    pbar=pbar)
+
+        with self._predict_function_scope(keras_model, batch_size):
+            result = self._prefetched_predict(keras_model, generator)
+
+        if isinstance(result, list):
+            return [np.asarray(i)[:total_num] for i in result]
+        else:
+            return np.asarray(result)[:total_num]
+
     def pre_training_checklist_master(self, input_data, labels):
 
         # handle named inputs/outputs first
@@ -317,6 +716,11 @@ class NeuralNetMaster(ABC):
         self.hyper_txt.write(f"Tensorflow Version: {self._tf_ver} \n")
         self.hyper_txt.write(f"Folder Name: {self.folder_name} \n")
         self.hyper_txt.write(f"Batch size: {self.batch_size} \n")
+        self.hyper_txt.write(f"Precision: {self.precision} \n")
+        self.hyper_txt.write(f"Data Pipeline: {self.data_pipeline} \n")
+        if self.strategy is not None:
+            self.hyper_txt.write(f"Distribution Strategy: {self.strategy.__class__.__name__} "
+                                 f"({self._worker_shard()[0]} workers) \n")
         self.hyper_txt.write(f"Optimizer: {self.optimizer.__class__.__name__} \n")
         self.hyper_txt.write(f"Maximum Epochs: {self.max_epochs} \n")
         self.hyper_txt.write(f"Learning Rate: {self.lr} \n")
@@ -574,6 +978,412 @@ class NeuralNetMaster(ABC):
 
         return jacobian_master
 
+    @staticmethod
+    def _export_norm_func(normalizer, name, inverse=False):
+        """
+        Tensorflow equivalent of the custom (de-)normalization function of a normalizer
+
+        :return: Tensorflow function or None if no custom normalization
+        :rtype: Union[NoneType, callable]
+        """
+        mode = normalizer.normalization_mode
+        if str(mode[name] if isinstance(mode, dict) else mode) != '3s':
+            return None
+        custom_func = normalizer._custom_denorm_func if inverse else normalizer._custom_norm_func
+        if custom_func not in (None, sigmoid, sigmoid_inv):
+            raise ValueError("Custom normalization function cannot be exported, only the default sigmoid is supported")
+        if inverse:
+            return lambda x: tf.math.log(x / (1. - x))
+        else:
+            return tf.sigmoid
+
+    def _export_normalize(self, x, name):
+        """
+        Normalize an input tensor the same way input_normalizer does in numpy
+        """
+        magic_mask = tf.logical_or(tf.equal(x, MAGIC_NUMBER), tf.math.is_nan(x))
+        mean, std = [tf.constant(np.asarray(i, dtype=np.float32), dtype=x.dtype)
+                     for i in (self.input_normalizer.mean_labels[name], self.input_normalizer.std_labels[name])]
+        x = (x - mean) / std
+        norm_func = self._export_norm_func(self.input_normalizer, name)
+        if norm_func is not None:
+            x = norm_func(x)
+        return tf.where(magic_mask, tf.cast(MAGIC_NUMBER, x.dtype), x)
+
+    def _export_denormalize(self, x, name):
+        """
+        De-normalize an output tensor the same way labels_normalizer does in numpy
+        """
+        magic_mask = tf.logical_or(tf.equal(x, MAGIC_NUMBER), tf.math.is_nan(x))
+        norm_func = self._export_norm_func(self.labels_normalizer, name, inverse=True)
+        if norm_func is not None:
+            x = norm_func(x)
+        # mean and standard derivation are per feature, extra axes of output (e.g. channel) are broadcasted
+        mean, std = [tf.reshape(tf.constant(np.asarray(i, dtype=np.float32), dtype=x.dtype),
+                                [-1] + [1] * (len(x.shape) - 2))
+                     for i in (self.labels_normalizer.mean_labels[name], self.labels_normalizer.std_labels[name])]
+        return tf.where(magic_mask, tf.cast(MAGIC_NUMBER, x.dtype), x * std + mean)
+
+    def _export_model(self, mc_num=None):
+        """
+        Keras model to be exported which takes normalized inputs, CNNBase and ConvVAEBase use keras_model directly
+
+        :param mc_num: Number of Monte Carlo integration, only used by Bayesian neural network
+        :type mc_num: Union[NoneType, int]
+        :return: Keras model
+        :rtype: keras.Model
+        """
+        return self.keras_model
+
+    def _export_outputs(self, model, norm_inputs):
+        """
+        Turn normalized inputs to dictionary of de-normalized outputs of the exported model
+
+        :param model: Keras model from _export_model()
+        :type model: keras.Model
+        :param norm_inputs: dictionary of normalized input tensors
+        :type norm_inputs: dict
+        :return: dictionary of output tensors
+        :rtype: dict
+        """
+        outputs = model(norm_inputs, training=False)
+        if isinstance(outputs, (list, tuple)):
+            outputs = dict(zip(model.output_names, outputs))
+        else:
+            outputs = {model.output_names[0]: outputs}
+        # de-normalize in float32 even if the model computes in half precision
+        return {'output': self._export_denormalize(tf.cast(outputs['output'], tf.float32), 'output')}
+
+    def export(self, path=None, mc_num=None, tflite=True):
+        """
+        | Export the model to a self-contained Tensorflow SavedModel (and a TFLite flatbuffer) for serving without
+        | astroNN, which includes input normalization, Monte Carlo inference with fixed number of samples for Bayesian
+        | neural network and output de-normalization
+        |
+        | The serving signature ``serving_default`` takes raw input data with the same shape as ``predict()`` does
+        | (i.e. without the trailing channel axis of size 1 added by astroNN), and ``sample_index`` for Bayesian neural
+        | network with ``mc_seed`` set. It returns ``output`` (or ``prediction``, ``total``, ``model`` and
+        | ``predictive`` uncertainty for Bayesian neural network).
+
+        :param path: Folder of the SavedModel, by default "saved_model" under the model folder
+        :type path: Union[NoneType, str]
+        :param mc_num: Number of Monte Carlo integration for Bayesian neural network, by default mc_num of the model
+        :type mc_num: Union[NoneType, int]
+        :param tflite: Whether to also convert the SavedModel to "model.tflite" in the SavedModel folder, TFLite
+            interpreter linked with Select TF ops is required to run it as Monte Carlo inference uses Tensorflow ops
+        :type tflite: bool
+        :return: path of the SavedModel
+        :rtype: str
+        """
+        self.has_model_check()
+        if path is None:
+            if self.fullfilepath is None:
+                raise ValueError("Please provide path to export as the model is not saved to a folder")
+            path = os.path.join(self.fullfilepath, "saved_model")
+
+        model = self._export_model(mc_num)
+        input_specs = []
+        for name, tensor in zip(model.input_names, model.inputs):
+            if tensor.dtype == tf.int64:  # sample index of seeded Monte Carlo inference
+                input_specs.append(tf.TensorSpec([None], tf.int64, name=name))
+                continue
+            shape = tensor.shape[1:]
+            if len(shape) > 1 and shape[-1] == 1:  # astroNN adds the channel axis, see input_d_checking()
+                shape = shape[:-1]
+            input_specs.append(tf.TensorSpec([None] + list(shape), tf.float32, name=name))
+        input_names = [spec.name for spec in input_specs]
+        input_ndims = {name: len(tensor.shape) for name, tensor in zip(model.input_names, model.inputs)}
+
+        @tf.function(input_signature=input_specs)
+        def serving(*args):
+            norm_inputs = {}
+            for name, x in zip(input_names, args):
+                if name == "input_err":
+                    x = x / tf.constant(np.asarray(self.input_normalizer.std_labels['input'], dtype=np.float32))
+                elif x.dtype.is_floating:
+                    x = self._export_normalize(x, name)
+                if len(x.shape) < input_ndims[name]:
+                    x = tf.expand_dims(x, axis=-1)
+                norm_inputs[name] = x
+            return self._export_outputs(model, norm_inputs)
+
+        module = tf.Module()
+        module.model = model  # track variables of the model
+        module.serving = serving
+        tf.saved_model.save(module, path, signatures={"serving_default": serving.get_concrete_function()})
+
+        if tflite:
+            self._convert_tflite(path)
+
+        return path
+
+    @staticmethod
+    def _convert_tflite(path, quantization=None):
+        """
+        Convert an exported SavedModel to "model.tflite" in the SavedModel folder
+
+        :param path: Folder of the SavedModel
+        :type path: str
+        :param quantization: None, "float16" to store weights in float16 or "int8" for dynamic range quantization which
+            stores weights in int8 and runs dense and convolution layers in int8 on CPU
+        :type quantization: Union[NoneType, str]
+        :return: path of the TFLite flatbuffer
+        :rtype: str
+        """
+        converter = tf.lite.TFLiteConverter.from_saved_model(path)
+        # Monte Carlo inference uses ops (e.g. parallelized loop and random ops) not available as TFLite builtins
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+        if quantization == "float16":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+        elif quantization == "int8":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        elif quantization is not None:
+            raise ValueError(f"Unknown quantization {quantization}, only None, 'float16' and 'int8' are supported")
+        tflite_path = os.path.join(path, "model.tflite")
+        with open(tflite_path, "wb") as f:
+            f.write(converter.convert())
+        return tflite_path
+
+    @staticmethod
+    def _run_tflite(tflite_path, input_data, batch_size):
+        """
+        Run the serving signature of an exported TFLite flatbuffer batch by batch
+
+        :return: dictionary of outputs and seconds elapsed
+        :rtype: tuple
+        """
+        interpreter = tf.lite.Interpreter(model_path=tflite_path)
+        input_names = interpreter.get_signature_list()["serving_default"]["inputs"]
+        runner = interpreter.get_signature_runner("serving_default")
+        total_num = input_data.shape[0]
+        outputs = {}
+        start_time = time.perf_counter()
+        for start in range(0, total_num, batch_size):
+            end = min(start + batch_size, total_num)
+            inputs = {"input": input_data[start:end]}
+            if "sample_index" in input_names:
+                inputs["sample_index"] = np.arange(start, end, dtype=np.int64)
+            for name, result in runner(**inputs).items():
+                outputs.setdefault(name, []).append(result)
+        elapsed = time.perf_counter() - start_time
+        return {name: np.concatenate(result) for name, result in outputs.items()}, elapsed
+
+    def compress(self, input_data, path=None, prune=0., quantization="int8", mc_num=None, batch_size=None):
+        """
+        | Post-training compression of the model to a TFLite flatbuffer for fast CPU inference with an accuracy report
+        |
+        | Kernels of dense layers are magnitude pruned (the smallest ``prune`` fraction of weights of every dense layer
+        | are set to zero) and the model is exported (see ``export()``) and quantized. The compressed model and the
+        | float32 model are then run on held-out ``input_data`` to compare predictions (and uncertainties of Bayesian
+        | neural network), size and speed. For Bayesian neural network without ``mc_seed``, the difference between two
+        | float32 runs is also reported as ``mc_noise`` so the degradation can be compared with Monte Carlo noise.
+        |
+        | Weights of the model itself are not changed. The compressed SavedModel, "model.tflite" and
+        | "compression_report.json" are saved under ``path``.
+
+        :param input_data: Held-out data to evaluate the compressed model
+        :type input_data: ndarray
+        :param path: Folder of the compressed model, by default "compressed_model" under the model folder
+        :type path: Union[NoneType, str]
+        :param prune: Fraction of weights of every dense layer to be pruned, 0 to disable pruning
+        :type prune: float
+        :param quantization: None, "float16" to store weights in float16 or "int8" for dynamic range quantization which
+            stores weights in int8 and runs dense and convolution layers in int8 on CPU
+        :type quantization: Union[NoneType, str]
+        :param mc_num: Number of Monte Carlo integration for Bayesian neural network, by default mc_num of the model
+        :type mc_num: Union[NoneType, int]
+        :param batch_size: batch size, by default the batch size of the model
+        :type batch_size: Union[NoneType, int]
+        :return: accuracy report with per output max, mean absolute and mean relative difference from float32 model,
+            sparsity of dense layers, size and inference time of the float32 and compressed model
+        :rtype: dict
+        """
+        self.has_model_check()
+        if not 0. <= prune < 1.:
+            raise ValueError("prune must be in [0, 1)")
+        if path is None:
+            if self.fullfilepath is None:
+                raise ValueError("Please provide path to save the compressed model as the model is not saved to a "
+                                 "folder")
+            path = os.path.join(self.fullfilepath, "compressed_model")
+        batch_size = self._inference_batch_size(batch_size)
+        input_data = np.asarray(input_data, dtype=np.float32)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            float32_path = self._convert_tflite(self.export(temp_dir, mc_num=mc_num, tflite=False))
+            reference, float32_time = self._run_tflite(float32_path, input_data, batch_size)
+            float32_size = os.path.getsize(float32_path)
+            mc_noise = None
+            # unseeded Bayesian neural network draws different Monte Carlo samples every run
+            if hasattr(self, "mc_seed") and self.mc_seed is None:
+                mc_noise, _ = self._run_tflite(float32_path, input_data, batch_size)
+
+        dense_layers = [layer for layer in self.keras_model.layers if isinstance(layer, tfk.layers.Dense)]
+        original_weights = [layer.get_weights() for layer in dense_layers]
+        num_zeros, num_weights = 0, 0
+        try:
+            for layer, weights in zip(dense_layers, original_weights):
+                kernel = weights[0]
+                if prune > 0.:
+                    kernel = np.where(np.abs(kernel) < np.quantile(np.abs(kernel), prune), 0., kernel)
+                    layer.set_weights([kernel] + weights[1:])
+                num_zeros += np.sum(kernel == 0.)
+                num_weights += kernel.size
+            compressed_path = self._convert_tflite(self.export(path, mc_num=mc_num, tflite=False),
+                                                   quantization=quantization)
+        finally:
+            for layer, weights in zip(dense_layers, original_weights):
+                layer.set_weights(weights)
+        compressed, compressed_time = self._run_tflite(compressed_path, input_data, batch_size)
+        compressed_size = os.path.getsize(compressed_path)
+
+        def difference(x, y):
+            abs_diff = np.abs(x - y)
+            return {"max_abs_diff": float(np.max(abs_diff)),
+                    "mean_abs_diff": float(np.mean(abs_diff)),
+                    "mean_rel_diff": float(np.mean(abs_diff / np.maximum(np.abs(y), epsilon())))}
+
+        report = {"prune": prune,
+                  "quantization": quantization,
+                  "dense_sparsity": float(num_zeros / max(num_weights, 1)),
+                  "float32_size": float32_size,
+                  "compressed_size": compressed_size,
+                  "size_ratio": float32_size / compressed_size,
+                  "float32_time": float32_time,
+                  "compressed_time": compressed_time,
+                  "speedup": float32_time / compressed_time,
+                  "outputs": {name: difference(compressed[name], reference[name]) for name in reference}}
+        if mc_noise is not None:
+            report["mc_noise"] = {name: difference(mc_noise[name], reference[name]) for name in reference}
+
+        with open(os.path.join(path, "compression_report.json"), "w") as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+
+        return report
+
+    def tune_batch_size(self, input_data, labels, batch_sizes=None, memory_limit=None, steps=3, tune_predict=True,
+                        save=True):
+        """
+        | Find batch sizes with the highest throughput for training and inference on this machine
+        |
+        | Increasing batch sizes are probed with short timed runs of the real train step of the model (weights and
+        | optimizer states are restored afterwards) and of ``predict()`` (including Monte Carlo inference of Bayesian
+        | neural network). Memory is measured as the increase of peak memory of the process over the memory before
+        | tuning, so data already loaded do not count. Probing stops before a batch size whose memory, estimated from
+        | the memory growth per data of the last batch size, would exceed ``memory_limit``, or when memory is
+        | exhausted. The chosen sizes are set to ``batch_size`` and ``predict_batch_size``, and saved to the parameter
+        | file of the model folder (if any) so they are used by ``load_folder()`` later.
+
+        :param input_data: Data to run the model on, at least the largest batch size to be probed
+        :type input_data: Union([ndarray, dict])
+        :param labels: Labels of the data
+        :type labels: Union([ndarray, dict])
+        :param batch_sizes: Batch sizes to be probed in increasing order, by default powers of two from 8 up to the
+            number of data
+        :type batch_sizes: Union([NoneType, list])
+        :param memory_limit: Maximum increase of peak memory of the process over the memory before tuning in bytes, by
+            default 80% of physical memory minus the memory before tuning
+        :type memory_limit: Union([NoneType, int])
+        :param steps: Number of timed steps for every batch size
+        :type steps: int
+        :param tune_predict: Whether to tune batch size for inference too
+        :type tune_predict: bool
+        :param save: Whether to save chosen batch sizes and throughput to model folder (if any)
+        :type save: bool
+        :return: throughput in samples per second of every batch size probed for training and inference, the chosen
+            batch sizes, peak memory and memory before tuning
+        :rtype: dict
+        """
+        self.has_model_check()
+        num_data = (input_data["input"] if isinstance(input_data, dict) else input_data).shape[0]
+        if batch_sizes is None:
+            batch_sizes = [2 ** i for i in range(3, 31) if 2 ** i <= num_data] or [num_data]
+        def next_exceeds_memory_limit(phase_memory, i):
+            """
+            Whether memory of the batch size after batch_sizes[i] is estimated to exceed memory_limit, from memory
+            growth of batch_sizes[i] over the memory before this phase (training or inference) scaled by batch size
+            """
+            growth = _peak_memory() - phase_memory
+            if phase_memory - baseline_memory + growth > memory_limit:
+                return True
+            elif i + 1 < len(batch_sizes):
+                return phase_memory - baseline_memory + growth * batch_sizes[i + 1] / batch_sizes[i] > memory_limit
+            return False
+
+        def rows(data, n):
+            return {name: data[name][:n] for name in data} if isinstance(data, dict) else data[:n]
+
+        # train step on batches structured as data generator, i.e. (inputs, labels) or (inputs, labels, sample weight)
+        batch = self._on_batch_generator(rows(input_data, max(batch_sizes)), rows(labels, max(batch_sizes)))[0]
+        baseline_memory = _peak_memory()
+        if memory_limit is None:
+            physical_memory = _physical_memory()
+            memory_limit = np.inf if physical_memory is None else max(0.8 * physical_memory - baseline_memory, 0)
+        optimizer = self.keras_model.optimizer
+
+        def optimizer_variables():
+            return list(optimizer.variables() if callable(optimizer.variables) else optimizer.variables)
+
+        weights = self.keras_model.get_weights()
+        optimizer_states = [(v, v.numpy()) for v in optimizer_variables()]
+        train_throughput, predict_throughput = {}, {}
+        try:
+            for i, batch_size in enumerate(batch_sizes):
+                sub_batch = tf.nest.map_structure(lambda x: x[:batch_size], batch)
+                try:
+                    self.keras_model.train_on_batch(*sub_batch)  # warm up and tracing
+                    start_time = time.perf_counter()
+                    for _ in range(steps):
+                        self.keras_model.train_on_batch(*sub_batch)
+                    train_throughput[batch_size] = batch_size * steps / (time.perf_counter() - start_time)
+                except tf.errors.ResourceExhaustedError:
+                    break
+                if next_exceeds_memory_limit(baseline_memory, i):
+                    break
+        finally:
+            self.keras_model.set_weights(weights)
+            saved = {id(v): state for v, state in optimizer_states}
+            for v in optimizer_variables():
+                # optimizer states created during probing are reset as if not created
+                v.assign(saved.get(id(v), np.zeros(v.shape, dtype=v.dtype.as_numpy_dtype)))
+
+        if tune_predict:
+            # memory grown in training probes is counted as still in use, growth of inference is measured after that
+            phase_memory = _peak_memory()
+            for i, batch_size in enumerate(batch_sizes):
+                num_predict = min(batch_size * steps, num_data)
+                try:
+                    self.predict(rows(input_data, batch_size), batch_size=batch_size)  # warm up and tracing
+                    start_time = time.perf_counter()
+                    self.predict(rows(input_data, num_predict), batch_size=batch_size)
+                    predict_throughput[batch_size] = num_predict / (time.perf_counter() - start_time)
+                except tf.errors.ResourceExhaustedError:
+                    break
+                if next_exceeds_memory_limit(phase_memory, i):
+                    break
+
+        if len(train_throughput) > 0:
+            self.batch_size = int(max(train_throughput, key=train_throughput.get))
+        if len(predict_throughput) > 0:
+            self.predict_batch_size = int(max(predict_throughput, key=predict_throughput.get))
+        result = {"train_throughput": train_throughput, "predict_throughput": predict_throughput,
+                  "batch_size": self.batch_size, "predict_batch_size": self.predict_batch_size,
+                  "peak_memory": _peak_memory(), "baseline_memory": baseline_memory, "memory_limit": memory_limit}
+
+        if save and self.fullfilepath is not None:
+            parameter_path = os.path.join(self.fullfilepath, "astroNN_model_parameter.json")
+            if os.path.isfile(parameter_path):
+                with open(parameter_path) as f:
+                    parameter = json.load(f)
+                parameter.update({"batch_size": self.batch_size, "predict_batch_size": self.predict_batch_size})
+                with open(parameter_path, "w") as f:
+                    json.dump(parameter, f, indent=4, sort_keys=True)
+            with open(os.path.join(self.fullfilepath, "batch_size_tuning.json"), "w") as f:
+                json.dump(result, f, indent=4, sort_keys=True, default=float)
+
+        return result
+
     def plot_dense_stats(self):
         """
         Plot dense layers weight statistics
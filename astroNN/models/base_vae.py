@@ -18,6 +18,7 @@ from astroNN.nn.losses import (
     mean_squared_reconstruction_error,
 )
 from astroNN.nn.utilities import Normalizer
+from astroNN.nn.utilities.file_backed import take_rows
 from astroNN.nn.utilities.generator import GeneratorMaster
 from astroNN.shared.dict_tools import dict_np_to_dict_list, list_to_dict
 from astroNN.shared.warnings import deprecated, deprecated_copy_signature
@@ -84,8 +85,10 @@ class CVAEDataGenerator(GeneratorMaster):
             return x, y
 
     def __getitem__(self, index):
-        return self._data_generation(
-            self.idx_list[index * self.batch_size : (index + 1) * self.batch_size]
+        return self._augment(
+            self._data_generation(
+                self.idx_list[index * self.batch_size : (index + 1) * self.batch_size]
+            )
         )
 
     def on_epoch_end(self):
@@ -94,6 +97,14 @@ class CVAEDataGenerator(GeneratorMaster):
             range(self.inputs["input"].shape[0])
         )
 
+    def _dataset_elements(self):
+        x = self._channel_view(self.inputs)
+        y = self._channel_view(self.recon_inputs)
+        if self.sample_weight is not None:
+            return x, y, self.sample_weight
+        else:
+            return x, y
+
 
 class CVAEPredDataGenerator(GeneratorMaster):
     """
@@ -139,11 +150,11 @@ class CVAEPredDataGenerator(GeneratorMaster):
         return x
 
     def __getitem__(self, index):
-        x = self._data_generation(
-            self.idx_list[index * self.batch_size : (index + 1) * self.batch_size]
-        )
+        idx_list_temp = self.idx_list[index * self.batch_size : (index + 1) * self.batch_size]
+        # pad the last batch so all batches have the same shape
+        x = self._data_generation(self._pad_idx(idx_list_temp))
         if self.pbar and index > self.current_idx:
-            self.pbar.update(self.batch_size)
+            self.pbar.update(len(idx_list_temp))
         self.current_idx = index
         return x
 
@@ -205,8 +216,10 @@ class ConvVAEBase(NeuralNetMaster, ABC):
         loss_weights=None,
         sample_weight_mode=None,
     ):
-        self.keras_encoder, self.keras_decoder = self.model()
-        self.keras_model = tfk.Model(inputs=[self.keras_encoder.inputs], outputs=[self.keras_decoder(self.keras_encoder.outputs[2])])
+        with self._precision_scope(), self._strategy_scope():
+            self.keras_encoder, self.keras_decoder = self.model()
+            self.keras_model = tfk.Model(inputs=[self.keras_encoder.inputs],
+                                         outputs=[self.keras_decoder(self.keras_encoder.outputs[2])])
         
         if optimizer is not None:
             self.optimizer = optimizer
@@ -293,13 +306,14 @@ class ConvVAEBase(NeuralNetMaster, ABC):
             z_mean, z_log_var, z = self.keras_encoder(x, training=True)
             y_pred = self.keras_decoder(z, training=True)
             reconstruction_loss = self.loss(y, y_pred, sample_weight=sample_weight)
+            # KL divergence in the precision of reconstruction loss as exp() overflows in half precision
+            z_mean, z_log_var = [tf.cast(i, reconstruction_loss.dtype) for i in (z_mean, z_log_var)]
             kl_loss = -0.5 * (1 + z_log_var - tf.square(z_mean) - tf.exp(z_log_var))
             kl_loss = tf.reduce_mean(tf.reduce_sum(kl_loss, axis=1))
             total_loss = reconstruction_loss + kl_loss
             
-        # Run backwards pass.
-        grads = tape.gradient(total_loss, self.keras_model.trainable_weights)
-        self.keras_model.optimizer.apply_gradients(zip(grads, self.keras_model.trainable_weights))
+        # Run backwards pass, minimize() takes care of loss scaling under mixed precision
+        self.keras_model.optimizer.minimize(total_loss, self.keras_model.trainable_weights, tape=tape)
         # self.keras_model.compiled_metrics.update_state(y, y_pred, sample_weight)
 
         self.keras_model.total_loss_tracker.update_state(total_loss)
@@ -327,6 +341,7 @@ class ConvVAEBase(NeuralNetMaster, ABC):
         z_mean, z_log_var, z = self.keras_encoder(x, training=False)
         y_pred = self.keras_decoder(z, training=False)
         reconstruction_loss = self.loss(y, y_pred, sample_weight=sample_weight)
+        z_mean, z_log_var = [tf.cast(i, reconstruction_loss.dtype) for i in (z_mean, z_log_var)]
         kl_loss = -0.5 * (1 + z_log_var - tf.square(z_mean) - tf.exp(z_log_var))
         kl_loss = tf.reduce_mean(tf.reduce_sum(kl_loss, axis=1))
         total_loss = reconstruction_loss + kl_loss
@@ -374,21 +389,19 @@ class ConvVAEBase(NeuralNetMaster, ABC):
                 mode=self.labels_norm_mode, verbose=self.verbose
             )
 
-            norm_data = self.input_normalizer.normalize(input_data)
+            norm_data = self._normalize_data(self.input_normalizer, input_data)
             self.input_mean, self.input_std = (
                 self.input_normalizer.mean_labels,
                 self.input_normalizer.std_labels,
             )
-            norm_labels = self.labels_normalizer.normalize(input_recon_target)
+            norm_labels = self._normalize_data(self.labels_normalizer, input_recon_target)
             self.labels_mean, self.labels_std = (
                 self.labels_normalizer.mean_labels,
                 self.labels_normalizer.std_labels,
             )
         else:
-            norm_data = self.input_normalizer.normalize(input_data, calc=False)
-            norm_labels = self.labels_normalizer.normalize(
-                input_recon_target, calc=False
-            )
+            norm_data = self._normalize_data(self.input_normalizer, input_data, calc=False)
+            norm_labels = self._normalize_data(self.labels_normalizer, input_recon_target, calc=False)
 
         if (
             self.keras_model is None
@@ -408,21 +421,23 @@ class ConvVAEBase(NeuralNetMaster, ABC):
             self.train_idx = np.arange(self.num_train + self.val_num)
             # just dummy, to minimize modification needed
             self.val_idx = np.arange(self.num_train + self.val_num)[:2]
+        # in storage order so file-backed data are read mostly sequentially
+        self.train_idx, self.val_idx = np.sort(self.train_idx), np.sort(self.val_idx)
 
         norm_data_training = {}
         norm_data_val = {}
         norm_labels_training = {}
         norm_labels_val = {}
         for name in norm_data.keys():
-            norm_data_training.update({name: norm_data[name][self.train_idx]})
-            norm_data_val.update({name: norm_data[name][self.val_idx]})
+            norm_data_training.update({name: take_rows(norm_data[name], self.train_idx)})
+            norm_data_val.update({name: take_rows(norm_data[name], self.val_idx)})
         for name in norm_labels.keys():
-            norm_labels_training.update({name: norm_labels[name][self.train_idx]})
-            norm_labels_val.update({name: norm_labels[name][self.val_idx]})
+            norm_labels_training.update({name: take_rows(norm_labels[name], self.train_idx)})
+            norm_labels_val.update({name: take_rows(norm_labels[name], self.val_idx)})
 
         if sample_weight is not None:
-            sample_weight_training = sample_weight[self.train_idx]
-            sample_weight_val = sample_weight[self.val_idx]
+            sample_weight_training = take_rows(sample_weight, self.train_idx)
+            sample_weight_val = take_rows(sample_weight, self.val_idx)
         else:
             sample_weight_training = None
             sample_weight_val = None
@@ -456,10 +471,11 @@ class ConvVAEBase(NeuralNetMaster, ABC):
         """
         Train a Convolutional Autoencoder
 
-        :param input_data: Data to be trained with neural network
-        :type input_data: ndarray
+        :param input_data: Data to be trained with neural network, file-backed data (h5py dataset, numpy memmap or
+            FileBackedArray) are read lazily batch by batch
+        :type input_data: Union([ndarray, h5py.Dataset, numpy.memmap, FileBackedArray])
         :param input_recon_target: Data to be reconstructed
-        :type input_recon_target: ndarray
+        :type input_recon_target: Union([ndarray, h5py.Dataset, numpy.memmap, FileBackedArray])
         :param sample_weight: Sample weights (if any)
         :type sample_weight: Union([NoneType, ndarray])
         :return: None
@@ -497,15 +513,20 @@ class ConvVAEBase(NeuralNetMaster, ABC):
 
         start_time = time.time()
 
-        self.keras_model.fit(
-            self.training_generator,
-            validation_data=self.validation_generator,
-            epochs=self.max_epochs,
-            verbose=self.verbose,
-            workers=os.cpu_count(),
-            callbacks=self.__callbacks,
-            use_multiprocessing=MULTIPROCESS_FLAG,
-        )
+        training_data, validation_data = self._fit_data()
+
+        try:
+            self.keras_model.fit(
+                training_data,
+                validation_data=validation_data,
+                epochs=self.max_epochs,
+                verbose=self.verbose,
+                workers=os.cpu_count(),
+                callbacks=self.__callbacks,
+                use_multiprocessing=MULTIPROCESS_FLAG,
+            )
+        finally:
+            self._release_fit_data()
 
         print(f"Completed Training, {(time.time() - start_time):.{2}f}s in total")
 
@@ -515,9 +536,9 @@ class ConvVAEBase(NeuralNetMaster, ABC):
 
         return None
 
-    def fit_on_batch(self, input_data, input_recon_target, sample_weight=None):
+    def _on_batch_generator(self, input_data, input_recon_target, sample_weight=None):
         """
-        Train a AutoEncoder by running a single gradient update on all of your data, suitable for fine-tuning
+        Data generator of a single batch of all normalized data for fit_on_batch()
 
         :param input_data: Data to be trained with neural network
         :type input_data: ndarray
@@ -525,11 +546,9 @@ class ConvVAEBase(NeuralNetMaster, ABC):
         :type input_recon_target: ndarray
         :param sample_weight: Sample weights (if any)
         :type sample_weight: Union([NoneType, ndarray])
-        :return: None
-        :rtype: NoneType
-        :History: 2018-Aug-25 - Written - Henry Leung (University of Toronto)
+        :return: data generator
+        :rtype: CVAEDataGenerator
         """
-
         input_data, input_recon_target = self.pre_training_checklist_master(
             input_data, input_recon_target
         )
@@ -564,9 +583,7 @@ class ConvVAEBase(NeuralNetMaster, ABC):
             norm_labels, self.keras_model.output_names
         )
 
-        start_time = time.time()
-
-        fit_generator = CVAEDataGenerator(
+        return CVAEDataGenerator(
             batch_size=input_data["input"].shape[0],
             shuffle=False,
             steps_per_epoch=1,
@@ -574,6 +591,23 @@ class ConvVAEBase(NeuralNetMaster, ABC):
             sample_weight=sample_weight,
         )
 
+    def fit_on_batch(self, input_data, input_recon_target, sample_weight=None):
+        """
+        Train a AutoEncoder by running a single gradient update on all of your data, suitable for fine-tuning
+
+        :param input_data: Data to be trained with neural network
+        :type input_data: ndarray
+        :param input_recon_target: Data to be reconstructed
+        :type input_recon_target: ndarray
+        :param sample_weight: Sample weights (if any)
+        :type sample_weight: Union([NoneType, ndarray])
+        :return: None
+        :rtype: NoneType
+        :History: 2018-Aug-25 - Written - Henry Leung (University of Toronto)
+        """
+        fit_generator = self._on_batch_generator(input_data, input_recon_target, sample_weight)
+        start_time = time.time()
+
         scores = self.keras_model.fit(
             fit_generator,
             epochs=1,
@@ -622,18 +656,22 @@ class ConvVAEBase(NeuralNetMaster, ABC):
             "input_norm_mode": self.input_normalizer.normalization_mode,
             "labels_norm_mode": self.labels_normalizer.normalization_mode,
             "batch_size": self.batch_size,
+            "predict_batch_size": self.predict_batch_size,
             "latent": self.latent_dim,
+            "precision": self.precision,
         }
 
         with open(self.fullfilepath + "/astroNN_model_parameter.json", "w") as f:
             json.dump(data, f, indent=4, sort_keys=True)
 
-    def predict(self, input_data):
+    def predict(self, input_data, batch_size=None):
         """
         Use the neural network to do inference and get reconstructed data
 
         :param input_data: Data to be inferred with neural network
         :type input_data: ndarray
+        :param batch_size: batch size, by default the batch size of the model
+        :type batch_size: Union([NoneType, int])
         :return: reconstructed data
         :rtype: ndarry
         :History: 2017-Dec-06 - Written - Henry Leung (University of Toronto)
@@ -650,56 +688,26 @@ class ConvVAEBase(NeuralNetMaster, ABC):
 
         total_test_num = input_data["input"].shape[0]  # Number of testing data
 
-        # for number of training data smaller than batch_size
-        if total_test_num < self.batch_size:
-            self.batch_size = total_test_num
-
-        # Due to the nature of how generator works, no overlapped prediction
-        data_gen_shape = (total_test_num // self.batch_size) * self.batch_size
-        remainder_shape = total_test_num - data_gen_shape  # Remainder from generator
-
         predictions = np.zeros((total_test_num, self._labels_shape["output"], 1))
 
-        norm_data_main = {}
-        norm_data_remainder = {}
-        for name in input_array.keys():
-            norm_data_main.update({name: input_array[name][:data_gen_shape]})
-            norm_data_remainder.update({name: input_array[name][data_gen_shape:]})
-
-        norm_data_main = self._tensor_dict_sanitize(
-            norm_data_main, self.keras_model.input_names
-        )
-        norm_data_remainder = self._tensor_dict_sanitize(
-            norm_data_remainder, self.keras_model.input_names
+        input_array = self._tensor_dict_sanitize(
+            input_array, self.keras_model.input_names
         )
 
         start_time = time.time()
         print("Starting Inference")
 
-        # Data Generator for prediction
+        # Data Generator for prediction, the last batch is padded so no graph is traced for the remainder
         with tqdm(total=total_test_num, unit="sample") as pbar:
             pbar.set_description_str("Prediction progress: ")
-            prediction_generator = CVAEPredDataGenerator(
-                batch_size=self.batch_size,
-                shuffle=False,
-                steps_per_epoch=total_test_num // self.batch_size,
-                data=[norm_data_main],
+            result = self._bucketed_predict(
+                self.keras_model,
+                CVAEPredDataGenerator,
+                input_array,
+                self._inference_batch_size(batch_size),
+                pbar=pbar,
             )
-            result = np.asarray(self.keras_model.predict(prediction_generator, verbose=0))
-
-            if remainder_shape != 0:
-                remainder_generator = CVAEPredDataGenerator(
-                    batch_size=remainder_shape,
-                    shuffle=False,
-                    steps_per_epoch=1,
-                    data=[norm_data_remainder],
-                )
-                pbar.update(remainder_shape)
-                remainder_result = np.asarray(
-                    self.keras_model.predict(remainder_generator, verbose=0)
-                )
-                result = np.concatenate((result, remainder_result))
-                
+
         predictions[:] = result
 
         if self.labels_normalizer is not None:
@@ -715,12 +723,14 @@ class ConvVAEBase(NeuralNetMaster, ABC):
 
         return predictions
 
-    def predict_encoder(self, input_data):
+    def predict_encoder(self, input_data, batch_size=None):
         """
         Use the neural network to do inference and get the hidden layer encoding/representation
 
         :param input_data: Data to be inferred with neural network
         :type input_data: ndarray
+        :param batch_size: batch size, by default the batch size of the model
+        :type batch_size: Union([NoneType, int])
         :return: hidden layer encoding/representation mean and std
         :rtype: ndarray
         :History: 2017-Dec-06 - Written - Henry Leung (University of Toronto)
@@ -737,20 +747,6 @@ class ConvVAEBase(NeuralNetMaster, ABC):
 
         total_test_num = input_data["input"].shape[0]  # Number of testing data
 
-        # for number of training data smaller than batch_size
-        if total_test_num < self.batch_size:
-            self.batch_size = input_data["input"].shape[0]
-
-        # Due to the nature of how generator works, no overlapped prediction
-        data_gen_shape = (total_test_num // self.batch_size) * self.batch_size
-        remainder_shape = total_test_num - data_gen_shape  # Remainder from generator
-
-        norm_data_main = {}
-        norm_data_remainder = {}
-        for name in input_array.keys():
-            norm_data_main.update({name: input_array[name][:data_gen_shape]})
-            norm_data_remainder.update({name: input_array[name][data_gen_shape:]})
-
         encoding_mean = np.zeros((total_test_num, self.latent_dim))
         encoding_uncertainty = np.zeros((total_test_num, self.latent_dim))
         encoding = np.zeros((total_test_num, self.latent_dim))
@@ -758,41 +754,24 @@ class ConvVAEBase(NeuralNetMaster, ABC):
         start_time = time.time()
         print("Starting Inference on Encoder")
 
-        # Data Generator for prediction
-        prediction_generator = CVAEPredDataGenerator(
-            batch_size=self.batch_size,
-            shuffle=False,
-            steps_per_epoch=total_test_num // self.batch_size,
-            data=[norm_data_main],
-        )
-        z_mean, z_log_var, z = np.asarray(
-            self.keras_encoder.predict(prediction_generator)
+        # Data Generator for prediction, the last batch is padded so no graph is traced for the remainder
+        z_mean, z_log_var, z = self._bucketed_predict(
+            self.keras_encoder,
+            CVAEPredDataGenerator,
+            input_array,
+            self._inference_batch_size(batch_size),
         )
-        
-        encoding_mean[:data_gen_shape] = z_mean
-        encoding_uncertainty[:data_gen_shape] = np.exp(0.5 * z_log_var)
-        encoding[:data_gen_shape] = z
-        
-        if remainder_shape != 0:
-            # assume its caused by mono images, so need to expand dim by 1
-            for name in input_array.keys():
-                if len(norm_data_remainder[name][0].shape) != len(
-                    self._input_shape[name]
-                ):
-                    norm_data_remainder.update(
-                        {name: np.expand_dims(norm_data_remainder[name], axis=-1)}
-                    )
-            z_mean, z_log_var, z = self.keras_encoder.predict(norm_data_remainder)
-            encoding_mean[data_gen_shape:] = z_mean
-            encoding_uncertainty[data_gen_shape:] = np.exp(0.5 * z_log_var)
-            encoding[data_gen_shape:] = z
+
+        encoding_mean[:] = z_mean
+        encoding_uncertainty[:] = np.exp(0.5 * z_log_var)
+        encoding[:] = z
         print(
             f"Completed Inference on Encoder, {(time.time() - start_time):.{2}f}s elapsed"
         )
 
         return encoding_mean, encoding_uncertainty, encoding
 
-    def evaluate(self, input_data, labels):
+    def evaluate(self, input_data, labels, batch_size=None):
         """
         Evaluate neural network by provided input data and labels/reconstruction target to get back a metrics score
 
@@ -800,6 +779,8 @@ class ConvVAEBase(NeuralNetMaster, ABC):
         :type input_data: ndarray
         :param labels: labels
         :type labels: ndarray
+        :param batch_size: batch size, by default the batch size of the model
+        :type batch_size: Union([NoneType, int])
         :return: metrics score
         :rtype: float
         :History: 2018-May-20 - Written - Henry Leung (University of Toronto)
@@ -839,8 +820,9 @@ class ConvVAEBase(NeuralNetMaster, ABC):
         )
 
         total_num = input_data["input"].shape[0]
-        eval_batchsize = self.batch_size if total_num > self.batch_size else total_num
-        steps = total_num // self.batch_size if total_num > self.batch_size else 1
+        batch_size = self._inference_batch_size(batch_size)
+        eval_batchsize = batch_size if total_num > batch_size else total_num
+        steps = total_num // batch_size if total_num > batch_size else 1
 
         start_time = time.time()
         print("Starting Evaluation")
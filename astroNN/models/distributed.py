@@ -0,0 +1,211 @@
+###############################################################################
+#   distributed.py: multi-process data-parallel training on a single host
+###############################################################################
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import h5py
+import numpy as np
+
+from astroNN.nn.utilities.file_backed import FileBackedArray
+from astroNN.nn.utilities.shared_array import SharedArray, to_shared_array
+
+
+def _free_ports(num):
+    """
+    Find free ports on localhost
+
+    :param num: number of ports
+    :type num: int
+    :return: list of ports
+    :rtype: list
+    """
+    sockets = []
+    try:
+        for _ in range(num):
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.bind(("localhost", 0))
+            sockets.append(s)
+        return [s.getsockname()[1] for s in sockets]
+    finally:
+        for s in sockets:
+            s.close()
+
+
+def _check_picklable(data):
+    """
+    Check data (also in dictionary) can be sent to worker processes
+
+    :raises TypeError: if any of data is a h5py dataset (also in ``FileBackedArray``) which cannot be pickled
+    """
+    for value in (data.values() if isinstance(data, dict) else [data]):
+        if isinstance(value.data if isinstance(value, FileBackedArray) else value, h5py.Dataset):
+            raise TypeError("DistributedTrainer does not support h5py datasets because they cannot be sent to worker "
+                            "processes, please use numpy memmap (e.g. numpy.load(..., mmap_mode='r')) instead")
+
+
+def _to_shared(data):
+    """
+    Copy in-memory NumPy arrays (also in dictionary) into shared memory so they are pickled to workers by name
+    """
+    if isinstance(data, dict):
+        return {name: to_shared_array(value) for name, value in data.items()}
+    return to_shared_array(data)
+
+
+def _release_shared(data):
+    for value in (data.values() if isinstance(data, dict) else [data]):
+        if isinstance(value, SharedArray):
+            value.release()
+
+
+def _worker_fit(model, task_index, worker_addresses, fit_args, fit_kwargs, folder, intra_op_threads, seed):
+    """
+    Train a model as a worker of ``tf.distribute.MultiWorkerMirroredStrategy``, the chief worker (index 0) saves the
+    model to folder (other workers save to a temporary folder as required by the strategy)
+
+    :return: training time, history, shard of training data of this worker and the saved folder of the chief worker
+    :rtype: dict
+    """
+    # cluster has to be configured before the strategy is created
+    os.environ["TF_CONFIG"] = json.dumps({"cluster": {"worker": worker_addresses},
+                                          "task": {"type": "worker", "index": task_index}})
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    # same seed so every worker has the same training/validation split, initial weights are broadcasted anyway
+    np.random.seed(seed)
+    tf.random.set_seed(seed)
+
+    model.strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    model.autosave = False
+    start_time = time.perf_counter()
+    model.fit(*fit_args, **fit_kwargs)
+    training_time = time.perf_counter() - start_time
+    generator = model.training_generator
+    shard = {"index": generator.shard_index, "num_shards": generator.num_shards, "batch_size": generator.batch_size,
+             "num_data": len(generator.data[0]["input"]) // generator.num_shards, "steps_per_epoch": len(generator)}
+
+    if task_index == 0 and folder is not None:
+        model.save(name=folder)
+        saved_folder = model.fullfilepath
+    else:
+        model.currentdir = tempfile.mkdtemp()
+        model.save(name="worker")
+        shutil.rmtree(model.currentdir, ignore_errors=True)
+        saved_folder = None
+    return {"training_time": training_time, "history": model.history.history, "shard": shard, "folder": saved_folder}
+
+
+class DistributedTrainer(object):
+    """
+    | Data-parallel training of astroNN model (i.e. CNNBase, BayesianCNNBase and ConvVAEBase) with multiple worker
+    | processes on localhost using ``tf.distribute.MultiWorkerMirroredStrategy``
+    |
+    | Every worker process gets a copy of the (not yet compiled) model, reads its own shard of data through the data
+    | generators with a batch size of ``batch_size`` divided by the number of workers, and gradients are all-reduced
+    | across workers every step, so the model is trained as if with ``batch_size`` in a single process. In-memory
+    | training data are copied into shared memory once and shared by all workers. File-backed training data have to
+    | be numpy memmap, h5py datasets cannot be sent to worker processes. The chief worker saves the trained model
+    | which is then loaded with ``load_folder()``.
+
+    :param model: astroNN model which has not been compiled
+    :type model: NeuralNetMaster
+    :param n_workers: Number of worker processes
+    :type n_workers: int
+    :param intra_op_threads: Number of Tensorflow intra-op threads of every worker, by default CPU evenly distributed
+    :type intra_op_threads: Union([NoneType, int])
+    :param seed: Seed of training/validation split and initial weights, the same for all workers
+    :type seed: int
+    """
+
+    def __init__(self, model, n_workers=2, intra_op_threads=None, seed=42):
+        if model.keras_model is not None:
+            raise ValueError("DistributedTrainer requires a model which has not been compiled, because the model has "
+                             "to be built under the distribution strategy in every worker")
+        self.model = model
+        self.n_workers = n_workers
+        if intra_op_threads is None:
+            intra_op_threads = max(os.cpu_count() // self.n_workers, 1)
+        self.intra_op_threads = intra_op_threads
+        self.seed = seed
+        self.worker_results = None
+
+    def _run(self, fit_args, fit_kwargs, folder):
+        for arg in list(fit_args) + list(fit_kwargs.values()):
+            _check_picklable(arg)
+        shared_args = [_to_shared(arg) for arg in fit_args]
+        shared_kwargs = {name: _to_shared(arg) for name, arg in fit_kwargs.items()}
+        worker_addresses = [f"localhost:{port}" for port in _free_ports(self.n_workers)]
+        try:
+            # spawn instead of fork because Tensorflow is not fork-safe, all workers have to run at the same time
+            with ProcessPoolExecutor(max_workers=self.n_workers,
+                                     mp_context=multiprocessing.get_context("spawn")) as executor:
+                futures = [executor.submit(_worker_fit, self.model, i, worker_addresses, shared_args, shared_kwargs,
+                                           folder if i == 0 else None, self.intra_op_threads, self.seed)
+                           for i in range(self.n_workers)]
+                self.worker_results = [future.result() for future in futures]
+        finally:
+            for arg in shared_args + list(shared_kwargs.values()):
+                _release_shared(arg)
+        return self.worker_results
+
+    def fit(self, *args, folder=None, **kwargs):
+        """
+        Train the model with worker processes, arguments are the same as fit() of the model
+
+        :param folder: Folder name of the trained model, by default ``folder_name`` of the model or automatically
+            generated
+        :type folder: Union([NoneType, str])
+        :return: trained model loaded from the folder saved by the chief worker
+        :rtype: NeuralNetMaster
+        """
+        from astroNN.models import load_folder
+        from astroNN.shared.nn_tools import folder_runnum
+
+        if folder is None:
+            folder = self.model.folder_name if self.model.folder_name is not None else folder_runnum()
+        results = self._run(args, kwargs, folder)
+        return load_folder(results[0]["folder"])
+
+
+def benchmark_distributed_scaling(model, *args, worker_counts=None, intra_op_threads=None, **kwargs):
+    """
+    Benchmark training time of data-parallel training against the number of worker processes, the model is trained
+    from scratch with every number of workers and is not saved
+
+    :param model: astroNN model which has not been compiled
+    :type model: NeuralNetMaster
+    :param args: Arguments of fit() of the model, i.e. training data
+    :param worker_counts: Numbers of workers to benchmark, by default 1, 2, 4, ... up to number of CPU
+    :type worker_counts: Union([NoneType, list])
+    :param intra_op_threads: Number of Tensorflow intra-op threads of every worker, by default CPU evenly distributed
+    :type intra_op_threads: Union([NoneType, int])
+    :param kwargs: Keyword arguments of fit() of the model
+    :return: training time (slowest worker, in seconds), wall time including starting workers, speedup and parallel
+        efficiency relative to the first number of workers, for every number of workers
+    :rtype: dict
+    """
+    if worker_counts is None:
+        worker_counts = [2 ** i for i in range(int(np.log2(os.cpu_count())) + 1)]
+
+    result = {}
+    for n_workers in worker_counts:
+        trainer = DistributedTrainer(model, n_workers=n_workers, intra_op_threads=intra_op_threads)
+        start_time = time.perf_counter()
+        worker_results = trainer._run(args, kwargs, None)
+        result[n_workers] = {"training_time": max(r["training_time"] for r in worker_results),
+                             "wall_time": time.perf_counter() - start_time}
+
+    baseline_workers = worker_counts[0]
+    baseline_time = result[baseline_workers]["training_time"]
+    for n_workers in worker_counts:
+        speedup = baseline_time / max(result[n_workers]["training_time"], 1e-12)
+        result[n_workers].update({"speedup": speedup, "efficiency": speedup * baseline_workers / n_workers})
+    return result
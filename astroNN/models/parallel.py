@@ -0,0 +1,223 @@
+###############################################################################
+#   parallel.py: multi-process sharded inference for astroNN models
+###############################################################################
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from astroNN.nn.utilities.shared_array import attach_shared_memory
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # python < 3.8
+    shared_memory = None
+
+# model and attached shared memory of a worker process
+_worker_model = None
+_worker_shm = {}
+
+
+def _create_shared_array(shape, dtype):
+    """
+    Create a shared memory block and an array backed by it
+
+    :return: shared memory and array
+    :rtype: tuple
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _attach_shared_array(spec):
+    """
+    Get an array backed by an existing shared memory block in a worker process
+
+    :param spec: (name of shared memory, shape, dtype)
+    :type spec: tuple
+    :return: array
+    :rtype: ndarray
+    """
+    name, shape, dtype = spec
+    if name not in _worker_shm:
+        # the parent process owns and unlinks the shared memory
+        _worker_shm[name] = attach_shared_memory(name)
+    return np.ndarray(shape, dtype=dtype, buffer=_worker_shm[name].buf)
+
+
+def _worker_init(folder, intra_op_threads, mc_num, mc_seed):
+    global _worker_model
+    import tensorflow as tf
+    from astroNN.models import load_folder
+
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    _worker_model = load_folder(folder)
+    if mc_num is not None:
+        _worker_model.mc_num = mc_num
+    if mc_seed is not None:
+        _worker_model.mc_seed = mc_seed
+
+
+def _worker_predict(input_specs, output_specs, start, end, batch_size):
+    """
+    Inference on [start:end] of inputs in shared memory, write results into outputs in shared memory or return them if
+    output_specs is None
+    """
+    for name in list(_worker_shm.keys()):  # release shared memory of previous predict() calls
+        if name not in [spec[0] for spec in list(input_specs.values()) + list((output_specs or {}).values())]:
+            _worker_shm.pop(name).close()
+
+    inputs = {name: _attach_shared_array(spec)[start:end] for name, spec in input_specs.items()}
+    inputs_err = inputs.pop("inputs_err", None)
+    input_data = inputs["input"] if list(inputs.keys()) == ["input"] else inputs
+    kwargs = {"batch_size": batch_size}
+    if inputs_err is not None:
+        kwargs["inputs_err"] = inputs_err
+    if getattr(_worker_model, "mc_seed", None) is not None:
+        # seeded Monte Carlo inference is keyed on global index so results do not depend on sharding
+        kwargs["sample_index"] = np.arange(start, end)
+    outputs = _worker_model.predict(input_data, **kwargs)
+
+    # Bayesian neural networks return prediction and dictionary of uncertainty
+    if isinstance(outputs, tuple):
+        results = {"prediction": outputs[0], **outputs[1]}
+    else:
+        results = {"prediction": outputs}
+
+    if output_specs is None:
+        return results
+    else:
+        for name, spec in output_specs.items():
+            _attach_shared_array(spec)[start:end] = results[name]
+        return None
+
+
+class ParallelPredictor(object):
+    """
+    | Sharded multi-process CPU inference for astroNN model folder (i.e. CNNBase, BayesianCNNBase and ConvVAEBase)
+    |
+    | Every worker process loads the model folder once with ``load_folder()``. Inputs are copied into shared memory
+    | once, workers read their shards from shared memory and write results into shared output buffers, so no data is
+    | pickled between processes.
+
+    :param folder: astroNN model folder
+    :type folder: str
+    :param n_workers: Number of worker processes, by default number of CPU
+    :type n_workers: Union([NoneType, int])
+    :param intra_op_threads: Number of Tensorflow intra-op threads of every worker, by default CPU evenly distributed
+    :type intra_op_threads: Union([NoneType, int])
+    :param mc_num: Number of Monte Carlo integration for Bayesian neural network, by default the one of the model
+    :type mc_num: Union([NoneType, int])
+    :param mc_seed: Seed of seeded Monte Carlo inference for Bayesian neural network (see ``mc_seed`` of the model) so
+        results are independent of the number of workers and shard size, by default the one of the model
+    :type mc_seed: Union([NoneType, int])
+    """
+
+    def __init__(self, folder, n_workers=None, intra_op_threads=None, mc_num=None, mc_seed=None):
+        if shared_memory is None:
+            raise ImportError("ParallelPredictor requires python 3.8 or above")
+        self.folder = os.path.abspath(folder)
+        self.n_workers = os.cpu_count() if n_workers is None else n_workers
+        if intra_op_threads is None:
+            intra_op_threads = max(os.cpu_count() // self.n_workers, 1)
+        self.intra_op_threads = intra_op_threads
+        self.mc_num = mc_num
+        self.mc_seed = mc_seed
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Shutdown worker processes
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            # spawn instead of fork because Tensorflow is not fork-safe
+            self._executor = ProcessPoolExecutor(max_workers=self.n_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_worker_init,
+                                                 initargs=(self.folder, self.intra_op_threads, self.mc_num,
+                                                           self.mc_seed))
+        return self._executor
+
+    def predict(self, input_data, inputs_err=None, batch_size=None, shard_size=None):
+        """
+        Use the neural network to do inference in parallel
+
+        :param input_data: Data to be inferred with neural network
+        :type input_data: Union([ndarray, dict])
+        :param inputs_err: Error for input_data (Bayesian neural network only), same shape with input_data.
+        :type inputs_err: Union([NoneType, ndarray])
+        :param batch_size: Batch size of every worker, by default the batch size of the model
+        :type batch_size: Union([NoneType, int])
+        :param shard_size: Number of data of each task sent to workers, by default data are splitted into 4 shards
+            per worker
+        :type shard_size: Union([NoneType, int])
+        :return: same as predict() of the model
+        :rtype: Union([ndarray, tuple])
+        """
+        inputs = dict(input_data) if isinstance(input_data, dict) else {"input": input_data}
+        if "input" not in inputs:
+            raise ValueError(f"astroNN expects input data dictionary has a key named 'input', but only "
+                             f"{list(inputs.keys())} are found.")
+        if inputs_err is not None:
+            inputs["inputs_err"] = inputs_err
+        total_num = inputs["input"].shape[0]
+        if total_num == 0:
+            # output structure is only known after running the model on data
+            raise ValueError("Please provide data to do inference, input_data is empty")
+        if shard_size is None:
+            shard_size = max(math.ceil(total_num / (self.n_workers * 4)), 1)
+        shards = [(i, min(i + shard_size, total_num)) for i in range(0, total_num, shard_size)]
+
+        shms, shared_data, outputs = [], None, {}
+        try:
+            input_specs = {}
+            for name, data in inputs.items():
+                data = np.ascontiguousarray(data)
+                shm, shared_data = _create_shared_array(data.shape, data.dtype)
+                shms.append(shm)
+                shared_data[:] = data
+                input_specs[name] = (shm.name, data.shape, data.dtype.str)
+
+            # run the first shard to get the output structure to allocate shared output buffers
+            first_results = self.executor.submit(_worker_predict, input_specs, None, *shards[0], batch_size).result()
+            output_specs = {}
+            for name, result in first_results.items():
+                result = np.asarray(result)
+                shm, outputs[name] = _create_shared_array((total_num,) + result.shape[1:], result.dtype)
+                shms.append(shm)
+                outputs[name][shards[0][0]:shards[0][1]] = result
+                output_specs[name] = (shm.name, outputs[name].shape, result.dtype.str)
+
+            futures = [self.executor.submit(_worker_predict, input_specs, output_specs, start, end, batch_size)
+                       for start, end in shards[1:]]
+            for future in futures:
+                future.result()  # raise exception in worker if any
+
+            # copy out of shared memory before it is released
+            results = {name: np.array(output) for name, output in outputs.items()}
+        finally:
+            # arrays backed by shared memory must be released before closing it
+            shared_data, outputs = None, None
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+        prediction = results.pop("prediction")
+        if results:  # Bayesian neural network
+            return prediction, results
+        else:
+            return prediction
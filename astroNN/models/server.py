@@ -0,0 +1,293 @@
+###############################################################################
+#   server.py: local micro-batching inference server for astroNN models
+###############################################################################
+import argparse
+import asyncio
+import collections
+import functools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+_HTTP_STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                500: "Internal Server Error"}
+
+
+class _InferenceRequest(object):
+    """
+    A prediction request waiting to be micro-batched
+    """
+    def __init__(self, input_data, inputs_err, future):
+        self.input_data = input_data
+        self.inputs_err = inputs_err
+        self.future = future
+        self.num_data = input_data.shape[0]
+        self.start_time = time.perf_counter()
+
+
+class InferenceServer(object):
+    """
+    | Local inference server for an astroNN model folder which collects concurrent requests into micro-batches
+    |
+    | The model folder is loaded once with ``load_folder()``. Requests arriving within ``max_latency`` seconds of the
+    | first waiting request are concatenated into one batch (up to ``max_batch_size`` data) and inferred at once, so
+    | per-call overhead is shared by many tiny requests. Requests are served as JSON over HTTP on localhost:
+    |
+    | ``POST /predict`` with body ``{"input": [[...], ...], "inputs_err": [[...], ...]}`` (``inputs_err`` is optional
+    | and only for Bayesian neural network) returns ``{"prediction": [[...], ...], ...}`` with uncertainty of Bayesian
+    | neural network if any
+    | ``GET /stats`` returns per-request latency and batch fill ratio statistics
+
+    :param folder: astroNN model folder
+    :type folder: str
+    :param host: Host to listen on
+    :type host: str
+    :param port: Port to listen on, 0 to pick a free port
+    :type port: int
+    :param max_batch_size: Maximum number of data in a micro-batch, by default the batch size of the model
+    :type max_batch_size: Union([NoneType, int])
+    :param max_latency: Maximum time in seconds a request waits for others to fill a micro-batch
+    :type max_latency: float
+    """
+
+    def __init__(self, folder, host="127.0.0.1", port=8000, max_batch_size=None, max_latency=0.01):
+        from astroNN.models import load_folder
+
+        self.folder = folder
+        self.host = host
+        self.port = port
+        self.model = load_folder(folder)
+        self.max_batch_size = self.model._inference_batch_size(max_batch_size)
+        self.max_latency = max_latency
+
+        self._queue = None
+        self._server = None
+        self._batching_task = None
+        # only one thread runs the model, so the event loop is never blocked by inference
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self.num_requests = 0
+        self.num_batches = 0
+        self._latency = collections.deque(maxlen=10000)
+        self._fill_ratio = collections.deque(maxlen=10000)
+
+    def _predict(self, input_data, inputs_err=None):
+        """
+        Run the model on a micro-batch and flatten outputs into a dictionary
+        """
+        kwargs = {"batch_size": self.max_batch_size}
+        if inputs_err is not None:
+            kwargs["inputs_err"] = inputs_err
+        outputs = self.model.predict(input_data, **kwargs)
+
+        # Bayesian neural networks return prediction and dictionary of uncertainty
+        if isinstance(outputs, tuple):
+            return {"prediction": outputs[0], **outputs[1]}
+        else:
+            return {"prediction": outputs}
+
+    def _check_shape(self, input_data):
+        """
+        Check shape of a data point of a request against the input shape of the model (with or without channel axis)
+
+        :param input_data: Data of a request
+        :type input_data: ndarray
+        :raises ValueError: if the shape does not match
+        """
+        expected_shape = self.model._input_shape["input"] if self.model._input_shape is not None else None
+        if expected_shape is None:
+            return None
+        expected_shape = tuple(expected_shape)
+        data_shape = tuple(input_data.shape[1:])
+        if data_shape != expected_shape and data_shape + (1,) != expected_shape:
+            raise ValueError(f"Shape of a data point {data_shape} does not match the input shape of the model "
+                             f"{expected_shape}")
+
+    async def predict(self, input_data, inputs_err=None):
+        """
+        Submit a prediction request to be micro-batched with other concurrent requests
+
+        :param input_data: Data to be inferred with neural network
+        :type input_data: ndarray
+        :param inputs_err: Error for input_data (Bayesian neural network only), same shape with input_data.
+        :type inputs_err: Union([NoneType, ndarray])
+        :return: dictionary of prediction (and uncertainty of Bayesian neural network)
+        :rtype: dict
+        :raises ValueError: if shape of the data does not match the input shape of the model
+        """
+        input_data = np.asarray(input_data, dtype=np.float32)
+        if input_data.ndim == 1:  # single data point
+            input_data = input_data[np.newaxis]
+        # a malformed request is rejected here instead of failing the whole micro-batch it would be concatenated into
+        self._check_shape(input_data)
+        if inputs_err is not None:
+            inputs_err = np.asarray(inputs_err, dtype=np.float32).reshape(input_data.shape)
+        request = _InferenceRequest(input_data, inputs_err, asyncio.get_running_loop().create_future())
+        await self._queue.put(request)
+        return await request.future
+
+    async def _batching_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [await self._queue.get()]
+            num_data = requests[0].num_data
+            deadline = loop.time() + self.max_latency
+            while num_data < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                requests.append(request)
+                num_data += request.num_data
+            await self._run_batch(requests, num_data)
+
+    async def _run_batch(self, requests, num_data):
+        try:
+            input_data = np.concatenate([i.input_data for i in requests])
+            if all(i.inputs_err is None for i in requests):
+                inputs_err = None
+            else:
+                inputs_err = np.concatenate([np.zeros_like(i.input_data) if i.inputs_err is None else i.inputs_err
+                                             for i in requests])
+            outputs = await asyncio.get_running_loop().run_in_executor(
+                self._executor, functools.partial(self._predict, input_data, inputs_err))
+        except Exception as e:
+            for request in requests:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        self.num_batches += 1
+        self._fill_ratio.append(num_data / self.max_batch_size)
+        start_idx = 0
+        for request in requests:
+            end_idx = start_idx + request.num_data
+            if not request.future.done():  # the client might have gone
+                request.future.set_result({name: output[start_idx:end_idx] for name, output in outputs.items()})
+            self.num_requests += 1
+            self._latency.append(time.perf_counter() - request.start_time)
+            start_idx = end_idx
+
+    def get_stats(self):
+        """
+        Statistics of recent requests for tuning ``max_batch_size`` and ``max_latency``
+
+        :return: number of requests and micro-batches served, per-request latency in seconds (mean, median and 99th
+            percentile) and mean batch fill ratio (number of data in a micro-batch over max_batch_size)
+        :rtype: dict
+        """
+        stats = {"requests": self.num_requests, "batches": self.num_batches,
+                 "max_batch_size": self.max_batch_size, "max_latency": self.max_latency}
+        if len(self._latency) > 0:
+            latency = np.array(self._latency)
+            stats.update({"latency_mean": float(np.mean(latency)),
+                          "latency_p50": float(np.percentile(latency, 50)),
+                          "latency_p99": float(np.percentile(latency, 99)),
+                          "fill_ratio_mean": float(np.mean(self._fill_ratio))})
+        return stats
+
+    async def _respond(self, writer, status, content):
+        body = json.dumps(content).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {_HTTP_STATUS[status]}\r\n"
+                     f"Content-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            method, path, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            if path == "/stats":
+                await self._respond(writer, 200, self.get_stats())
+            elif path != "/predict":
+                await self._respond(writer, 404, {"error": f"Unknown path {path}"})
+            elif method != "POST":
+                await self._respond(writer, 405, {"error": "Only POST is supported for /predict"})
+            else:
+                try:
+                    request = json.loads(body)
+                    outputs = await self.predict(request["input"], request.get("inputs_err", None))
+                except (ValueError, KeyError, TypeError) as e:
+                    await self._respond(writer, 400, {"error": f"Invalid request: {e}"})
+                except Exception as e:
+                    await self._respond(writer, 500, {"error": str(e)})
+                else:
+                    await self._respond(writer, 200, {name: output.tolist() for name, output in outputs.items()})
+        except (ValueError, asyncio.IncompleteReadError):  # malformed HTTP request
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        """
+        Start listening and micro-batching in the running event loop
+        """
+        self._queue = asyncio.Queue()
+        self._batching_task = asyncio.ensure_future(self._batching_loop())
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        # in case port 0 is used to pick a free port
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """
+        Stop listening and micro-batching
+        """
+        self._server.close()
+        await self._server.wait_closed()
+        self._batching_task.cancel()
+        try:
+            await self._batching_task
+        except asyncio.CancelledError:
+            pass
+
+    async def serve_forever(self):
+        """
+        Start the server and serve until cancelled
+        """
+        await self.start()
+        print(f"Serving {self.folder} on http://{self.host}:{self.port}")
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+            self._executor.shutdown()
+
+
+def main(argv=None):
+    """
+    Console entry point ``astronn-serve`` to serve an astroNN model folder
+    """
+    parser = argparse.ArgumentParser(description="Local micro-batching inference server for astroNN model folder")
+    parser.add_argument("folder", help="astroNN model folder")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on (default: 8000)")
+    parser.add_argument("--max-batch-size", type=int, default=None,
+                        help="Maximum number of data in a micro-batch (default: batch size of the model)")
+    parser.add_argument("--max-latency-ms", type=float, default=10.,
+                        help="Maximum time in milliseconds a request waits to be batched (default: 10)")
+    args = parser.parse_args(argv)
+
+    server = InferenceServer(args.folder, host=args.host, port=args.port, max_batch_size=args.max_batch_size,
+                             max_latency=args.max_latency_ms / 1000.)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
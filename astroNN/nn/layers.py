@@ -5,6 +5,7 @@ from packaging import version
 from tensorflow.python.framework import tensor_shape
 from tensorflow.python.ops.parallel_for.control_flow_ops import pfor
 
+from astroNN.config import MAGIC_NUMBER
 from astroNN.nn import intpow_avx2
 
 # from tensorflow_probability.python.layers import util as tfp_layers_util
@@ -80,6 +81,72 @@ class VAESampling(Layer):
         return z_mean + tf.exp(0.5 * z_log_var) * epsilon
 
 
+class _MCRandomContext(object):
+    """
+    | Keys of random numbers drawn by Monte Carlo layers in seeded Monte Carlo inference (see FastMCInference)
+    |
+    | Every stochastic layer traced inside the context draws its noise from stateless random ops keyed on
+    | (seed, layer, sample index, draw index) instead of stateful random ops, so the noise of a data point does not
+    | depend on the batch it is in. Layers are numbered in the order they are traced which is the same for the same
+    | model. Supports up to 1024 stochastic layers and 2**20 Monte Carlo draws.
+
+    :param seed: Global seed
+    :type seed: int
+    :param sample_index: Global index of every data point in the batch, with shape (batch size,)
+    :type sample_index: tf.Tensor
+    :param draw_index: Index of the Monte Carlo draw
+    :type draw_index: Union[int, tf.Tensor]
+    """
+    active = None  # context currently being traced
+
+    def __init__(self, seed, sample_index, draw_index):
+        self.seed = seed
+        self.sample_index = sample_index
+        self.draw_index = draw_index
+        self.layer_count = 0
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = _MCRandomContext.active
+        _MCRandomContext.active = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _MCRandomContext.active = self._previous
+
+    def next_seeds(self):
+        """
+        :return: Stateless random seeds of every data point in the batch for the next stochastic layer
+        :rtype: tf.Tensor
+        """
+        layer_key = tf.constant(self.seed * 1024 + self.layer_count, dtype=tf.int64)
+        self.layer_count += 1
+        sample_key = tf.cast(self.sample_index, tf.int64) * 2 ** 20 + tf.cast(self.draw_index, tf.int64)
+        return tf.stack([tf.fill(tf.shape(sample_key), layer_key), sample_key], axis=-1)
+
+
+def _mc_random(shape, distribution="uniform", dtype=tf.float32, **kwargs):
+    """
+    Random numbers for Monte Carlo layers, drawn from stateless random ops per data point in seeded Monte Carlo
+    inference or from stateful random ops otherwise
+
+    :param shape: Shape of random numbers, the first dimension is the batch dimension
+    :type shape: Union[tf.Tensor, tuple]
+    :param distribution: "uniform" or "normal"
+    :type distribution: str
+    :return: Random numbers
+    :rtype: tf.Tensor
+    """
+    context = _MCRandomContext.active
+    if context is None:
+        return getattr(tf.random, distribution)(shape, dtype=dtype, **kwargs)
+    else:
+        stateless_random = getattr(tf.random, f"stateless_{distribution}")
+        shape = tf.convert_to_tensor(shape)
+        return tf.map_fn(lambda seed: stateless_random(shape[1:], seed=seed, dtype=dtype, **kwargs),
+                         context.next_seeds(), fn_output_signature=dtype)
+
+
 class MCDropout(Layer):
     """
     Dropout Layer for Bayesian Neural Network, this layer will always on regardless the learning phase flag
@@ -123,6 +190,10 @@ class MCDropout(Layer):
         noise_shape = self._get_noise_shape(inputs)
         if self.disable_layer is True:
             return inputs
+        elif _MCRandomContext.active is not None:  # seeded Monte Carlo inference
+            noise_shape = tf.shape(inputs) if noise_shape is None else noise_shape
+            keep_mask = tf.cast(_mc_random(noise_shape, dtype=inputs.dtype) >= self.rate, inputs.dtype)
+            return inputs * keep_mask / (1. - self.rate)
         else:
             return tf.nn.dropout(x=inputs,
                                  rate=self.rate,
@@ -226,7 +297,8 @@ class MCGaussianDropout(Layer):
         if self.disable_layer is True:
             return inputs
         else:
-            return inputs * tf.random.normal(shape=tf.shape(inputs), mean=1.0, stddev=stddev)
+            return inputs * _mc_random(tf.shape(inputs), distribution="normal", dtype=inputs.dtype, mean=1.0,
+                                       stddev=stddev)
 
     def get_config(self):
         """
@@ -309,7 +381,7 @@ class MCConcreteDropout(Wrapper):
         eps = epsilon()
         self.p_call = tf.nn.sigmoid(self.p_logit)
 
-        unif_noise = tf.random.uniform(shape=tf.shape(x))
+        unif_noise = _mc_random(tf.shape(x), dtype=x.dtype)
         drop_prob = (tf.math.log(self.p_call + eps) - tf.math.log(1. - self.p_call + eps) + tf.math.log(unif_noise + eps) - tf.math.log(
             1. - unif_noise + eps))
         drop_prob = tf.nn.sigmoid(drop_prob / 0.1)
@@ -423,7 +495,11 @@ class ErrorProp(Layer):
         if training is None:
             training = tfk.backend.learning_phase()
 
-        noised = tf.random.normal([1], mean=inputs[0], stddev=inputs[1])
+        if _MCRandomContext.active is None:
+            noised = tf.random.normal([1], mean=inputs[0], stddev=inputs[1])
+        else:  # seeded Monte Carlo inference, noise has to be drawn per data point
+            noised = inputs[0] + inputs[1] * _mc_random(tf.shape(inputs[0]), distribution="normal",
+                                                        dtype=inputs[0].dtype)
         output_tensor = tf.where(tf.equal(training, True), inputs[0], noised)
         output_tensor._uses_learning_phase = True
         return output_tensor
@@ -441,12 +517,115 @@ class ErrorProp(Layer):
         return input_shape
 
 
+# layers which output differently every time they are called in inference
+_STOCHASTIC_LAYERS = (MCDropout, MCGaussianDropout, MCConcreteDropout, ErrorProp, VAESampling)
+
+
+class _UnsupportedGraph(Exception):
+    """
+    Keras graph of a model cannot be walked, e.g. private Keras internals differ in this Keras version
+    """
+    pass
+
+
+def _inbound_layer_and_inputs(tensor):
+    """
+    Layer which outputs a symbolic Keras tensor and the input tensors of that call, read from private Keras internals
+
+    :param tensor: symbolic Keras tensor
+    :type tensor: tf.Tensor
+    :return: (layer, list of input tensors)
+    :rtype: tuple
+    """
+    try:
+        layer, node_index, _ = tensor._keras_history
+        node_inputs = layer._inbound_nodes[node_index].keras_inputs
+    except (AttributeError, TypeError, ValueError, IndexError, KeyError) as e:
+        raise _UnsupportedGraph(f"Cannot find the layer which outputs {tensor}") from e
+    return layer, tf.nest.flatten(node_inputs)
+
+
+def _split_deterministic_prefix(model):
+    """
+    | Split a functional model at its first stochastic layers into a deterministic prefix model and a stochastic
+    | suffix model, such that suffix(prefix(x)) is model(x)
+    |
+    | Only layers in ``_STOCHASTIC_LAYERS`` are regarded as stochastic, every other layer is assumed to be
+    | deterministic. The graph is walked with private Keras attributes ``_keras_history`` and ``_inbound_nodes`` of
+    | symbolic tensors and layers, if they are not available the model is not split.
+
+    :param model: Keras functional model
+    :type model: keras.Model
+    :return: (prefix model, suffix model) or None if there is no deterministic prefix to be split or the graph
+        cannot be walked, then the full model should be used
+    :rtype: Union[NoneType, tuple]
+    """
+    def is_stochastic_layer(layer):
+        return any(isinstance(i, _STOCHASTIC_LAYERS) for i in [layer] + list(getattr(layer, 'submodules', [])))
+
+    depends_on_stochastic = {}  # id of tensor -> whether the tensor depends on any stochastic layer
+    boundary = []  # deterministic tensors consumed by stochastic part of the graph
+
+    def add_boundary(tensor):
+        if not any(tensor is i for i in boundary):
+            boundary.append(tensor)
+
+    def visit(tensor):
+        if id(tensor) not in depends_on_stochastic:
+            layer, node_inputs = _inbound_layer_and_inputs(tensor)
+            parents = [visit(i) for i in node_inputs]
+            stochastic = is_stochastic_layer(layer) or any(parents)
+            if stochastic:
+                for node_input, parent in zip(node_inputs, parents):
+                    if not parent:
+                        add_boundary(node_input)
+            depends_on_stochastic[id(tensor)] = stochastic
+        return depends_on_stochastic[id(tensor)]
+
+    try:
+        for output in model.outputs:
+            if not visit(output):
+                add_boundary(output)  # deterministic output will be passed through the suffix model as is
+        if all(any(i is j for j in model.inputs) for i in boundary):
+            return None  # nothing deterministic before the stochastic layers
+        prefix_model = tfk.models.Model(inputs=model.inputs, outputs=boundary)
+        suffix_model = tfk.models.Model(inputs=boundary, outputs=model.outputs)
+    except (_UnsupportedGraph, AttributeError, ValueError, RecursionError):
+        # not a functional model, the graph is too exotic or Keras internals are not as expected, do not split
+        return None
+
+    return prefix_model, suffix_model
+
+
 class FastMCInference():
     """
     Turn a model for fast Monte Carlo (Dropout, Flipout, etc) Inference on GPU
 
     :param n: Number of Monte Carlo integration
     :type n: int
+    :param strategy: | "pfor" to draw all n samples at once in a parallelized loop which is the fastest
+                     | "chunked" to draw chunk_size samples at once and accumulate mean and variance online so peak
+                     | memory usage does not scale with n
+                     | "auto" to use "pfor" unless its estimated memory usage exceeds memory_budget
+    :type strategy: str
+    :param chunk_size: Number of Monte Carlo samples drawn at once for "chunked" strategy
+    :type chunk_size: int
+    :param memory_budget: Memory budget in bytes for "auto" strategy
+    :type memory_budget: Union[NoneType, int]
+    :param batch_size: Batch size expected to be used for inference for "auto" strategy
+    :type batch_size: Union[NoneType, int]
+    :param deterministic_prefix: | Whether to run layers before the first stochastic layers (e.g. MCDropout) only
+                                 | once and repeat only the rest of the model n times. Only astroNN Monte Carlo
+                                 | layers are known to be stochastic, any other stochastic layer (e.g. keras Dropout
+                                 | called with training=True or tensorflow_probability Flipout layers) in the prefix
+                                 | would be computed once and uncertainty would be underestimated, so only enable it
+                                 | if the model has no other stochastic layer.
+    :type deterministic_prefix: bool
+    :param seed: | If not None, Monte Carlo layers draw noise from stateless random ops keyed on
+                 | (seed, sample index, draw index) so results of a data point are reproducible regardless of how
+                 | data are batched. The accelerated model then takes an extra int64 input "sample_index" of the
+                 | global index of every data point. Slower than stateful random ops.
+    :type seed: Union[NoneType, int]
     :return: A layer
     :rtype: object
     :History: 
@@ -455,8 +634,56 @@ class FastMCInference():
 
     """
 
-    def __init__(self, n, **kwargs):
+    def __init__(self, n, strategy="pfor", chunk_size=10, memory_budget=None, batch_size=None,
+                 deterministic_prefix=False, seed=None, **kwargs):
         self.n = n
+        self.seed = seed
+        self.deterministic_prefix = deterministic_prefix
+        self.strategy = strategy
+        self.chunk_size = chunk_size
+        self.memory_budget = memory_budget
+        self.batch_size = batch_size
+
+    def memory_estimate(self, model):
+        """
+        Rough estimation of memory usage of activations in bytes with "pfor" strategy
+
+        :param model: Keras model to be accelerated
+        :type model: Union[keras.Model, keras.Sequential]
+        :return: Estimated memory usage in bytes
+        :rtype: int
+        """
+        activation_size = 0
+        for layer in model.layers:
+            try:
+                outputs = tf.nest.flatten(layer.output)
+            except AttributeError:  # layer used multiple times in the graph has no unique output
+                continue
+            for output in outputs:
+                output_size = output.dtype.size
+                for i in output.shape[1:]:
+                    output_size *= 1 if i is None else i
+                activation_size += output_size
+        return self.n * (1 if self.batch_size is None else self.batch_size) * activation_size
+
+    def select_strategy(self, model):
+        """
+        Get the strategy to be used to accelerate a model
+
+        :param model: Keras model to be accelerated
+        :type model: Union[keras.Model, keras.Sequential]
+        :return: "pfor" or "chunked"
+        :rtype: str
+        """
+        if self.strategy == "auto":
+            if self.memory_budget is not None and self.memory_estimate(model) > self.memory_budget:
+                return "chunked"
+            else:
+                return "pfor"
+        elif self.strategy in ["pfor", "chunked"]:
+            return self.strategy
+        else:
+            raise ValueError(f'Unknown strategy {self.strategy}, only "pfor", "chunked" and "auto" are supported')
 
     def __call__(self, model):
         """
@@ -472,8 +699,26 @@ class FastMCInference():
         new_input = tfk.layers.Input(shape=(self.model.input_shape[1:]), name='input')
         mc_model = tfk.models.Model(inputs=self.model.inputs, outputs=self.model.outputs)
 
-        mc = FastMCInferenceMeanVar()(FastMCInferenceV2_internal(mc_model, self.n)(new_input))
-        new_mc_model = tfk.models.Model(inputs=new_input, outputs=mc)
+        split_models = _split_deterministic_prefix(self.model) if self.deterministic_prefix else None
+        if split_models is None:
+            mc_input = new_input
+        else:  # run the deterministic prefix once and only repeat the stochastic suffix
+            prefix_model, mc_model = split_models
+            mc_input = prefix_model(new_input)
+
+        if self.seed is None:
+            new_inputs = new_input
+        else:  # global index of data points to key the random numbers on
+            sample_index = tfk.layers.Input(shape=(), dtype=tf.int64, name='sample_index')
+            new_inputs = [new_input, sample_index]
+            mc_input = [mc_input, sample_index]
+
+        if self.select_strategy(mc_model) == "pfor":
+            mc = FastMCInferenceMeanVar()(FastMCInferenceV2_internal(mc_model, self.n, seed=self.seed)(mc_input))
+        else:
+            mc = FastMCInferenceChunked_internal(mc_model, self.n, chunk_size=self.chunk_size,
+                                                 seed=self.seed)(mc_input)
+        new_mc_model = tfk.models.Model(inputs=new_inputs, outputs=mc)
 
         return new_mc_model
 
@@ -482,14 +727,31 @@ class FastMCInference():
         :return: Dictionary of configuration
         :rtype: dict
         """
-        config = {'n': self.n}
+        config = {'n': self.n,
+                  'strategy': self.strategy,
+                  'chunk_size': self.chunk_size,
+                  'memory_budget': self.memory_budget,
+                  'batch_size': self.batch_size,
+                  'deterministic_prefix': self.deterministic_prefix,
+                  'seed': self.seed}
         return config
 
+def _mc_draw(model, inputs, draw_index, seed=None, sample_index=None):
+  """
+  Draw a Monte Carlo sample from model, seeded by (seed, sample index, draw index) if seed is not None
+  """
+  if seed is None:
+    return model(inputs)
+  with _MCRandomContext(seed, sample_index, draw_index):
+    return model(inputs)
+
+
 class FastMCInferenceV2_internal(Wrapper):
-  def __init__(self, model, n=100, **kwargs):
+  def __init__(self, model, n=100, seed=None, **kwargs):
     if isinstance(model, tfk.Model) or isinstance(model, tfk.Sequential):
         self.layer = model
         self.n = n
+        self.seed = seed
     else:
         raise TypeError(f'FastMCInference expects tensorflow.keras Model, you gave {type(model)}')
     
@@ -502,13 +764,94 @@ class FastMCInferenceV2_internal(Wrapper):
     return self.layer.output_shape
 
   def call(self, inputs, training=None, mask=None):
+    sample_index = None
+    if self.seed is not None:
+      inputs, sample_index = inputs
+
     def loop_fn(i):
-      return self.layer(inputs)
+      return _mc_draw(self.layer, inputs, i, seed=self.seed, sample_index=sample_index)
 
     outputs = pfor(loop_fn, self.n, parallel_iterations=self.n)
     return outputs
 
 
+def _stack_mean_var(mean, var):
+    """
+    Stack mean and variance of Monte Carlo samples on the last axis because keras can only handle one output, axes
+    of length one are squeezed away except the batch axis so a batch of a single data point keeps its batch axis
+
+    :param mean: mean with shape (batch, ...)
+    :type mean: tf.Tensor
+    :param var: variance with the same shape as mean
+    :type var: tf.Tensor
+    :return: stacked mean and variance
+    :rtype: tf.Tensor
+    """
+    axes = [i for i, size in enumerate(mean.shape) if i > 0 and size == 1]
+    if axes:
+        mean, var = tf.squeeze(mean, axis=axes), tf.squeeze(var, axis=axes)
+    return tf.stack((mean, var), axis=-1)
+
+
+class FastMCInferenceChunked_internal(Wrapper):
+  """
+  Draw Monte Carlo samples chunk by chunk in a while loop and accumulate mean and variance online, so only chunk_size
+  samples are materialized at once. Output is the same as FastMCInferenceMeanVar applied on all samples.
+  """
+  def __init__(self, model, n=100, chunk_size=10, seed=None, **kwargs):
+    if isinstance(model, tfk.Model) or isinstance(model, tfk.Sequential):
+        self.layer = model
+        self.n = n
+        self.chunk_size = min(chunk_size, n)
+        self.seed = seed
+    else:
+        raise TypeError(f'FastMCInference expects tensorflow.keras Model, you gave {type(model)}')
+
+    super(FastMCInferenceChunked_internal, self).__init__(model, **kwargs)
+
+  def build(self, input_shape):
+    self.built = True
+
+  def compute_output_shape(self, input_shape):
+    return tuple(self.layer.output_shape) + (2,)
+
+  def call(self, inputs, training=None, mask=None):
+    sample_index = None
+    if self.seed is not None:
+      inputs, sample_index = inputs
+
+    def chunk_moments(size, offset):
+      # mean and sum of squared difference from the mean of a chunk of samples, draws are numbered from offset
+      def loop_fn(i):
+        return _mc_draw(self.layer, inputs, offset + i, seed=self.seed, sample_index=sample_index)
+
+      # accumulate in the precision of this layer even if the model computes in half precision
+      samples = tf.cast(pfor(loop_fn, size, parallel_iterations=size), self.compute_dtype)
+      mean, var = tf.nn.moments(samples, axes=0)
+      return mean, var * size
+
+    def merge(count, mean, m2, size, chunk_mean, chunk_m2):
+      # Chan et al. parallel algorithm to merge statistics of a chunk of samples
+      new_count = count + size
+      delta = chunk_mean - mean
+      return mean + delta * size / new_count, m2 + chunk_m2 + delta ** 2 * count * size / new_count
+
+    num_chunk, remainder = divmod(self.n, self.chunk_size)
+
+    def body(i, mean, m2):
+      chunk_mean, chunk_m2 = chunk_moments(self.chunk_size, i * self.chunk_size)
+      mean, m2 = merge(tf.cast(i * self.chunk_size, mean.dtype), mean, m2, self.chunk_size, chunk_mean, chunk_m2)
+      return i + 1, mean, m2
+
+    mean, m2 = chunk_moments(self.chunk_size, 0)
+    _, mean, m2 = tf.while_loop(lambda i, mean, m2: i < num_chunk, body, (tf.constant(1), mean, m2))
+    if remainder > 0:
+      chunk_mean, chunk_m2 = chunk_moments(remainder, num_chunk * self.chunk_size)
+      mean, m2 = merge(tf.cast(num_chunk * self.chunk_size, mean.dtype), mean, m2, remainder, chunk_mean, chunk_m2)
+
+    return _stack_mean_var(mean, m2 / self.n)
+
+
 class FastMCInferenceMeanVar(Layer):
     """
     Take mean and variance of the results of a TimeDistributed layer, assuming axis=1 is the timestamp axis
@@ -546,9 +889,101 @@ class FastMCInferenceMeanVar(Layer):
         :return: Tensor after applying the layer
         :rtype: tf.Tensor
         """
-        # need to stack because keras can only handle one output
         mean, var = tf.nn.moments(inputs, axes=0)
-        return tf.stack((tf.squeeze([mean]), tf.squeeze([var])), axis=-1)
+        return _stack_mean_var(mean, var)
+
+
+class FastMCInferencePostProcess(Layer):
+    """
+    | Turn mean and variance of ``FastMCInference`` of a Bayesian neural network, whose output is prediction
+    | concatenated with predictive log variance, to de-normalized prediction, total, model and predictive uncertainty
+    |
+    | For regression, uncertainties are standard deviations. For classification, prediction is the predicted class and
+    | model uncertainty is the entropy.
+
+    :param task: "regression", "classification" or "binary_classification"
+    :type task: str
+    :param labels_mean: Mean of labels to de-normalize prediction
+    :type labels_mean: Union[float, list, ndarray]
+    :param labels_std: Standard derivation of labels to de-normalize prediction
+    :type labels_std: Union[float, list, ndarray]
+    :return: A layer
+    :rtype: object
+    """
+
+    def __init__(self, task="regression", labels_mean=0., labels_std=1., name=None, **kwargs):
+        if task not in ["regression", "classification", "binary_classification"]:
+            raise AttributeError('Unknown Task')
+        self.task = task
+        self.labels_mean = labels_mean
+        self.labels_std = labels_std
+        if not name:
+            prefix = self.__class__.__name__
+            name = prefix + '_' + str(tfk.backend.get_uid(prefix))
+        super().__init__(name=name, **kwargs)
+
+    def compute_output_shape(self, input_shape):
+        output_shape = (input_shape[0], input_shape[-2] // 2)
+        if self.task == "classification":
+            return [(input_shape[0],)] * 4
+        else:
+            return [output_shape] * 4
+
+    def get_config(self):
+        """
+        :return: Dictionary of configuration
+        :rtype: dict
+        """
+        config = {'task': self.task,
+                  'labels_mean': tf.constant(self.labels_mean).numpy().tolist(),
+                  'labels_std': tf.constant(self.labels_std).numpy().tolist()}
+        base_config = super().get_config()
+        return {**dict(base_config.items()), **config}
+
+    def call(self, inputs, training=None):
+        """
+        :Note: Equivalent to __call__()
+        :param inputs: Tensor of stacked mean and variance with shape (batch, 2 * number of outputs, 2)
+        :type inputs: tf.Tensor
+        :return: list of Tensor of prediction, total, model and predictive uncertainty
+        :rtype: list[tf.Tensor]
+        """
+        # FastMCInferenceMeanVar squeezes batch dimension away if there is only one data
+        inputs = tf.reshape(inputs, [-1, inputs.shape[-2], 2])
+        half_first_dim = inputs.shape[-2] // 2
+        labels_mean = tf.cast(self.labels_mean, inputs.dtype)
+        labels_std = tf.cast(self.labels_std, inputs.dtype)
+
+        norm_predictions = inputs[:, :half_first_dim, 0]  # mean prediction
+        predictions = tf.where(tf.equal(norm_predictions, MAGIC_NUMBER),
+                               tf.cast(MAGIC_NUMBER, inputs.dtype),
+                               norm_predictions * labels_std + labels_mean)
+        mc_dropout_var = inputs[:, :half_first_dim, 1] * labels_std ** 2  # model uncertainty
+        predictions_var = tf.exp(inputs[:, half_first_dim:, 0]) * labels_std ** 2  # predictive uncertainty
+
+        if self.task == 'regression':
+            # epistemic plus aleatoric uncertainty, and convert variance back to standard derivation
+            pred_uncertainty = tf.sqrt(predictions_var + mc_dropout_var)
+            mc_dropout_uncertainty = tf.sqrt(mc_dropout_var)
+            predictive_uncertainty = tf.sqrt(predictions_var)
+        elif self.task == 'classification':
+            # we want entropy for classification uncertainty
+            predicted_class = tf.argmax(predictions, axis=1)
+            mc_dropout_uncertainty = - tf.reduce_sum(predictions * tf.math.log(predictions), axis=1)
+            # center variance
+            predictive_uncertainty = tf.gather(predictions_var - 1., predicted_class, axis=1, batch_dims=1)
+            pred_uncertainty = mc_dropout_uncertainty + predictive_uncertainty
+            # We only want the predicted class back
+            predictions = predicted_class
+        else:
+            # we want entropy for classification uncertainty, so need prediction in logits space
+            mc_dropout_uncertainty = - predictions * tf.math.log(predictions)
+            # need to activate before round to int so that the prediction is always 0 or 1
+            predictions = tf.math.rint(tf.sigmoid(predictions))
+            predictive_uncertainty = predictions_var
+            pred_uncertainty = mc_dropout_uncertainty + predictions_var
+
+        return [predictions, pred_uncertainty, mc_dropout_uncertainty, predictive_uncertainty]
 
 
 class FastMCRepeat(Layer):
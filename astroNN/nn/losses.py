@@ -34,16 +34,39 @@ def magic_correction_term(y_true):
         | 2018-Feb-17 - Updated - Henry Leung (University of Toronto)
     """
 
+    # same dtype as the losses it corrects, e.g. float64 or float16 under mixed precision
+    dtype = y_true.dtype if y_true.dtype.is_floating else tf.float32
     num_nonmagic = tf.reduce_sum(
-        tf.cast(tf.logical_not(magic_num_check(y_true)), tf.float32), axis=-1
+        tf.cast(tf.logical_not(magic_num_check(y_true)), dtype), axis=-1
     )
-    num_magic = tf.reduce_sum(tf.cast(magic_num_check(y_true), tf.float32), axis=-1)
+    num_magic = tf.reduce_sum(tf.cast(magic_num_check(y_true), dtype), axis=-1)
 
     # If no magic number, then num_zero=0 and whole expression is just 1 and get back our good old loss
     # If num_nonzero is 0, that means we don't have any information, then set the correction term to ones
     return (num_nonmagic + num_magic) / num_nonmagic
 
 
+def loss_precision(y_true, *tensors):
+    """
+    | Cast ground truth and other tensors to a common dtype which is numerically safe to calculate losses
+    |
+    | Half precision (float16 or bfloat16 under mixed precision) is upcasted to float32 because exp() overflows and
+    | epsilon underflows in half precision, float64 is kept. Magic number in ground truth is restored exactly as it is
+    | not representable in half precision.
+
+    :param y_true: Ground Truth
+    :type y_true: Union(tf.Tensor, tf.Variable)
+    :param tensors: Other tensors such as prediction
+    :type tensors: Union(tf.Tensor, tf.Variable)
+    :return: list of casted tensors with ground truth first
+    :rtype: list
+    """
+    tensors = [tf.convert_to_tensor(i) for i in (y_true,) + tensors]
+    dtype = tf.float64 if any(i.dtype == tf.float64 for i in tensors) else tf.float32
+    y_true = tf.where(magic_num_check(tensors[0]), tf.cast(MAGIC_NUMBER, dtype), tf.cast(tensors[0], dtype))
+    return [y_true] + [tf.cast(i, dtype) for i in tensors[1:]]
+
+
 def weighted_loss(losses, sample_weight=None):
     """
     Calculate sample-weighted losses from losses
@@ -110,6 +133,7 @@ def mean_squared_error(y_true, y_pred, sample_weight=None):
     :rtype: tf.Tensor
     :History: 2017-Nov-16 - Written - Henry Leung (University of Toronto)
     """
+    y_true, y_pred = loss_precision(y_true, y_pred)
     losses = tf.reduce_mean(
         tf.where(
             magic_num_check(y_true), tf.zeros_like(y_true), tf.square(y_true - y_pred)
@@ -133,6 +157,7 @@ def mean_squared_reconstruction_error(y_true, y_pred, sample_weight=None):
     :rtype: tf.Tensor
     :History: 2022-May-05 - Written - Henry Leung (University of Toronto)
     """
+    y_true, y_pred = loss_precision(y_true, y_pred)
     raw_loss = tf.where(magic_num_check(y_true), tf.zeros_like(y_true), tf.square(y_true - y_pred))
     losses = weighted_loss(tf.reduce_mean(raw_loss, axis=-1), sample_weight)
     return tf.reduce_mean(tf.reduce_sum(losses, axis=-1))
@@ -212,12 +237,17 @@ def robust_mse(y_true, y_pred, variance, labels_err, sample_weight=None):
     :rtype: tf.Tensor
     :History: 2018-April-07 - Written - Henry Leung (University of Toronto)
     """
+    y_true, y_pred, variance, labels_err = loss_precision(y_true, y_pred, variance, labels_err)
     # labels_err still contains magic_number
     labels_err_y = tf.where(
-        magic_num_check(y_true), tf.zeros_like(y_true), tf.cast(labels_err, tf.float32)
+        magic_num_check(y_true), tf.zeros_like(y_true), labels_err
     )
     # Neural Net is predicting log(var), so take exp, takes account the target variance, and take log back
-    y_pred_corrected = tf.math.log(tf.exp(variance) + tf.square(labels_err_y))
+    # i.e. log(exp(variance) + labels_err^2) but evaluated as log-sum-exp so exp(variance) never overflows
+    log_labels_var = tf.math.log(tf.square(labels_err_y))
+    y_pred_corrected = tf.maximum(variance, log_labels_var) + tf.math.log1p(
+        tf.exp(-tf.abs(variance - log_labels_var))
+    )
 
     wrapper_output = tf.where(
         magic_num_check(y_true),
@@ -244,6 +274,7 @@ def mean_absolute_error(y_true, y_pred, sample_weight=None):
     :rtype: tf.Tensor
     :History: 2018-Jan-14 - Written - Henry Leung (University of Toronto)
     """
+    y_true, y_pred = loss_precision(y_true, y_pred)
     losses = tf.reduce_mean(
         tf.where(
             magic_num_check(y_true), tf.zeros_like(y_true), tf.abs(y_true - y_pred)
@@ -267,8 +298,9 @@ def mean_absolute_percentage_error(y_true, y_pred, sample_weight=None):
     :rtype: tf.Tensor
     :History: 2018-Feb-17 - Written - Henry Leung (University of Toronto)
     """
-    tf_inf = tf.cast(tf.constant(1) / tf.constant(0), tf.float32)
-    epsilon_tensor = tf.cast(tf.constant(tfk.backend.epsilon()), tf.float32)
+    y_true, y_pred = loss_precision(y_true, y_pred)
+    tf_inf = tf.cast(tf.constant(1) / tf.constant(0), y_true.dtype)
+    epsilon_tensor = tf.cast(tf.constant(tfk.backend.epsilon()), y_true.dtype)
 
     diff = tf.abs(
         (y_true - y_pred) / tf.clip_by_value(tf.abs(y_true), epsilon_tensor, tf_inf)
@@ -294,8 +326,9 @@ def median_absolute_percentage_error(y_true, y_pred, sample_weight=None):
     :rtype: tf.Tensor
     :History: 2020-Aug-13 - Written - Henry Leung (University of Toronto)
     """
-    tf_inf = tf.cast(tf.constant(1) / tf.constant(0), tf.float32)
-    epsilon_tensor = tf.cast(tf.constant(tfk.backend.epsilon()), tf.float32)
+    y_true, y_pred = loss_precision(y_true, y_pred)
+    tf_inf = tf.cast(tf.constant(1) / tf.constant(0), y_true.dtype)
+    epsilon_tensor = tf.cast(tf.constant(tfk.backend.epsilon()), y_true.dtype)
 
     diff = tf.abs(
         (y_true - y_pred) / tf.clip_by_value(tf.abs(y_true), epsilon_tensor, tf_inf)
@@ -319,8 +352,9 @@ def mean_squared_logarithmic_error(y_true, y_pred, sample_weight=None):
     :rtype: tf.Tensor
     :History: 2018-Feb-17 - Written - Henry Leung (University of Toronto)
     """
-    tf_inf = tf.cast(tf.constant(1) / tf.constant(0), tf.float32)
-    epsilon_tensor = tf.cast(tf.constant(tfk.backend.epsilon()), tf.float32)
+    y_true, y_pred = loss_precision(y_true, y_pred)
+    tf_inf = tf.cast(tf.constant(1) / tf.constant(0), y_true.dtype)
+    epsilon_tensor = tf.cast(tf.constant(tfk.backend.epsilon()), y_true.dtype)
 
     first_log = tf.math.log(tf.clip_by_value(y_pred, epsilon_tensor, tf_inf) + 1.0)
     second_log = tf.math.log(tf.clip_by_value(y_true, epsilon_tensor, tf_inf) + 1.0)
@@ -347,6 +381,7 @@ def mean_error(y_true, y_pred, sample_weight=None):
     :rtype: tf.Tensor
     :History: 2018-May-22 - Written - Henry Leung (University of Toronto)
     """
+    y_true, y_pred = loss_precision(y_true, y_pred)
     losses = tf.reduce_mean(
         tf.where(magic_num_check(y_true), tf.zeros_like(y_true), y_true - y_pred),
         axis=-1,
@@ -368,8 +403,9 @@ def mean_percentage_error(y_true, y_pred, sample_weight=None):
     :rtype: tf.Tensor
     :History: 2018-Jun-06 - Written - Henry Leung (University of Toronto)
     """
-    tf_inf = tf.cast(tf.constant(1) / tf.constant(0), tf.float32)
-    epsilon_tensor = tf.cast(tf.constant(tfk.backend.epsilon()), tf.float32)
+    y_true, y_pred = loss_precision(y_true, y_pred)
+    tf_inf = tf.cast(tf.constant(1) / tf.constant(0), y_true.dtype)
+    epsilon_tensor = tf.cast(tf.constant(tfk.backend.epsilon()), y_true.dtype)
 
     diff = y_true - y_pred / tf.clip_by_value(y_true, epsilon_tensor, tf_inf)
     diff_corrected = tf.where(magic_num_check(y_true), tf.zeros_like(y_true), diff)
@@ -393,8 +429,9 @@ def median_percentage_error(y_true, y_pred, sample_weight=None):
     :rtype: tf.Tensor
     :History: 2020-Aug-13 - Written - Henry Leung (University of Toronto)
     """
-    tf_inf = tf.cast(tf.constant(1) / tf.constant(0), tf.float32)
-    epsilon_tensor = tf.cast(tf.constant(tfk.backend.epsilon()), tf.float32)
+    y_true, y_pred = loss_precision(y_true, y_pred)
+    tf_inf = tf.cast(tf.constant(1) / tf.constant(0), y_true.dtype)
+    epsilon_tensor = tf.cast(tf.constant(tfk.backend.epsilon()), y_true.dtype)
 
     diff = y_true - y_pred / tf.clip_by_value(y_true, epsilon_tensor, tf_inf)
     diff_corrected = tf.where(magic_num_check(y_true), tf.zeros_like(y_true), diff)
@@ -418,6 +455,7 @@ def categorical_crossentropy(y_true, y_pred, sample_weight=None, from_logits=Fal
     :rtype: tf.Tensor
     :History: 2018-Jan-14 - Written - Henry Leung (University of Toronto)
     """
+    y_true, y_pred = loss_precision(y_true, y_pred)
     # calculate correction term first
     correction = magic_correction_term(y_true)
 
@@ -426,7 +464,7 @@ def categorical_crossentropy(y_true, y_pred, sample_weight=None, from_logits=Fal
 
     # Note: tf.nn.softmax_cross_entropy_with_logits expects logits, we expects probabilities by default.
     if not from_logits:
-        epsilon_tensor = tf.cast(tf.constant(tfk.backend.epsilon()), tf.float32)
+        epsilon_tensor = tf.cast(tf.constant(tfk.backend.epsilon()), y_pred.dtype)
         # scale preds so that the class probas of each sample sum to 1
         y_pred /= tf.reduce_sum(y_pred, len(y_pred.get_shape()) - 1, True)
         # manual computation of crossentropy
@@ -460,9 +498,10 @@ def binary_crossentropy(y_true, y_pred, sample_weight=None, from_logits=False):
     :rtype: tf.Tensor
     :History: 2018-Jan-14 - Written - Henry Leung (University of Toronto)
     """
+    y_true, y_pred = loss_precision(y_true, y_pred)
     # Note: tf.nn.sigmoid_cross_entropy_with_logits expects logits, we expects probabilities by default.
     if not from_logits:
-        epsilon_tensor = tf.cast(tf.constant(tfk.backend.epsilon()), tf.float32)
+        epsilon_tensor = tf.cast(tf.constant(tfk.backend.epsilon()), y_pred.dtype)
         # transform back to logits
         y_pred = tf.clip_by_value(y_pred, epsilon_tensor, 1.0 - epsilon_tensor)
         y_pred = tf.math.log(y_pred / (1.0 - y_pred))
@@ -550,6 +589,7 @@ def robust_categorical_crossentropy(y_true, y_pred, logit_var, sample_weight):
     :rtype: tf.Tensor
     :History: 2018-Mar-15 - Written - Henry Leung (University of Toronto)
     """
+    y_true, y_pred, logit_var = loss_precision(y_true, y_pred, logit_var)
     variance_depressor = tf.reduce_mean(tf.exp(logit_var) - tf.ones_like(logit_var))
     undistorted_loss = categorical_crossentropy(
         y_true, y_pred, sample_weight, from_logits=True
@@ -649,6 +689,7 @@ def robust_binary_crossentropy(y_true, y_pred, logit_var, sample_weight):
     :rtype: tf.Tensor
     :History: 2018-Mar-15 - Written - Henry Leung (University of Toronto)
     """
+    y_true, y_pred, logit_var = loss_precision(y_true, y_pred, logit_var)
     variance_depressor = tf.reduce_mean(tf.exp(logit_var) - tf.ones_like(logit_var))
     undistorted_loss = binary_crossentropy(y_true, y_pred, from_logits=True)
     dist = tfd.Normal(loc=y_pred, scale=logit_var)
@@ -793,6 +834,7 @@ def zeros_loss(y_true, y_pred, sample_weight=None):
     :rtype: tf.Tensor
     :History: 2018-May-24 - Written - Henry Leung (University of Toronto)
     """
+    y_true, y_pred = loss_precision(y_true, y_pred)
     losses = tf.reduce_mean(0.0 * y_true + 0.0 * y_pred, axis=-1)
     return weighted_loss(losses, sample_weight)
 
@@ -0,0 +1,88 @@
+###############################################################################
+#   augmentation.py: on-the-fly data augmentation for training
+###############################################################################
+import threading
+
+import numpy as np
+
+from astroNN.config import MAGIC_NUMBER
+
+
+class GaussianNoiseAugmentation(object):
+    """
+    | Perturb a batch of inputs with Gaussian noise drawn from their (normalized) uncertainty, vectorized over the batch
+    |
+    | Works on batches of NumPy arrays from data generators (every worker thread has its own random generator) and on
+    | batches of tensors in tf.data pipeline. Data with magic number and non-positive or NaN uncertainty are not
+    | perturbed. Inputs are never modified in place.
+
+    :param input_name: Name of the input to be perturbed
+    :type input_name: str
+    :param err_name: Name of the uncertainty of the input
+    :type err_name: str
+    :param scale: Standard deviation of noise in unit of uncertainty
+    :type scale: float
+    :param seed: Seed of random generators
+    :type seed: Union([NoneType, int])
+    """
+
+    def __init__(self, input_name="input", err_name="input_err", scale=1., seed=None):
+        self.input_name = input_name
+        self.err_name = err_name
+        self.scale = scale
+        self.seed = seed
+        self._seed_sequence = np.random.SeedSequence(seed)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # random generators are per thread, do not send them to worker processes
+        state = self.__dict__.copy()
+        state.update({"_local": None, "_lock": None})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _rng(self):
+        rng = getattr(self._local, "rng", None)
+        if rng is None:
+            with self._lock:  # independent stream for every thread
+                rng = self._local.rng = np.random.default_rng(self._seed_sequence.spawn(1)[0])
+        return rng
+
+    def perturb(self, data, err):
+        """
+        Perturb data with Gaussian noise with standard deviation of err
+
+        :param data: data
+        :type data: Union([ndarray, tf.Tensor])
+        :param err: uncertainty of data, same shape with data
+        :type err: Union([ndarray, tf.Tensor])
+        :return: perturbed data
+        :rtype: Union([ndarray, tf.Tensor])
+        """
+        if isinstance(data, np.ndarray):
+            std = np.where((data != MAGIC_NUMBER) & (err > 0.), err, 0.).astype(np.float32, copy=False)
+            noise = self._rng().standard_normal(size=data.shape, dtype=np.float32)
+            noise *= std
+            if self.scale != 1.:
+                noise *= self.scale
+            noise += data
+            return noise.astype(data.dtype, copy=False)
+        else:
+            import tensorflow as tf
+
+            err = tf.cast(err, data.dtype)
+            std = tf.where((data != MAGIC_NUMBER) & (err > 0.), err, tf.zeros_like(err))
+            return data + tf.random.normal(tf.shape(data), stddev=self.scale, dtype=data.dtype, seed=self.seed) * std
+
+    def __call__(self, x, y, sample_weight=None):
+        x = dict(x)
+        x.update({self.input_name: self.perturb(x[self.input_name], x[self.err_name])})
+        if sample_weight is not None:
+            return x, y, sample_weight
+        else:
+            return x, y
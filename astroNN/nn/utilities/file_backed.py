@@ -0,0 +1,334 @@
+###############################################################################
+#   file_backed.py: lazily read file-backed data for out-of-core training
+###############################################################################
+import threading
+import time
+from collections import OrderedDict
+
+import h5py
+import numpy as np
+
+
+def is_file_backed(data):
+    """
+    Whether data live in a file (h5py dataset, numpy memmap or FileBackedArray) so they should be read lazily
+
+    :param data: data
+    :type data: Union([ndarray, h5py.Dataset, FileBackedArray])
+    :return: True if data are file-backed
+    :rtype: bool
+    """
+    return isinstance(data, (h5py.Dataset, np.memmap, FileBackedArray))
+
+
+def lazy_zeros_like(data):
+    """
+    Zeros with the same shape of data, without allocating memory for file-backed data
+
+    :param data: data
+    :type data: Union([ndarray, h5py.Dataset, FileBackedArray])
+    :return: zeros
+    :rtype: Union([ndarray, FileBackedArray])
+    """
+    if is_file_backed(data):
+        # read-only view with zero strides
+        return FileBackedArray(np.broadcast_to(np.zeros((1,) + tuple(data.shape[1:]), dtype=np.float32),
+                                               data.shape))
+    else:
+        return np.zeros_like(data)
+
+
+def lazy_divide(data, divisor):
+    """
+    Data divided by divisor, lazily for file-backed data
+
+    :param data: data
+    :type data: Union([ndarray, h5py.Dataset, FileBackedArray])
+    :param divisor: divisor
+    :type divisor: Union([float, ndarray])
+    :return: divided data
+    :rtype: Union([ndarray, FileBackedArray])
+    """
+    if is_file_backed(data):
+        return FileBackedArray(data, transform=_Divide(divisor))
+    else:
+        return data / divisor
+
+
+def take_rows(data, idx):
+    """
+    Rows of data at indices, a lazy subset for file-backed data or a copy for in-memory data
+
+    :param data: data
+    :type data: Union([ndarray, h5py.Dataset, FileBackedArray])
+    :param idx: indices
+    :type idx: ndarray
+    :return: rows of data
+    :rtype: Union([ndarray, FileBackedArray])
+    """
+    if is_file_backed(data):
+        return FileBackedArray(data).subset(idx)
+    else:
+        return data[idx]
+
+
+class FileBackedArray(object):
+    """
+    | Array-like view of file-backed data (h5py dataset, numpy memmap or any array) which reads rows only when indexed
+    |
+    | Subsets (e.g. training/validation split) are kept as indices without reading, and a transform (e.g.
+    | normalization) is applied to every batch when it is read. Rows are read from h5py dataset in increasing order as
+    | required by HDF5, and contiguous rows are read as a slice.
+    |
+    | With ``set_chunk_pool()``, whole storage chunks are read sequentially and kept in a bounded in-memory pool (least
+    | recently used chunk is evicted), rows are then gathered from the pool. Read throughput is counted in
+    | ``read_stats``.
+
+    :param data: file-backed data
+    :type data: Union([h5py.Dataset, numpy.memmap, ndarray, FileBackedArray])
+    :param index: indices of rows of data in this view, by default all rows
+    :type index: Union([NoneType, ndarray])
+    :param transform: function applied to every batch read
+    :type transform: Union([NoneType, callable])
+    """
+
+    def __init__(self, data, index=None, transform=None):
+        if isinstance(data, FileBackedArray):
+            if index is not None:
+                index = data._row_index(index)
+            else:
+                index = data.index
+            if data.transform is not None:
+                transform = data.transform if transform is None else _Compose(data.transform, transform)
+            data = data.data
+        self.data = data
+        self.index = None if index is None else np.asarray(index, dtype=np.int64)
+        self.transform = transform
+        self._row_shape = None
+        self._dtype = None
+
+        self.chunk_size = None
+        self.pool_size = None
+        self._pool = OrderedDict()
+        self._lock = threading.Lock()
+        self.read_stats = {"rows": 0, "bytes": 0, "read_time": 0., "chunks_read": 0}
+
+    def __getstate__(self):
+        # chunk pool and lock are per process, do not send them to worker processes
+        state = self.__dict__.copy()
+        state.update({"_pool": OrderedDict(), "_lock": None})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.data.shape[0] if self.index is None else len(self.index)
+
+    def _transformed_row(self):
+        # shape and dtype after transform is known by reading the first row
+        if self._row_shape is None:
+            row = self[:1]
+            self._row_shape, self._dtype = tuple(row.shape[1:]), row.dtype
+        return self._row_shape, self._dtype
+
+    @property
+    def shape(self):
+        if self.transform is None:
+            return (len(self),) + tuple(self.data.shape[1:])
+        return (len(self),) + self._transformed_row()[0]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        if self.transform is None:
+            return np.dtype(self.data.dtype)
+        return self._transformed_row()[1]
+
+    def _row_index(self, key):
+        """
+        Indices of rows of the underlying data for a key of this view
+        """
+        if isinstance(key, slice):
+            key = np.arange(len(self))[key]
+        key = np.asarray(key)
+        if key.dtype == bool:
+            key = np.nonzero(key)[0]
+        else:
+            key = key.astype(np.int64, copy=False)
+            if np.any(key < 0):
+                key = np.where(key < 0, key + len(self), key)
+        return key if self.index is None else self.index[key]
+
+    @property
+    def storage_rows(self):
+        """
+        Indices of rows of the underlying data in this view
+        """
+        return np.arange(self.data.shape[0]) if self.index is None else self.index
+
+    def default_chunk_size(self):
+        """
+        Number of rows of a storage chunk, the HDF5 chunk size of chunked h5py dataset, otherwise about 4MB of rows
+
+        :return: chunk size
+        :rtype: int
+        """
+        if isinstance(self.data, h5py.Dataset) and self.data.chunks is not None:
+            return int(self.data.chunks[0])
+        row_bytes = int(np.prod(self.data.shape[1:], dtype=np.int64)) * np.dtype(self.data.dtype).itemsize
+        return max(4 * 1024 ** 2 // max(row_bytes, 1), 1)
+
+    def set_chunk_pool(self, chunk_size=None, pool_size=8):
+        """
+        Read whole storage chunks sequentially into a bounded in-memory pool, rows are gathered from the pool
+
+        :param chunk_size: Number of rows of a storage chunk, by default default_chunk_size()
+        :type chunk_size: Union([NoneType, int])
+        :param pool_size: Maximum number of chunks kept in memory, None to disable the pool
+        :type pool_size: Union([NoneType, int])
+        :return: None
+        """
+        self.chunk_size = self.default_chunk_size() if chunk_size is None else chunk_size
+        self.pool_size = pool_size
+        with self._lock:
+            self._pool.clear()
+
+    def read_throughput(self):
+        """
+        Read throughput of the underlying data since created
+
+        :return: read_stats with rows and megabytes read per second
+        :rtype: dict
+        """
+        stats = dict(self.read_stats)
+        read_time = max(stats["read_time"], 1e-12)
+        stats.update({"rows_per_sec": stats["rows"] / read_time, "mb_per_sec": stats["bytes"] / 1024 ** 2 / read_time})
+        return stats
+
+    def _count_read(self, data, start_time, chunks=0):
+        self.read_stats["rows"] += data.shape[0]
+        self.read_stats["bytes"] += data.nbytes
+        self.read_stats["read_time"] += time.perf_counter() - start_time
+        self.read_stats["chunks_read"] += chunks
+
+    def _load_chunk(self, chunk_id):
+        """
+        A storage chunk from the pool, read it sequentially if not in the pool
+        """
+        with self._lock:
+            chunk = self._pool.get(chunk_id)
+            if chunk is not None:
+                self._pool.move_to_end(chunk_id)
+                return chunk
+            start_time = time.perf_counter()
+            chunk = np.asarray(self.data[chunk_id * self.chunk_size:(chunk_id + 1) * self.chunk_size])
+            self._count_read(chunk, start_time, chunks=1)
+            self._pool[chunk_id] = chunk
+            while len(self._pool) > self.pool_size:
+                self._pool.popitem(last=False)
+            return chunk
+
+    def _read(self, rows):
+        """
+        Read rows of the underlying data
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.pool_size is not None and len(rows) > 0:
+            chunk_ids = rows // self.chunk_size
+            batch = np.empty((len(rows),) + tuple(self.data.shape[1:]), dtype=self.data.dtype)
+            for chunk_id in np.unique(chunk_ids):
+                in_chunk = chunk_ids == chunk_id
+                batch[in_chunk] = self._load_chunk(chunk_id)[rows[in_chunk] - chunk_id * self.chunk_size]
+            return batch
+        start_time = time.perf_counter()
+        batch = self._read_rows(rows)
+        with self._lock:
+            self._count_read(batch, start_time)
+        return batch
+
+    def _read_rows(self, rows):
+        if len(rows) == 0:
+            return np.empty((0,) + tuple(self.data.shape[1:]), dtype=self.data.dtype)
+        if rows[-1] - rows[0] == len(rows) - 1 and np.all(np.diff(rows) == 1):
+            return np.asarray(self.data[int(rows[0]):int(rows[-1]) + 1])
+        if isinstance(self.data, h5py.Dataset):
+            # HDF5 only reads unique increasing indices
+            unique_rows, inverse = np.unique(rows, return_inverse=True)
+            return np.asarray(self.data[unique_rows])[inverse]
+        return np.take(self.data, rows, axis=0)
+
+    def subset(self, idx):
+        """
+        Lazy view of rows at indices
+
+        :param idx: indices of rows in this view
+        :type idx: Union([ndarray, slice])
+        :return: view
+        :rtype: FileBackedArray
+        """
+        return FileBackedArray(self.data, index=self._row_index(idx), transform=self.transform)
+
+    def with_transform(self, transform):
+        """
+        Lazy view with a transform applied after the existing one (if any)
+
+        :param transform: function applied to every batch read
+        :type transform: callable
+        :return: view
+        :rtype: FileBackedArray
+        """
+        return FileBackedArray(self, transform=transform)
+
+    def iter_chunks(self, chunk_size=65536, transform=False):
+        """
+        Iterate over the view chunk by chunk in order
+
+        :param chunk_size: number of rows per chunk
+        :type chunk_size: int
+        :param transform: Whether to apply the transform
+        :type transform: bool
+        :return: generator of chunks
+        :rtype: generator
+        """
+        for start in range(0, len(self), chunk_size):
+            rows = np.arange(start, min(start + chunk_size, len(self)))
+            chunk = self._read(self._row_index(rows))
+            yield self.transform(chunk) if (transform and self.transform is not None) else chunk
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self[[key]][0]
+        if isinstance(key, tuple):  # only the first axis is lazy
+            if isinstance(key[0], (int, np.integer)):
+                return self[key[0]][key[1:]]
+            return self[key[0]][(slice(None),) + key[1:]]
+        batch = self._read(self._row_index(key))
+        return self.transform(batch) if self.transform is not None else batch
+
+    def __array__(self, dtype=None):
+        # reading the whole view into memory, e.g. by np.asarray()
+        data = self[:]
+        return data if dtype is None else data.astype(dtype, copy=False)
+
+
+class _Divide(object):
+    # picklable (unlike lambda) so it can be sent to worker processes of data generators
+    def __init__(self, divisor):
+        self.divisor = np.asarray(divisor, dtype=np.float32)
+
+    def __call__(self, x):
+        return np.asarray(x, dtype=np.float32) / self.divisor
+
+
+class _Compose(object):
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+
+    def __call__(self, x):
+        return self.second(self.first(x))
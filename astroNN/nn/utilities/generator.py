@@ -1,6 +1,16 @@
+import itertools
+import os
+import queue
+import threading
+import time
+
 import numpy as np
 
+import tensorflow as tf
 from tensorflow import keras as tfk
+
+from astroNN.nn.utilities.shared_array import SharedArray, to_shared_array
+
 Sequence = tfk.utils.Sequence
 
 
@@ -22,6 +32,30 @@ class GeneratorMaster(Sequence):
         self.manual_reset = manual_reset
 
         self.steps_per_epoch = steps_per_epoch
+        # sampler to find shuffled exploration order (e.g. ChunkShuffleSampler), None for fully random shuffling
+        self.sampler = None
+        # function applied to every batch of training data (e.g. GaussianNoiseAugmentation), None for no augmentation
+        self.augmentation = None
+        # this generator only explores the shard_index-th of num_shards disjoint shards of data (see shard())
+        self.num_shards = 1
+        self.shard_index = 0
+
+        # max_queue_size and workers of the Keras enqueuer this generator is consumed with, models use Keras default
+        # max_queue_size and at most one worker thread per CPU, they size the ring of batch buffers (see buffer_slots)
+        self.max_queue_size = 10
+        self.workers = os.cpu_count() or 1
+        self._buffers = {}
+        self._buffer_counter = itertools.count()
+
+    def __getstate__(self):
+        # buffers are per worker, do not send them to worker processes
+        state = self.__dict__.copy()
+        state.update({"_buffers": {}, "_buffer_counter": None})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._buffer_counter = itertools.count()
 
     def __len__(self):
         return self.steps_per_epoch
@@ -31,13 +65,107 @@ class GeneratorMaster(Sequence):
         :param idx_list:
         :return:
         """
+        if self.num_shards > 1:
+            # every shard has the same number of data so all workers run the same number of steps
+            idx_list = np.asarray(idx_list)[self.shard_index::self.num_shards][:len(idx_list) // self.num_shards]
+
         # shuffle (if applicable) and find exploration order
-        if self.shuffle is True:
+        if self.shuffle is True and self.sampler is not None:
+            idx_list = self.sampler.order(idx_list)
+        elif self.shuffle is True:
             idx_list = np.copy(idx_list)
             np.random.shuffle(idx_list)
 
         return idx_list
 
+    def shard(self, num_shards, index, batch_size=None):
+        """
+        | Only explore one of disjoint shards of data, e.g. for a worker of multi-worker data-parallel training
+        |
+        | Data are sharded by data index before shuffling, so every shard has a fixed set of data which are shuffled
+        | within the shard every epoch. Every shard has the same number of data (the remainder is dropped) so all
+        | workers run the same number of steps per epoch.
+
+        :param num_shards: Number of shards
+        :type num_shards: int
+        :param index: Index of the shard of this generator
+        :type index: int
+        :param batch_size: Batch size of this shard, by default the batch size of the generator
+        :type batch_size: Union([NoneType, int])
+        :return: the generator itself
+        :rtype: GeneratorMaster
+        """
+        if not 0 <= index < num_shards:
+            raise ValueError(f"Shard index {index} is out of range for {num_shards} shards")
+        self.num_shards = num_shards
+        self.shard_index = index
+        if batch_size is not None:
+            self.batch_size = batch_size
+            self._buffers = {}
+        self.steps_per_epoch = max(len(tf.nest.flatten(self.data[0])[0]) // num_shards // self.batch_size, 1)
+        self.on_epoch_end()
+        return self
+
+    def _pad_idx(self, idx_list_temp):
+        """
+        Pad a batch of indices up to batch_size by repeating the last index, so every batch has the same shape
+
+        :param idx_list_temp: indices of a batch
+        :type idx_list_temp: Union([ndarray, range])
+        :return: padded indices
+        :rtype: Union([ndarray, range])
+        """
+        if len(idx_list_temp) < self.batch_size:
+            idx_list_temp = np.concatenate([idx_list_temp,
+                                            np.repeat(idx_list_temp[-1:], self.batch_size - len(idx_list_temp))])
+        return idx_list_temp
+
+    def to_shared_memory(self):
+        """
+        | Copy in-memory data (inputs, labels and sample weight) of the generator into shared memory
+        |
+        | The generator is then pickled to worker processes (``use_multiprocessing=True``) by names of the shared
+        | memory blocks instead of by values, so every worker process reads the same memory. File-backed data are not
+        | copied.
+
+        :return: the generator itself
+        :rtype: GeneratorMaster
+        """
+        for data_dict in self.data:
+            if isinstance(data_dict, dict):
+                # update dictionary in place, so the sub-class attributes refer to the same dictionary
+                for name in data_dict.keys():
+                    data_dict[name] = to_shared_array(data_dict[name])
+        if getattr(self, "sample_weight", None) is not None:
+            self.sample_weight = to_shared_array(self.sample_weight)
+        return self
+
+    def release_shared_memory(self):
+        """
+        Release shared memory created by to_shared_memory(), data are copied back to ordinary in-memory arrays
+        """
+        for data_dict in self.data:
+            if isinstance(data_dict, dict):
+                for name in data_dict.keys():
+                    if isinstance(data_dict[name], SharedArray):
+                        shared, data_dict[name] = data_dict[name], np.array(data_dict[name])
+                        shared.release()
+        if isinstance(getattr(self, "sample_weight", None), SharedArray):
+            shared, self.sample_weight = self.sample_weight, np.array(self.sample_weight)
+            shared.release()
+        self._buffers = {}
+
+    def _augment(self, batch):
+        """
+        Apply augmentation (if any) to a batch of (inputs, labels) or (inputs, labels, sample weight)
+
+        :param batch: a batch of data
+        :type batch: tuple
+        :return: augmented batch
+        :rtype: tuple
+        """
+        return batch if self.augmentation is None else self.augmentation(*batch)
+
     def sparsify(self, y):
         """Returns labels in binary NumPy array"""
         # n_classes =  # Enter number of classes
@@ -45,26 +173,351 @@ class GeneratorMaster(Sequence):
         #                  for i in range(y.shape[0])])
         pass
 
+    @staticmethod
+    def _contiguous_slice(idx_list_temp):
+        """
+        Slice equivalent to a batch of indices if they are contiguous and increasing, otherwise None
+
+        :param idx_list_temp: indices of a batch
+        :type idx_list_temp: Union([ndarray, range])
+        :return: slice or None
+        :rtype: Union([NoneType, slice])
+        """
+        if len(idx_list_temp) == 0:
+            return None
+        if isinstance(idx_list_temp, range):
+            return slice(idx_list_temp.start, idx_list_temp.stop) if idx_list_temp.step == 1 else None
+        idx_list_temp = np.asarray(idx_list_temp)
+        if idx_list_temp[-1] - idx_list_temp[0] == len(idx_list_temp) - 1 and np.all(np.diff(idx_list_temp) == 1):
+            return slice(int(idx_list_temp[0]), int(idx_list_temp[-1]) + 1)
+        return None
+
+    @property
+    def buffer_slots(self):
+        """
+        | Number of batch buffers in the ring, a buffer is only reused this number of batches later
+        |
+        | This has to be more than the number of batches alive at the same time or a batch would be overwritten while
+        | still in use. Keras enqueuer keeps at most ``max_queue_size`` batches in its queue plus one waiting to be
+        | queued, ``workers`` threads assemble one batch each, and the batch being trained on and one prefetched by
+        | ``tf.data`` (tensors converted from NumPy arrays may share their memory) are still alive. Set
+        | ``max_queue_size`` and ``workers`` if the generator is consumed with larger values.
+
+        :return: number of batch buffers
+        :rtype: int
+        """
+        return self.max_queue_size + self.workers + 4
+
+    def _batch_buffer(self, key, slot, shape, dtype):
+        """
+        Preallocated buffer of a batch of data with batch_size rows, reused every buffer_slots batches
+
+        :param key: key to identify the data
+        :type key: tuple
+        :param slot: slot in the ring of buffers of the data
+        :type slot: int
+        :param shape: shape of a batch without the batch axis
+        :type shape: tuple
+        :param dtype: dtype of the batch
+        :type dtype: numpy.dtype
+        :return: buffer
+        :rtype: ndarray
+        """
+        ring = self._buffers.setdefault(key, [None] * self.buffer_slots)
+        buffer = ring[slot]
+        if buffer is None or buffer.shape[1:] != shape or buffer.dtype != dtype:
+            buffer = ring[slot] = np.empty((self.batch_size,) + shape, dtype=dtype)
+        return buffer
+
     def input_d_checking(self, inputs, idx_list_temp):
+        """
+        | Assemble a batch of inputs with a channel axis added for 1D and 2D data
+        |
+        | Floating point data keep their dtype (others are converted to float32). Contiguous indices (e.g. unshuffled
+        | prediction) give views of the data without copying, otherwise data are gathered into preallocated buffers
+        | reused every ``buffer_slots`` batches, so no memory is allocated per batch.
+
+        :param inputs: dictionary of data
+        :type inputs: dict
+        :param idx_list_temp: indices of a batch
+        :type idx_list_temp: Union([ndarray, range])
+        :return: dictionary of a batch of data
+        :rtype: dict
+        """
         x_dict = {}
+        contiguous = self._contiguous_slice(idx_list_temp)
+        slot = None
         for name in inputs.keys():
-            if inputs[name].ndim == 2:
-                x = np.empty((len(idx_list_temp), inputs[name].shape[1], 1))
-                # Generate data
-                x[:, :, 0] = inputs[name][idx_list_temp]
-
-            elif inputs[name].ndim == 3:
-                x = np.empty((len(idx_list_temp), inputs[name].shape[1], inputs[name].shape[2], 1))
-                # Generate data
-                x[:, :, :, 0] = inputs[name][idx_list_temp]
-
-            elif inputs[name].ndim == 4:
-                x = np.empty((len(idx_list_temp), inputs[name].shape[1], inputs[name].shape[2], inputs[name].shape[3]))
-                # Generate data
-                x[:, :, :, :] = inputs[name][idx_list_temp]
+            data = inputs[name]
+            if data.ndim == 1:
+                # per data point scalar (e.g. index of data point), keep its dtype
+                x_dict.update({name: np.asarray(data[idx_list_temp])})
+                continue
+            elif data.ndim > 4:
+                raise ValueError(f"Unsupported data dimension, your data has {data.ndim} dimension")
+
+            # 1D and 2D data get a channel axis
+            shape = tuple(data.shape[1:]) + ((1,) if data.ndim < 4 else ())
+            dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.dtype(np.float32)
+            num = len(idx_list_temp)
+            if contiguous is not None:
+                x = np.asarray(data[contiguous], dtype=dtype).reshape((num,) + shape)
             else:
-                raise ValueError(f"Unsupported data dimension, your data has {inputs[name].ndim} dimension")
+                if slot is None:  # all inputs of a batch share a slot
+                    slot = next(self._buffer_counter) % self.buffer_slots
+                x = self._batch_buffer((name, id(data)), slot, shape, dtype)[:num]
+                if isinstance(data, np.ndarray) and data.dtype == dtype:
+                    # gather straight into the buffer, indices are always valid so no need to check bounds
+                    np.take(data, idx_list_temp, axis=0, out=x.reshape((num,) + tuple(data.shape[1:])), mode='clip')
+                else:
+                    x.reshape((num,) + tuple(data.shape[1:]))[:] = data[idx_list_temp]
 
             x_dict.update({name: x})
 
         return x_dict
+
+    @staticmethod
+    def _channel_view(inputs):
+        """
+        Whole data with a channel axis added for 1D and 2D data like input_d_checking() does, without copying
+
+        :param inputs: dictionary of data
+        :type inputs: dict
+        :return: dictionary of data
+        :rtype: dict
+        """
+        x_dict = {}
+        for name in inputs.keys():
+            data = np.asarray(inputs[name])
+            if data.ndim in (2, 3):
+                data = data.reshape(data.shape + (1,))
+            elif data.ndim > 4:
+                raise ValueError(f"Unsupported data dimension, your data has {data.ndim} dimension")
+            if not np.issubdtype(data.dtype, np.floating) and data.ndim > 1:
+                data = data.astype(np.float32)
+            x_dict.update({name: data})
+        return x_dict
+
+    def _dataset_elements(self):
+        """
+        Whole data equivalent to batches of the generator as (inputs, labels) or (inputs, labels, sample weight), to be
+        implemented in the generator sub-class to support as_dataset()
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} does not support tf.data pipeline")
+
+    def as_dataset(self, shuffle=None, shuffle_buffer=None, cache=None, map_func=None, drop_remainder=None):
+        """
+        | tf.data pipeline equivalent to the generator, in the order of cache, shuffle, batch, map and prefetch
+        |
+        | Data are shuffled element by element (not batch by batch) and reshuffled every epoch.
+
+        :param shuffle: Whether to shuffle data, by default the same as the generator
+        :type shuffle: Union([NoneType, bool])
+        :param shuffle_buffer: Size of shuffle buffer, by default all data so shuffling is uniform
+        :type shuffle_buffer: Union([NoneType, int])
+        :param cache: None to not cache, "memory" to cache in memory or a filename to cache on disk
+        :type cache: Union([NoneType, str])
+        :param map_func: Function applied to every batch in parallel (e.g. augmentation) after ``augmentation`` of the
+            generator (if any), which takes and returns the same structure as batches of the generator, i.e.
+            (inputs, labels) or (inputs, labels, sample weight)
+        :type map_func: Union([NoneType, callable])
+        :param drop_remainder: Whether to drop the last batch if smaller than batch_size, by default the same as
+            shuffle so training batches have a fixed shape
+        :type drop_remainder: Union([NoneType, bool])
+        :return: dataset
+        :rtype: tf.data.Dataset
+        """
+        shuffle = self.shuffle if shuffle is None else shuffle
+        elements = self._dataset_elements()
+        num_data = len(tf.nest.flatten(elements)[0])
+
+        dataset = tf.data.Dataset.from_tensor_slices(elements)
+        if self.num_shards > 1:
+            num_data = num_data // self.num_shards
+            dataset = dataset.shard(self.num_shards, self.shard_index).take(num_data)
+        if cache is not None:
+            dataset = dataset.cache("" if cache == "memory" else cache)
+        if shuffle:
+            dataset = dataset.shuffle(num_data if shuffle_buffer is None else shuffle_buffer,
+                                      reshuffle_each_iteration=True)
+        dataset = dataset.batch(self.batch_size, drop_remainder=shuffle if drop_remainder is None else drop_remainder)
+        if self.augmentation is not None:
+            dataset = dataset.map(lambda *batch: self.augmentation(*batch), num_parallel_calls=tf.data.AUTOTUNE)
+        if map_func is not None:
+            dataset = dataset.map(lambda *batch: map_func(*batch), num_parallel_calls=tf.data.AUTOTUNE)
+        return self._shard_options(dataset).prefetch(tf.data.AUTOTUNE)
+
+    def as_generator_dataset(self):
+        """
+        | tf.data dataset which yields the batches of the generator in order, and calls on_epoch_end() after every epoch
+        |
+        | Unlike as_dataset(), data are still read (and augmented) by the generator so it works with file-backed data,
+        | e.g. for distribution strategies which only accept datasets for sharded data.
+
+        :return: dataset
+        :rtype: tf.data.Dataset
+        """
+        signature = tf.nest.map_structure(
+            lambda x: tf.TensorSpec((None,) + np.shape(x)[1:], tf.as_dtype(np.asarray(x).dtype)), self[0])
+
+        def batches():
+            for i in range(len(self)):
+                yield self[i]
+            self.on_epoch_end()
+
+        dataset = tf.data.Dataset.from_generator(batches, output_signature=signature)
+        return self._shard_options(dataset).prefetch(tf.data.AUTOTUNE)
+
+    def _shard_options(self, dataset):
+        """
+        Turn off auto-sharding of distribution strategies for sharded generator because data are already sharded
+        """
+        if self.num_shards > 1:
+            options = tf.data.Options()
+            options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+            dataset = dataset.with_options(options)
+        return dataset
+
+
+def benchmark_data_pipeline(generator, epochs=1, **kwargs):
+    """
+    Benchmark host-side throughput of the Keras ``Sequence`` generator against the equivalent tf.data pipeline, by
+    iterating over all batches without running any model
+
+    :param generator: astroNN data generator which supports as_dataset()
+    :type generator: GeneratorMaster
+    :param epochs: Number of epochs to iterate over
+    :type epochs: int
+    :param kwargs: Keyword arguments of as_dataset()
+    :return: seconds per batch and number of batches of both pipelines, and speedup of tf.data pipeline
+    :rtype: dict
+    """
+    result = {}
+    start_time = time.perf_counter()
+    num_batches = 0
+    for _ in range(epochs):
+        for i in range(len(generator)):
+            generator[i]
+            num_batches += 1
+        generator.on_epoch_end()
+    result.update({"generator_time_per_batch": (time.perf_counter() - start_time) / max(num_batches, 1),
+                   "generator_batches": num_batches})
+
+    dataset = generator.as_dataset(**kwargs)
+    start_time = time.perf_counter()
+    num_batches = 0
+    for _ in range(epochs):
+        for _ in dataset:
+            num_batches += 1
+    result.update({"dataset_time_per_batch": (time.perf_counter() - start_time) / max(num_batches, 1),
+                   "dataset_batches": num_batches})
+    result["speedup"] = result["generator_time_per_batch"] / max(result["dataset_time_per_batch"], 1e-12)
+    return result
+
+
+class ChunkShuffleSampler(object):
+    """
+    | Chunk-aware shuffling for file-backed data, so reading shuffled batches is mostly sequential
+    |
+    | The order of storage chunks is shuffled, then data of every ``pool_size`` consecutive chunks in that order are
+    | shuffled together. Therefore batches only need data from ``pool_size`` chunks at a time which can be kept in
+    | memory (see ``FileBackedArray.set_chunk_pool()``), while every chunk is read once per epoch.
+
+    :param storage_rows: Index of the row in storage of every data
+    :type storage_rows: ndarray
+    :param chunk_size: Number of rows of a storage chunk
+    :type chunk_size: int
+    :param pool_size: Number of chunks shuffled together, larger for better randomness and more memory
+    :type pool_size: int
+    """
+
+    def __init__(self, storage_rows, chunk_size, pool_size=8):
+        self.chunk_ids = np.asarray(storage_rows) // chunk_size
+        self.chunk_size = chunk_size
+        self.pool_size = pool_size
+
+    def order(self, idx_list):
+        """
+        Shuffled exploration order
+
+        :param idx_list: indices of data to be shuffled
+        :type idx_list: Union([ndarray, range])
+        :return: shuffled indices
+        :rtype: ndarray
+        """
+        idx_list = np.asarray(idx_list)
+        idx_chunk_ids = self.chunk_ids[idx_list]
+        # group indices by chunk with a stable sort, then shuffle the order of chunks
+        sorter = np.argsort(idx_chunk_ids, kind="stable")
+        _, starts = np.unique(idx_chunk_ids[sorter], return_index=True)
+        chunks = np.split(idx_list[sorter], starts[1:])
+        chunks = [chunks[i] for i in np.random.permutation(len(chunks))]
+
+        pools = []
+        for i in range(0, len(chunks), self.pool_size):
+            pool = np.concatenate(chunks[i:i + self.pool_size])
+            np.random.shuffle(pool)
+            pools.append(pool)
+        return np.concatenate(pools) if pools else idx_list.copy()
+
+
+class GeneratorPrefetcher(object):
+    """
+    | Iterate over batches of a generator while the next batches are prepared in a background thread, so batch
+    | assembly and normalization of batch i+1 overlap with computation on batch i
+    |
+    | Time spent waiting for batches is recorded in ``data_wait_time``
+
+    :param generator: astroNN data generator
+    :type generator: GeneratorMaster
+    :param prefetch: Number of batches prepared ahead, 0 to prepare batches synchronously
+    :type prefetch: int
+    """
+
+    def __init__(self, generator, prefetch=2):
+        self.generator = generator
+        self.prefetch = prefetch
+        self.data_wait_time = 0.
+
+    def __len__(self):
+        return len(self.generator)
+
+    def _producer(self, batch_queue, stop_event):
+        try:
+            for i in range(len(self.generator)):
+                batch = self.generator[i]
+                # do not block forever if the consumer stopped early
+                while not stop_event.is_set():
+                    try:
+                        batch_queue.put((batch, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop_event.is_set():
+                    return
+        except Exception as e:  # raise it in the consumer thread
+            batch_queue.put((None, e))
+
+    def __iter__(self):
+        if self.prefetch <= 0:
+            for i in range(len(self.generator)):
+                start_time = time.perf_counter()
+                batch = self.generator[i]
+                self.data_wait_time += time.perf_counter() - start_time
+                yield batch
+            return
+
+        batch_queue = queue.Queue(maxsize=self.prefetch)
+        stop_event = threading.Event()
+        thread = threading.Thread(target=self._producer, args=(batch_queue, stop_event), daemon=True)
+        thread.start()
+        try:
+            for _ in range(len(self.generator)):
+                start_time = time.perf_counter()
+                batch, error = batch_queue.get()
+                self.data_wait_time += time.perf_counter() - start_time
+                if error is not None:
+                    raise error
+                yield batch
+        finally:
+            stop_event.set()
@@ -0,0 +1,205 @@
+###############################################################################
+#   norm_cache.py: persistent on-disk cache of normalized training data
+###############################################################################
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from astroNN.config import MAGIC_NUMBER, astroNN_CACHE_DIR
+
+# bump when the layout of cache entries changes so old entries are not used
+_CACHE_VERSION = 1
+
+
+class NormalizationCache(object):
+    """
+    | Persistent on-disk cache of normalized data and fitted mean and std of ``Normalizer``
+    |
+    | Entries are keyed by a content hash of the data and the normalization mode (and mean and std if not fitted), and
+    | stored as .npy files which are loaded as copy-on-write memmaps, so repeated training on the same data (e.g.
+    | hyperparameter trials) skip normalization and only read the data needed. Least recently used entries are evicted
+    | when the total size exceeds ``max_size``.
+
+    :param cache_dir: Folder of the cache, by default ``normalized`` in astroNN cache folder
+    :type cache_dir: Union([NoneType, str])
+    :param max_size: Maximum total size of the cache in bytes
+    :type max_size: int
+    """
+
+    def __init__(self, cache_dir=None, max_size=10 * 1024 ** 3):
+        self.cache_dir = os.path.join(astroNN_CACHE_DIR, "normalized") if cache_dir is None else cache_dir
+        self.max_size = max_size
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def _hash_array(hasher, data, chunk_size=65536):
+        data = np.asarray(data)
+        hasher.update(f"{data.dtype.str}{data.shape}".encode())
+        for start in range(0, max(data.shape[0] if data.ndim > 0 else 1, 1), chunk_size):
+            hasher.update(np.ascontiguousarray(data[start:start + chunk_size] if data.ndim > 0 else data).data)
+
+    def key(self, normalizer, data, calc=True):
+        """
+        Key of a cache entry from content hash of data, normalization mode and, if not fitted, mean and std
+
+        :param normalizer: normalizer
+        :type normalizer: Normalizer
+        :param data: dictionary of data
+        :type data: dict
+        :param calc: Whether mean and std are fitted
+        :type calc: bool
+        :return: key
+        :rtype: str
+        """
+        hasher = hashlib.blake2b(digest_size=20)
+        custom_func = getattr(normalizer._custom_norm_func, "__qualname__", None)
+        hasher.update(f"{_CACHE_VERSION}{MAGIC_NUMBER}{normalizer.normalization_mode}{custom_func}{calc}".encode())
+        for name in sorted(data.keys()):
+            hasher.update(name.encode())
+            self._hash_array(hasher, data[name])
+            if calc is False:
+                self._hash_array(hasher, np.ma.getdata(normalizer.mean_labels[name]))
+                self._hash_array(hasher, np.ma.getdata(normalizer.std_labels[name]))
+        return hasher.hexdigest()
+
+    def _entries(self):
+        """
+        Cache entries with their last used time and size in bytes, least recently used first
+        """
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for key in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.cache_dir, key, "meta.json")
+            if not os.path.isfile(meta_path):  # being written by another process
+                continue
+            folder = os.path.join(self.cache_dir, key)
+            size = sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder))
+            entries.append((os.path.getmtime(meta_path), key, size))
+        return sorted(entries)
+
+    def size(self):
+        """
+        Total size of the cache in bytes
+
+        :return: size
+        :rtype: int
+        """
+        return sum(entry[2] for entry in self._entries())
+
+    def clear(self):
+        """
+        Remove all cache entries
+        """
+        for _, key, _ in self._entries():
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the total size is within ``max_size``
+
+        :param keep: Key of an entry which is never evicted, e.g. the one just stored
+        :type keep: Union([NoneType, str])
+        """
+        entries = self._entries()
+        total_size = sum(entry[2] for entry in entries)
+        for _, key, size in entries:
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total_size -= size
+            self.stats["evictions"] += 1
+
+    def load(self, key):
+        """
+        Load a cache entry
+
+        :param key: key
+        :type key: str
+        :return: dictionary of normalized data as memmaps, mean and std, or None if not in cache
+        :rtype: Union([NoneType, tuple])
+        """
+        folder = os.path.join(self.cache_dir, key)
+        meta_path = os.path.join(folder, "meta.json")
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            norm_data, mean_labels, std_labels = {}, {}, {}
+            for i, name in enumerate(meta["names"]):
+                norm_data[name] = np.load(os.path.join(folder, f"data_{i}.npy"), mmap_mode="c")
+                mean_labels[name] = np.load(os.path.join(folder, f"mean_{i}.npy"))
+                std_labels[name] = np.load(os.path.join(folder, f"std_{i}.npy"))
+        except (FileNotFoundError, ValueError, KeyError):  # not in cache or being evicted
+            return None
+        os.utime(meta_path)  # mark as recently used
+        return norm_data, mean_labels, std_labels
+
+    def store(self, key, norm_data, normalizer):
+        """
+        Store normalized data with mean and std of the normalizer, nothing is stored if they are larger than
+        ``max_size``
+
+        :param key: key
+        :type key: str
+        :param norm_data: dictionary of normalized data
+        :type norm_data: dict
+        :param normalizer: normalizer which normalized the data
+        :type normalizer: Normalizer
+        """
+        if sum(np.asarray(data).nbytes for data in norm_data.values()) > self.max_size:
+            return None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write into a temporary folder and move it into place so other processes never see a partial entry
+        temp_folder = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp_")
+        try:
+            names = list(norm_data.keys())
+            for i, name in enumerate(names):
+                np.save(os.path.join(temp_folder, f"data_{i}.npy"), np.asarray(norm_data[name]))
+                np.save(os.path.join(temp_folder, f"mean_{i}.npy"), np.ma.getdata(normalizer.mean_labels[name]))
+                np.save(os.path.join(temp_folder, f"std_{i}.npy"), np.ma.getdata(normalizer.std_labels[name]))
+            with open(os.path.join(temp_folder, "meta.json"), "w") as f:
+                json.dump({"names": names, "mode": normalizer.normalization_mode, "created": time.time()}, f)
+            os.rename(temp_folder, os.path.join(self.cache_dir, key))
+        except OSError:  # stored by another process in the meantime
+            pass
+        finally:
+            shutil.rmtree(temp_folder, ignore_errors=True)
+        self.evict(keep=key)
+
+    def normalize(self, normalizer, data, calc=True):
+        """
+        Normalize a dictionary of data with ``normalize()`` of normalizer, or load them with mean and std from cache
+
+        :param normalizer: normalizer
+        :type normalizer: Normalizer
+        :param data: dictionary of data
+        :type data: dict
+        :param calc: Whether to fit mean and std
+        :type calc: bool
+        :return: dictionary of normalized data, memmaps if loaded from cache
+        :rtype: dict
+        """
+        key = self.key(normalizer, data, calc=calc)
+        cached = self.load(key)
+        if cached is None:
+            self.stats["misses"] += 1
+            norm_data = normalizer.normalize(data, calc=calc)
+            self.store(key, norm_data, normalizer)
+            return norm_data
+
+        self.stats["hits"] += 1
+        norm_data, mean_labels, std_labels = cached
+        # set up normalization mode and flags with the first data point, then use cached mean and std
+        normalizer.mode_checker({name: np.asarray(data[name][:1]) for name in data.keys()})
+        normalizer.mean_labels.update(mean_labels)
+        normalizer.std_labels.update(std_labels)
+        if normalizer.verbose > 0:
+            print(f"Loaded normalized data from cache {os.path.join(self.cache_dir, key)}")
+        return norm_data
@@ -6,6 +6,7 @@ import numpy as np
 
 from astroNN.config import MAGIC_NUMBER
 from astroNN.nn.numpy import sigmoid_inv, sigmoid
+from astroNN.nn.utilities.file_backed import FileBackedArray, is_file_backed
 from astroNN.shared.dict_tools import list_to_dict, to_iterable
 
 
@@ -39,12 +40,19 @@ class Normalizer(object):
         self._custom_norm_func = None
         self._custom_denorm_func = None
 
+        # running count, mean and M2 of data being fitted by partial_fit()
+        self._moments = {}
+        self._partial_dict_flag = True
+
     def mode_checker(self, data):
         if type(data) is not dict:
             dict_flag = False
             data = {"Temp": data}
-            self.mean_labels = {"Temp": self.mean_labels}
-            self.std_labels = {"Temp": self.std_labels}
+            # nothing fitted yet (empty dictionary) falls back to default mean and std like named data
+            if not (isinstance(self.mean_labels, dict) and len(self.mean_labels) == 0):
+                self.mean_labels = {"Temp": self.mean_labels}
+            if not (isinstance(self.std_labels, dict) and len(self.std_labels) == 0):
+                self.std_labels = {"Temp": self.std_labels}
         else:
             dict_flag = True
 
@@ -177,6 +185,109 @@ Datawise std Center: {self.datasetwise_stdalization}
 
         return data_array
 
+    def partial_fit(self, data):
+        """
+        | Update mean and std being fitted with a chunk of data, finalize() has to be called after all chunks
+        |
+        | Statistics are merged chunk by chunk (Chan et al. parallel algorithm) with data of magic number or NaN
+        | masked, so the fitted mean and std are the same as normalize() on all data at once, in any chunk size.
+
+        :param data: a chunk of data, or dictionary of chunks of named data
+        :type data: Union([ndarray, dict])
+        :return: None
+        """
+        self._partial_dict_flag = type(data) is dict
+        if not self._partial_dict_flag:
+            data = {"Temp": data}
+
+        # set up normalization mode and flags with the first data point of new named data
+        new_names = [name for name in data.keys() if name not in self.featurewise_center]
+        if len(new_names) > 0:
+            if not isinstance(self.mean_labels, dict):
+                self.mean_labels, self.std_labels = {"Temp": self.mean_labels}, {"Temp": self.std_labels}
+            self.mode_checker({name: np.asarray(data[name][:1]) for name in new_names})
+
+        for name in data.keys():
+            featurewise = self.featurewise_center[name] or self.featurewise_stdalization[name]
+            datasetwise = self.datasetwise_center[name] or self.datasetwise_stdalization[name]
+            if not (featurewise or datasetwise):
+                continue
+            chunk = np.asarray(data[name])
+            chunk_moments = _masked_moments(chunk.reshape(chunk.shape[0], -1) if chunk.ndim == 1 else chunk,
+                                            0 if featurewise else None)
+            moments = self._moments.get(name)
+            self._moments[name] = chunk_moments if moments is None else _merge_moments(moments, chunk_moments)
+
+    def finalize(self):
+        """
+        Set mean_labels and std_labels from statistics fitted by partial_fit()
+
+        :return: None
+        """
+        mean_labels = self.mean_labels if isinstance(self.mean_labels, dict) else {"Temp": self.mean_labels}
+        std_labels = self.std_labels if isinstance(self.std_labels, dict) else {"Temp": self.std_labels}
+        for name in self.featurewise_center.keys():
+            mean_labels.setdefault(name, np.array([0.]))
+            std_labels.setdefault(name, np.array([1.]))
+            if name not in self._moments:
+                continue
+            count, mean, m2 = self._moments[name]
+            std = np.sqrt(m2 / np.maximum(count, 1))
+            if self.featurewise_center[name] or self.datasetwise_center[name]:
+                mean_labels.update({name: mean.astype(np.float32)})
+            if self.featurewise_stdalization[name] or self.datasetwise_stdalization[name]:
+                std_labels.update({name: std.astype(np.float32)})
+
+        if self._partial_dict_flag:
+            self.mean_labels, self.std_labels = mean_labels, std_labels
+        else:
+            self.mean_labels, self.std_labels = mean_labels["Temp"], std_labels["Temp"]
+
+    def fit_chunked(self, data, chunk_size=65536):
+        """
+        Fit mean and std of data in a single streaming pass chunk by chunk, so data do not need to fit in memory
+
+        :param data: dictionary of data, can be file-backed (e.g. h5py dataset or numpy memmap)
+        :type data: dict
+        :param chunk_size: number of data read per chunk
+        :type chunk_size: int
+        :return: None
+        """
+        # set up normalization mode and flags with the first data point, then only read data which need statistics
+        self._moments = {}
+        self.mode_checker({name: np.asarray(data[name][:1]) for name in data.keys()})
+        for name in data.keys():
+            if any(flag[name] for flag in [self.featurewise_center, self.datasetwise_center,
+                                           self.featurewise_stdalization, self.datasetwise_stdalization]):
+                for chunk in FileBackedArray(data[name]).iter_chunks(chunk_size):
+                    self.partial_fit({name: chunk})
+        self.finalize()
+
+    def normalize_lazy(self, data, calc=True, chunk_size=65536):
+        """
+        | Normalize a dictionary of data where file-backed data (e.g. h5py dataset or numpy memmap) are normalized lazily
+        | batch by batch when read, other data are normalized in memory
+
+        :param data: dictionary of data
+        :type data: dict
+        :param calc: Whether to fit mean and std in a streaming pass with fit_chunked()
+        :type calc: bool
+        :param chunk_size: number of data read per chunk when fitting
+        :type chunk_size: int
+        :return: dictionary of normalized data
+        :rtype: dict
+        """
+        if calc is True:
+            self.fit_chunked(data, chunk_size=chunk_size)
+        norm_data = {}
+        in_memory = {name: data[name] for name in data.keys() if not is_file_backed(data[name])}
+        if len(in_memory) > 0:
+            norm_data.update(self.normalize(in_memory, calc=False))
+        for name in data.keys():
+            if name not in in_memory:
+                norm_data.update({name: FileBackedArray(data[name], transform=_BatchNormalizer(self, name))})
+        return {name: norm_data[name] for name in data.keys()}
+
     def denormalize(self, data):
         data_array, dict_flag = self.mode_checker(data)
         for name in data_array.keys():  # normalize data for each named inputs
@@ -195,3 +306,50 @@ Datawise std Center: {self.datasetwise_stdalization}
             self.std_labels = self.std_labels['Temp']
 
         return data_array
+
+
+class _BatchNormalizer(object):
+    """
+    Normalize a batch of a named data with fitted mean and std, picklable so it can be sent to worker processes
+    """
+    def __init__(self, normalizer, name):
+        self.normalizer = normalizer
+        self.name = name
+
+    def __call__(self, x):
+        return self.normalizer.normalize({self.name: x}, calc=False)[self.name]
+
+
+def _masked_moments(data, axis):
+    """
+    Number of data, mean and sum of squared deviations (M2) not masked by magic number or NaN
+
+    :param data: data
+    :type data: ndarray
+    :param axis: axis to reduce, None for all data
+    :type axis: Union([NoneType, int])
+    :return: count, mean and M2
+    :rtype: tuple
+    """
+    data = np.asarray(data, dtype=np.float64)
+    valid = ~((data == MAGIC_NUMBER) | np.isnan(data))
+    count = np.sum(valid, axis=axis)
+    mean = np.sum(np.where(valid, data, 0.), axis=axis) / np.maximum(count, 1)
+    m2 = np.sum(np.where(valid, data - mean, 0.) ** 2, axis=axis)
+    return count, mean, m2
+
+
+def _merge_moments(moments_a, moments_b):
+    """
+    Merge moments of two sets of data with Chan et al. parallel algorithm
+
+    :return: count, mean and M2
+    :rtype: tuple
+    """
+    count_a, mean_a, m2_a = moments_a
+    count_b, mean_b, m2_b = moments_b
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / np.maximum(count, 1)
+    m2 = m2_a + m2_b + delta ** 2 * count_a * count_b / np.maximum(count, 1)
+    return count, mean, m2
@@ -0,0 +1,134 @@
+###############################################################################
+#   shared_array.py: NumPy arrays backed by shared memory for worker processes
+###############################################################################
+import sys
+import weakref
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # python < 3.8
+    resource_tracker, shared_memory = None, None
+
+
+def _release(shm):
+    try:
+        shm.close()
+    except BufferError:  # views of the array are still alive, memory is freed once they are gone
+        pass
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+# whether this process started a resource tracker of its own by attaching to shared memory
+_private_tracker = False
+
+
+def attach_shared_memory(name):
+    """
+    | Attach to an existing shared memory block by name without taking over its ownership
+    |
+    | The process which created the shared memory unlinks it. Processes started by multiprocessing (fork or spawn)
+    | share the resource tracker of their parent, so the registration of the owner must be kept. Only a resource
+    | tracker started by the attaching process itself is told to forget the shared memory, so it does not unlink it
+    | when the attaching process exits.
+
+    :param name: name of the shared memory block
+    :type name: str
+    :return: shared memory
+    :rtype: multiprocessing.shared_memory.SharedMemory
+    """
+    global _private_tracker
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    if resource_tracker._resource_tracker._fd is None:
+        # no tracker inherited from parent, attaching starts one owned by this process only
+        _private_tracker = True
+    shm = shared_memory.SharedMemory(name=name)
+    if _private_tracker:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _attach(name, shape, dtype):
+    """
+    Attach to an existing shared memory block by name in a worker process
+    """
+    return SharedArray._from_shm(attach_shared_memory(name), shape, dtype, owner=False)
+
+
+class SharedArray(np.ndarray):
+    """
+    | NumPy array backed by a ``multiprocessing.shared_memory`` block
+    |
+    | It is pickled by the name of the shared memory block, so sending it to worker processes (e.g. data generators
+    | with ``use_multiprocessing=True``) does not copy the data and every process attaches to the same memory. Views
+    | and results of operations are ordinary arrays in memory of their own process. The process which created the
+    | array unlinks the shared memory when the array is garbage collected or ``release()`` is called.
+    """
+
+    @classmethod
+    def from_array(cls, array):
+        """
+        Copy an array into a new shared memory block
+
+        :param array: array
+        :type array: ndarray
+        :return: array backed by shared memory
+        :rtype: SharedArray
+        """
+        if shared_memory is None:
+            raise ImportError("SharedArray requires python 3.8 or above")
+        array = np.asarray(array)
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = cls._from_shm(shm, array.shape, array.dtype, owner=True)
+        shared[...] = array
+        return shared
+
+    @classmethod
+    def _from_shm(cls, shm, shape, dtype, owner):
+        shared = np.ndarray.__new__(cls, shape, dtype=dtype, buffer=shm.buf)
+        shared._shm = shm
+        shared._finalizer = weakref.finalize(shared, _release, shm) if owner else None
+        return shared
+
+    def __array_finalize__(self, obj):
+        # views and results of operations do not own the shared memory and are pickled by value
+        self._shm = None
+        self._finalizer = None
+
+    def __reduce__(self):
+        if self._shm is None:
+            return np.asarray(self).__reduce__()
+        return _attach, (self._shm.name, self.shape, self.dtype.str)
+
+    @property
+    def shm_name(self):
+        """
+        Name of the shared memory block, None for views
+        """
+        return None if self._shm is None else self._shm.name
+
+    def release(self):
+        """
+        Unlink the shared memory (only by the process which created it), the array must not be used afterwards
+        """
+        if self._finalizer is not None:
+            self._finalizer()
+
+
+def to_shared_array(data):
+    """
+    Copy in-memory NumPy array into shared memory, other data (e.g. file-backed data) are returned as they are
+
+    :param data: data
+    :type data: Union([ndarray, NoneType])
+    :return: array backed by shared memory or data
+    :rtype: Union([SharedArray, NoneType])
+    """
+    if type(data) is np.ndarray and data.dtype != object:
+        return SharedArray.from_array(data)
+    return data
@@ -43,6 +43,9 @@ setup(
         "tensorflow": [f"tensorflow>={tf_min_version}"],
         "tensorflow-probability": [f"tensorflow-probability>={tfp_min_version}"],
     },
+    entry_points={
+        "console_scripts": ["astronn-serve=astroNN.models.server:main"],
+    },
     url="https://github.com/henrysky/astroNN",
     project_urls={
         "Bug Tracker": "https://github.com/henrysky/astroNN/issues",
@@ -1,16 +1,23 @@
+import asyncio
+import json
 import os
+import urllib.error
 import urllib.request
 import unittest
+from unittest import mock
 
 import h5py
 import numpy as np
 
 from astroNN.models import ApogeeCNN, ApogeeBCNN, ApogeeBCNNCensored, ApogeeDR14GaiaDR2BCNN, StarNet2017, ApogeeCVAE, \
     ApogeeKplerEchelle, ApokascEncoderDecoder
-from astroNN.models import load_folder
+from astroNN.models import load_folder, ParallelPredictor, InferenceServer, DistributedTrainer, \
+    benchmark_distributed_scaling
 from astroNN.nn.callbacks import ErrorOnNaN
+from astroNN.nn.utilities.shared_array import SharedArray
 from astroNN.shared.downloader_tools import TqdmUpTo
 
+import tensorflow as tf
 from tensorflow import keras as tfk
 mnist = tfk.datasets.mnist
 utils = tfk.utils
@@ -47,8 +54,21 @@ class ApogeeModelTestCase(unittest.TestCase):
         neuralnet.max_epochs = 5  # for quick result
         neuralnet.callbacks = ErrorOnNaN()  # Raise error and fail the test if Nan
         neuralnet.targetname = ["logg", "feh"]
+        neuralnet.data_shared_memory = True
         neuralnet.fit(xdata, ydata)  # training
+        # shared memory of training data is released after training
+        self.assertNotIsInstance(neuralnet.training_generator.data[0]["input"], SharedArray)
         neuralnet.fit_on_batch(xdata[:64], ydata[:64])  # single batch fine-tuning test
+
+        # tf.data pipeline should not read file-backed training data into memory
+        lazy_neuralnet = ApogeeCNN()
+        lazy_neuralnet.max_epochs = 1
+        lazy_neuralnet.data_pipeline = "tf.data"
+        lazy_neuralnet.fit(f["spectra"], ydata)
+        rows_read = lazy_neuralnet.data_read_stats()["training_input"]["rows"]
+        lazy_neuralnet._fit_data()
+        self.assertLess(lazy_neuralnet.data_read_stats()["training_input"]["rows"] - rows_read,
+                        lazy_neuralnet.num_train)
         # self.assertEqual(neuralnet.uses_learning_phase, True)  # Assert ApogeeCNN uses learning phase (bc of Dropout)
 
         # test basic astroNN model method
@@ -97,6 +117,75 @@ class ApogeeModelTestCase(unittest.TestCase):
         # ApogeeCNN is deterministic check again
         np.testing.assert_array_equal(prediction, prediction_loaded)
 
+        # multi-process sharded inference should agree with single process inference
+        with ParallelPredictor("apogee_cnn", n_workers=2) as predictor:
+            prediction_parallel = predictor.predict(xdata[:500])
+        np.testing.assert_allclose(prediction_parallel, prediction[:500], rtol=1e-5, atol=1e-5)
+        # concurrent tiny requests to the local inference server should be micro-batched
+        async def serve_requests():
+            server = InferenceServer("apogee_cnn", port=0, max_latency=0.1)
+            await server.start()
+            try:
+                results = await asyncio.gather(*[server.predict(xdata[i:i + 3]) for i in range(0, 30, 3)])
+                # a malformed request is rejected alone without failing others in the same micro-batch
+                mixed_results = await asyncio.gather(server.predict(xdata[:3]), server.predict(xdata[:3, :100]),
+                                                     return_exceptions=True)
+                http_request = urllib.request.Request(f"http://127.0.0.1:{server.port}/predict",
+                                                      data=json.dumps({"input": xdata[:2].tolist()}).encode())
+                http_result = await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: json.loads(urllib.request.urlopen(http_request).read()))
+                bad_http_request = urllib.request.Request(f"http://127.0.0.1:{server.port}/predict",
+                                                          data=json.dumps({"input": xdata[:2, :100].tolist()}).encode())
+                with self.assertRaises(urllib.error.HTTPError) as http_error:
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, lambda: urllib.request.urlopen(bad_http_request).read())
+                self.assertEqual(http_error.exception.code, 400)
+                return results, mixed_results, http_result, server.get_stats()
+            finally:
+                await server.stop()
+
+        results, mixed_results, http_result, server_stats = asyncio.run(serve_requests())
+        np.testing.assert_allclose(mixed_results[0]["prediction"], prediction[:3], rtol=1e-5, atol=1e-5)
+        self.assertIsInstance(mixed_results[1], ValueError)
+        np.testing.assert_allclose(np.concatenate([i["prediction"] for i in results]), prediction[:30],
+                                   rtol=1e-5, atol=1e-5)
+        np.testing.assert_allclose(http_result["prediction"], prediction[:2], rtol=1e-5, atol=1e-5)
+        self.assertEqual(server_stats["requests"], 12)
+        self.assertLess(server_stats["batches"], 11)
+        self.assertGreater(server_stats["fill_ratio_mean"], 0.)
+
+        # remainder of data is padded to the batch size and trimmed
+        np.testing.assert_allclose(neuralnet_loaded.predict(xdata[:5]), prediction[:5], rtol=1e-5, atol=1e-5)
+        # small request should not change batch size, and alternating request sizes should reuse predict functions
+        self.assertEqual(neuralnet_loaded.batch_size, neuralnet.batch_size)
+        traces = neuralnet_loaded.inference_stats["traces"]
+        neuralnet_loaded.predict(xdata[:1000])
+        neuralnet_loaded.predict(xdata[:5])
+        neuralnet_loaded.predict(xdata[:1000], batch_size=neuralnet.batch_size)
+        self.assertEqual(neuralnet_loaded.inference_stats["traces"], traces)
+        # batch preparation overlaps with computation and time spent on them are reported
+        self.assertGreater(neuralnet_loaded.inference_stats["compute_time"], 0.)
+        self.assertGreaterEqual(neuralnet_loaded.inference_stats["data_wait_time"], 0.)
+
+        # exported SavedModel runs without astroNN and includes normalization
+        export_path = neuralnet_loaded.export(tflite=False)
+        exported = tf.saved_model.load(export_path).signatures["serving_default"]
+        np.testing.assert_allclose(exported(input=tf.constant(xdata[:100], dtype=tf.float32))["output"].numpy(),
+                                   prediction[:100], rtol=1e-4, atol=1e-4)
+
+        # batch size tuning does not change the model, chosen batch sizes are used by load_folder()
+        tuning = neuralnet_loaded.tune_batch_size(xdata[:64], ydata[:64], batch_sizes=[8, 16, 32], steps=1)
+        self.assertEqual(set(tuning["train_throughput"].keys()), {8, 16, 32})
+        self.assertIn(neuralnet_loaded.predict_batch_size, [8, 16, 32])
+        np.testing.assert_allclose(neuralnet_loaded.predict(xdata[:5]), prediction[:5], rtol=1e-5, atol=1e-5)
+        self.assertEqual(load_folder("apogee_cnn").predict_batch_size, neuralnet_loaded.predict_batch_size)
+        # probing stops before a batch size estimated to exceed the memory limit, memory before tuning does not count
+        with mock.patch("astroNN.models.base_master_nn._peak_memory",
+                        side_effect=[10e9, 10e9 + 30e6, 10e9 + 60e6, 10e9 + 60e6]):
+            tuning = neuralnet_loaded.tune_batch_size(xdata[:64], ydata[:64], batch_sizes=[8, 16, 32], steps=1,
+                                                      memory_limit=100e6, tune_predict=False, save=False)
+        self.assertEqual(set(tuning["train_throughput"].keys()), {8, 16})
+
         # Fine tuning test
         neuralnet_loaded.max_epochs = 5
         neuralnet_loaded.callbacks = ErrorOnNaN()
@@ -106,6 +195,37 @@ class ApogeeModelTestCase(unittest.TestCase):
         # prediction should not be equal after fine-tuning
         self.assertRaises(AssertionError, np.testing.assert_array_equal, prediction, prediction_loaded)
 
+    def test_apogee_distributed(self):
+        """
+        Test data-parallel training of ApogeeCNN with 2 worker processes on localhost
+        """
+        print("======ApogeeCNN Distributed======")
+        neuralnet = ApogeeCNN()
+        neuralnet.max_epochs = 1
+        trainer = DistributedTrainer(neuralnet, n_workers=2)
+        # h5py datasets cannot be sent to worker processes
+        self.assertRaises(TypeError, trainer.fit, f["spectra"], ydata)
+        neuralnet_trained = trainer.fit(xdata, ydata, folder="apogee_cnn_distributed")
+
+        # every worker trains on its own disjoint shard of the same size with half of the batch size
+        shards = [result["shard"] for result in trainer.worker_results]
+        self.assertEqual(sorted(shard["index"] for shard in shards), [0, 1])
+        for shard in shards:
+            self.assertEqual(shard["num_shards"], 2)
+            self.assertEqual(shard["batch_size"], neuralnet.batch_size // 2)
+            self.assertEqual(shard["num_data"], shards[0]["num_data"])
+            self.assertEqual(shard["steps_per_epoch"], shards[0]["steps_per_epoch"])
+        self.assertEqual(len(trainer.worker_results[0]["history"]["loss"]), 1)
+        prediction = neuralnet_trained.predict(xdata[:100])
+        self.assertEqual(prediction.shape, (100, 2))
+        self.assertTrue(np.all(np.isfinite(prediction)))
+
+        neuralnet = ApogeeCNN()
+        neuralnet.max_epochs = 1
+        scaling = benchmark_distributed_scaling(neuralnet, xdata, ydata, worker_counts=[1, 2])
+        self.assertEqual(set(scaling.keys()), {1, 2})
+        self.assertEqual(scaling[1]["speedup"], 1.)
+
     def test_apogee_bcnn(self):
         """
         Test ApogeeBCNN models
@@ -145,6 +265,62 @@ class ApogeeModelTestCase(unittest.TestCase):
         # prevent memory issue on Tavis CI
         bneuralnet_loaded.mc_num = 2
         pred, pred_err = bneuralnet_loaded.predict(xdata)
+
+        # streaming prediction from h5py dataset straight into preallocated arrays
+        stream_output = {"prediction": np.zeros_like(pred), "total": np.zeros_like(pred)}
+        for _ in bneuralnet_loaded.predict_stream(f["spectra"], chunk_size=500, output=stream_output):
+            pass
+        np.testing.assert_array_equal(stream_output["prediction"].shape, ydata.shape)
+        self.assertEqual(np.all(stream_output["total"] > 0.), True)
+        # Monte Carlo inference model should be built once and reused across predict calls
+        self.assertEqual(bneuralnet_loaded.inference_stats["cache_misses"], 1)
+        self.assertEqual(bneuralnet_loaded.inference_stats["cache_hits"] > 0, True)
+        # batches are padded to a fixed shape, so predicting data of another size should not trace a new graph
+        traces = bneuralnet_loaded.inference_stats["traces"]
+        pred_remainder, _ = bneuralnet_loaded.predict(xdata[:bneuralnet_loaded.batch_size + 3])
+        np.testing.assert_array_equal(pred_remainder.shape, ydata[:bneuralnet_loaded.batch_size + 3].shape)
+        self.assertEqual(bneuralnet_loaded.inference_stats["traces"], traces)
+
+        # prediction from h5py dataset whose length is not a multiple of batch size, so the last batch is padded
+        num_dataset = bneuralnet_loaded.batch_size * 2 + 3
+        with h5py.File("apogee_bcnn_predict_dataset.h5", "w") as h5f:
+            h5f.create_dataset("spectra", data=xdata[:num_dataset])
+        bneuralnet_loaded.mc_seed = 42
+        with h5py.File("apogee_bcnn_predict_dataset.h5", "r") as h5f:
+            pred_dataset, pred_dataset_err = bneuralnet_loaded.predict_dataset(h5f["spectra"])
+        pred_memory, pred_memory_err = bneuralnet_loaded.predict(xdata[:num_dataset])
+        bneuralnet_loaded.mc_seed = None
+        np.testing.assert_array_equal(pred_dataset.shape, ydata[:num_dataset].shape)
+        np.testing.assert_allclose(pred_dataset, pred_memory, rtol=1e-4, atol=1e-4)
+
+        # adaptive Monte Carlo inference should never draw more than mc_num samples (rounded up to mc_block)
+        bneuralnet_loaded.mc_num = 8
+        pred, pred_err = bneuralnet_loaded.predict(xdata[:200], mc_tol=0.1, mc_block=4)
+        np.testing.assert_array_equal(pred.shape, ydata[:200].shape)
+        self.assertEqual(np.all((pred_err["mc_num"] >= 4) & (pred_err["mc_num"] <= 8)), True)
+        bneuralnet_loaded.mc_num = 2
+
+        # seeded Monte Carlo inference of a subset should be identical to that of the whole catalog
+        bneuralnet_loaded.mc_seed = 42
+        pred, pred_err = bneuralnet_loaded.predict(xdata[:200])
+        pred_subset, pred_err_subset = bneuralnet_loaded.predict(xdata[100:200], sample_index=np.arange(100, 200))
+        np.testing.assert_allclose(pred[100:], pred_subset, rtol=1e-5)
+        np.testing.assert_allclose(pred_err["model"][100:], pred_err_subset["model"], rtol=1e-4)
+        self.assertRaises(ValueError, bneuralnet_loaded.predict, xdata[:10], mc_tol=0.1)
+        # exported seeded Monte Carlo inference should agree with predict()
+        export_path = bneuralnet_loaded.export(path="apogee_bcnn_saved_model", tflite=False)
+        exported = tf.saved_model.load(export_path).signatures["serving_default"]
+        exported_result = exported(input=tf.constant(xdata[100:200], dtype=tf.float32),
+                                   sample_index=tf.range(100, 200, dtype=tf.int64))
+        np.testing.assert_allclose(exported_result["prediction"].numpy(), pred_subset, rtol=1e-4, atol=1e-4)
+        np.testing.assert_allclose(exported_result["total"].numpy(), pred_err_subset["total"], rtol=1e-3, atol=1e-4)
+        # compressed model should stay close to the float32 model
+        report = bneuralnet_loaded.compress(xdata[:200], path="apogee_bcnn_compressed", prune=0.5)
+        self.assertAlmostEqual(report["dense_sparsity"], 0.5, places=2)
+        self.assertGreater(report["size_ratio"], 2.)
+        self.assertLess(report["outputs"]["prediction"]["mean_rel_diff"], 0.1)
+        self.assertEqual(os.path.exists("apogee_bcnn_compressed/compression_report.json"), True)
+        bneuralnet_loaded.mc_seed = None
         bneuralnet_loaded.save()
 
         # Fine-tuning test
@@ -168,7 +344,9 @@ class ApogeeModelTestCase(unittest.TestCase):
 
         bneuralnetcensored.max_epochs = 1
         bneuralnetcensored.callbacks = ErrorOnNaN()
-        bneuralnetcensored.fit(random_xdata, random_ydata)
+        bneuralnetcensored.fit(random_xdata, random_ydata, experimental=True)
+        # tf.data pipeline of experimental=True only applies to that fit() call
+        self.assertEqual(bneuralnetcensored.data_pipeline, "generator")
         # prevent memory issue on Tavis CI
         bneuralnetcensored.mc_num = 2
         prediction, prediction_err = bneuralnetcensored.predict(random_xdata)
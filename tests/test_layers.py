@@ -271,6 +271,67 @@ class LayerCase(unittest.TestCase):
         # make sure accelerated model has no variance (uncertainty) on deterministic model prediction
         self.assertAlmostEqual(np.sum(y[:, :, 1]), 0.)
 
+        # memory-bounded chunked strategy (with a remainder chunk) should agree on deterministic model
+        chunked_model = FastMCInference(25, strategy="chunked", chunk_size=10)(model)
+        yc = chunked_model.predict(random_xdata)
+        npt.assert_almost_equal(yc[:, :, 0], y[:, :, 0], decimal=4)
+        self.assertAlmostEqual(np.sum(yc[:, :, 1]), 0., places=4)
+        # auto strategy should only fall back to chunked strategy when exceeding memory budget
+        self.assertEqual(FastMCInference(100, strategy="auto").select_strategy(model), "pfor")
+        self.assertEqual(FastMCInference(100, strategy="auto", memory_budget=1, batch_size=64).select_strategy(model),
+                         "chunked")
+        self.assertRaises(ValueError, FastMCInference(100, strategy="abc").select_strategy, model)
+
+        # deterministic prefix should be split at the first stochastic layer and computed once
+        from astroNN.nn.layers import MCDropout, _split_deterministic_prefix
+        input = Input(shape=[7514])
+        dense = Dense(100)(input)
+        dropout = MCDropout(0.2, disable=True)(dense)
+        output = Dense(25)(dropout)
+        mc_model = Model(inputs=input, outputs=output)
+        prefix_model, suffix_model = _split_deterministic_prefix(mc_model)
+        self.assertEqual(prefix_model.output_shape, (None, 100))
+        # nothing to split if the stochastic layer comes first
+        self.assertEqual(_split_deterministic_prefix(Model(inputs=input, outputs=MCDropout(0.2)(input))), None)
+        # fall back to the full model if Keras internals are not as expected
+        history = dense._keras_history
+        del dense._keras_history
+        self.assertEqual(_split_deterministic_prefix(mc_model), None)
+        dense._keras_history = history
+        # stochastic layers unknown to astroNN must not be computed once by default
+        dropout_input = Input(shape=[20])
+        keras_dropout = tfk.layers.Dropout(0.5)(Dense(20, kernel_initializer='ones')(dropout_input), training=True)
+        unlisted_model = Model(inputs=dropout_input, outputs=Dense(5)(MCDropout(0.2)(keras_dropout)))
+        unlisted_x = np.random.normal(size=(50, 20))
+        unlisted_var = np.mean(FastMCInference(50)(unlisted_model).predict(unlisted_x)[:, :, 1])
+        prefix_model = FastMCInference(50, deterministic_prefix=True)(unlisted_model)
+        prefix_var = np.mean(prefix_model.predict(unlisted_x)[:, :, 1])
+        self.assertGreater(unlisted_var, prefix_var)
+        from astroNN.models import ApogeeBCNN
+        self.assertEqual(ApogeeBCNN().mc_deterministic_prefix, False)
+        prefix_acc_model = FastMCInference(10, deterministic_prefix=True)(mc_model)
+        npt.assert_almost_equal(prefix_acc_model.predict(random_xdata)[:, :, 0], mc_model.predict(random_xdata),
+                                decimal=4)
+
+        # seeded inference should be reproducible regardless of batching and strategy
+        input = Input(shape=[7514])
+        dense = Dense(100)(input)
+        output = Dense(25)(MCDropout(0.2)(dense))
+        mc_model = Model(inputs=input, outputs=output)
+        seeded_model = FastMCInference(10, seed=42)(mc_model)
+        sample_index = np.arange(100)
+        ys = seeded_model.predict({'input': random_xdata, 'sample_index': sample_index}, batch_size=32)
+        ys_subset = seeded_model.predict({'input': random_xdata[50:], 'sample_index': sample_index[50:]}, batch_size=7)
+        npt.assert_almost_equal(ys[50:], ys_subset, decimal=5)
+        self.assertGreater(np.sum(ys[:, :, 1]), 0.)  # still stochastic across draws
+        # last batch of a single data point should keep its batch axis
+        ys_chunked = FastMCInference(10, strategy="chunked", chunk_size=4, seed=42)(mc_model).predict(
+            {'input': random_xdata, 'sample_index': sample_index}, batch_size=33)
+        npt.assert_almost_equal(ys, ys_chunked, decimal=5)
+        ys_other_seed = FastMCInference(10, seed=43)(mc_model).predict({'input': random_xdata,
+                                                                         'sample_index': sample_index})
+        self.assertEqual(np.any(np.not_equal(ys, ys_other_seed)), True)
+
         # assert error raised for things other than keras model
         self.assertRaises(TypeError, FastMCInference(10), '123')
 
@@ -287,6 +348,32 @@ class LayerCase(unittest.TestCase):
         # make sure accelerated model has no variance (uncertainty) on deterministic model prediction
         self.assertAlmostEqual(np.sum(sy[:, :, 1]), 0.)
 
+    def test_FastMCInferencePostProcess(self):
+        print('==========FastMCInferencePostProcess tests==========')
+        from astroNN.nn.layers import FastMCInferencePostProcess
+
+        # Data preparation, mean and variance of 3 predictions and 3 log variances
+        mc_result = np.random.uniform(0.1, 0.9, (100, 6, 2))
+        labels_mean, labels_std = np.array([1., 2., 3.]), np.array([2., 3., 4.])
+
+        pred, total, model, predictive = [i.numpy() for i in FastMCInferencePostProcess(
+            "regression", labels_mean, labels_std, dtype="float64")(mc_result)]
+        npt.assert_almost_equal(pred, mc_result[:, :3, 0] * labels_std + labels_mean)
+        npt.assert_almost_equal(model, np.sqrt(mc_result[:, :3, 1]) * labels_std)
+        npt.assert_almost_equal(predictive, np.sqrt(np.exp(mc_result[:, 3:, 0])) * labels_std)
+        npt.assert_almost_equal(total, np.sqrt(model ** 2 + predictive ** 2))
+
+        # classification should be vectorized over data
+        pred, total, model, predictive = [i.numpy() for i in FastMCInferencePostProcess(
+            "classification", dtype="float64")(mc_result)]
+        npt.assert_array_equal(pred, np.argmax(mc_result[:, :3, 0], axis=1))
+        npt.assert_almost_equal(model, -np.sum(mc_result[:, :3, 0] * np.log(mc_result[:, :3, 0]), axis=1))
+        npt.assert_almost_equal(predictive, np.exp(mc_result[:, 3:, 0])[np.arange(100), pred] - 1.)
+
+        # single data point without batch dimension
+        self.assertEqual(FastMCInferencePostProcess("regression")(mc_result[0])[0].shape, (1, 3))
+        self.assertRaises(AttributeError, FastMCInferencePostProcess, "abc")
+
     def test_TensorInput(self):
         print('==========BoolMask tests==========')
         from astroNN.nn.layers import TensorInput
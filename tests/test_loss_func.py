@@ -21,7 +21,8 @@ from astroNN.nn.losses import (
     mean_error,
     zeros_loss,
     mean_percentage_error, 
-    median
+    median,
+    robust_mse
 )
 from astroNN.nn.metrics import (
     categorical_accuracy,
@@ -48,6 +49,28 @@ class LossFuncTestCase(unittest.TestCase):
         )
         npt.assert_array_equal(magic_correction_term(y_true).numpy(), [3.0, 1.5])
 
+    def test_loss_mixed_precision(self):
+        # =============Losses under mixed precision============= #
+        y_true = [[2.0, MAGIC_NUMBER, 4.0], [2.0, MAGIC_NUMBER, 4.0]]
+        y_pred = [[2.0, 3.0, 4.0], [2.0, 3.0, 7.0]]
+        # correction term follows the dtype of ground truth
+        self.assertEqual(magic_correction_term(tf.constant(y_true, dtype=tf.float64)).dtype, tf.float64)
+        # magic number is not exact in half precision but should still be masked, losses are calculated in float32
+        for dtype in [tf.float16, tf.bfloat16]:
+            mse = mean_squared_error(tf.constant(y_true, dtype=dtype), tf.constant(y_pred, dtype=dtype))
+            self.assertEqual(mse.dtype, tf.float32)
+            npt.assert_almost_equal(mse.numpy(), [0.0, 9.0 / 2])
+        # robust_mse should not overflow with large log variance in half precision
+        variance = tf.constant([[20.0, 20.0, 20.0], [0.0, 0.0, 0.0]], dtype=tf.float16)
+        labels_err = tf.constant([[0.1, 0.1, 0.1], [0.0, 0.0, 0.0]], dtype=tf.float16)
+        losses = robust_mse(tf.constant(y_true, dtype=tf.float16), tf.constant(y_pred, dtype=tf.float16), variance,
+                            labels_err)
+        self.assertEqual(np.all(np.isfinite(losses.numpy())), True)
+        npt.assert_almost_equal(losses.numpy(), robust_mse(tf.constant(y_true), tf.constant(y_pred),
+                                                           tf.cast(variance, tf.float32),
+                                                           tf.cast(labels_err, tf.float32)).numpy(), decimal=5)
+        npt.assert_almost_equal(losses.numpy()[1], 0.5 * 9.0 / 3 * 1.5, decimal=5)
+
     def test_loss_mse(self):
         # =============MSE/MAE============= #
         y_pred = tf.constant([[2.0, 3.0, 4.0], [2.0, 3.0, 7.0]])
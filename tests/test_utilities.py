@@ -20,6 +20,16 @@ class UtilitiesTestCase(unittest.TestCase):
         self.assertEqual(sha256_pred, '36C265C907F440114D747DA21D2A014D32B5E442D541F183C0EE862F5865FD26'.lower())
         self.assertRaises(ValueError, filehash, anderson2017_path, algorithm='sha123')
 
+    def test_parallel_predictor_input_check(self):
+        from astroNN.models import ParallelPredictor
+        import numpy as np
+
+        # invalid inputs are rejected before any worker process is started
+        predictor = ParallelPredictor("not_a_model_folder", n_workers=1)
+        self.assertRaises(ValueError, predictor.predict, np.zeros((0, 10)))
+        self.assertRaises(ValueError, predictor.predict, {"spectra": np.zeros((5, 10))})
+        self.assertIsNone(predictor._executor)
+
     def test_normalizer(self):
         from astroNN.nn.utilities.normalizer import Normalizer
         from astroNN.config import MAGIC_NUMBER
@@ -70,6 +80,346 @@ class UtilitiesTestCase(unittest.TestCase):
         errorous_norm = Normalizer(mode=-1234)
         self.assertRaises(ValueError, errorous_norm.normalize, data)
 
+    def test_generator_prefetcher(self):
+        from astroNN.nn.utilities.generator import GeneratorMaster, GeneratorPrefetcher
+        import numpy as np
+
+        class TestGenerator(GeneratorMaster):
+            def __getitem__(self, index):
+                if index == 3 and self.data is None:
+                    raise ValueError("broken batch")
+                return {"input": np.full((2, 1), index)}
+
+        for prefetch in [0, 2]:
+            # batches should come in order, whether prepared ahead or not
+            prefetcher = GeneratorPrefetcher(TestGenerator(2, False, 5, [], False), prefetch=prefetch)
+            npt.assert_array_equal([batch["input"][0, 0] for batch in prefetcher], np.arange(5))
+            self.assertGreaterEqual(prefetcher.data_wait_time, 0.)
+            # error in preparing batches should be raised
+            self.assertRaises(ValueError, list, GeneratorPrefetcher(TestGenerator(2, False, 5, None, False),
+                                                                    prefetch=prefetch))
+
+    def test_generator_batch_assembly(self):
+        from astroNN.nn.utilities.generator import GeneratorMaster
+        import numpy as np
+
+        data = np.random.normal(size=(20, 5)).astype(np.float32)
+        generator = GeneratorMaster(4, False, 5, None, False)
+        # contiguous indices give views of the data in its own dtype
+        batch = generator.input_d_checking({"input": data}, range(4, 8))["input"]
+        self.assertEqual(batch.dtype, np.float32)
+        self.assertEqual(np.shares_memory(batch, data), True)
+        npt.assert_array_equal(batch[:, :, 0], data[4:8])
+        # shuffled indices are gathered into buffers which are reused after buffer_slots batches
+        idx = np.array([3, 1, 7, 0])
+        first_batch = generator.input_d_checking({"input": data}, idx)["input"]
+        npt.assert_array_equal(first_batch[:, :, 0], data[idx])
+        self.assertEqual(np.shares_memory(first_batch, data), False)
+        for _ in range(generator.buffer_slots - 1):
+            generator.input_d_checking({"input": data}, idx[::-1])
+        npt.assert_array_equal(first_batch[:, :, 0], data[idx])
+        # batches alive in Keras queue and worker threads are never overwritten
+        self.assertGreater(generator.buffer_slots, generator.max_queue_size + generator.workers)
+        self.assertEqual(np.shares_memory(generator.input_d_checking({"input": data}, idx[:2])["input"],
+                                          first_batch), True)
+        # non-floating data are converted to float32
+        int_batch = generator.input_d_checking({"input": np.arange(40).reshape(20, 2)}, idx)["input"]
+        self.assertEqual(int_batch.dtype, np.float32)
+        npt.assert_array_equal(int_batch[:, :, 0], np.arange(40).reshape(20, 2)[idx])
+
+    def test_generator_as_dataset(self):
+        from astroNN.models.base_cnn import CNNDataGenerator
+        from astroNN.nn.utilities.generator import benchmark_data_pipeline
+        import numpy as np
+
+        data = np.random.normal(size=(20, 5)).astype(np.float32)
+        labels = np.arange(20, dtype=np.float32)[:, None]
+        generator = CNNDataGenerator(batch_size=4, shuffle=False, steps_per_epoch=5,
+                                     data=[{"input": data}, {"output": labels}])
+        # without shuffling, batches are the same as the generator
+        batches = list(generator.as_dataset())
+        self.assertEqual(len(batches), len(generator))
+        for i, (x, y) in enumerate(batches):
+            npt.assert_array_equal(x["input"].numpy(), generator[i][0]["input"])
+            npt.assert_array_equal(y["output"].numpy(), generator[i][1]["output"])
+
+        # shuffling is element-level, batches are not fixed groups of contiguous data
+        generator.shuffle = True
+        epoch_1 = np.concatenate([y["output"].numpy() for _, y in generator.as_dataset(cache="memory")])
+        self.assertEqual(sorted(epoch_1[:, 0].tolist()), labels[:, 0].tolist())
+        groups = {tuple(sorted(epoch_1[i:i + 4, 0] // 4)) for i in range(0, 20, 4)}
+        self.assertNotEqual(groups, {(i, i, i, i) for i in range(5)})
+
+        # augmentation map
+        dataset = generator.as_dataset(map_func=lambda x, y: ({"input": x["input"] * 0.}, y))
+        for x, _ in dataset:
+            npt.assert_array_equal(x["input"].numpy(), 0.)
+
+        result = benchmark_data_pipeline(generator)
+        self.assertEqual(result["generator_batches"], result["dataset_batches"])
+
+    def test_generator_shard(self):
+        from astroNN.models.base_cnn import CNNDataGenerator
+        import numpy as np
+
+        data = np.random.normal(size=(23, 5)).astype(np.float32)
+        labels = np.arange(23, dtype=np.float32)[:, None]
+        seen = []
+        for index in range(3):
+            generator = CNNDataGenerator(batch_size=6, shuffle=True, steps_per_epoch=3,
+                                         data=[{"input": data}, {"output": labels}]).shard(3, index, batch_size=2)
+            # every shard has the same number of data and steps
+            self.assertEqual(len(generator), 23 // 3 // 2)
+            shard = np.concatenate([generator[i][1]["output"] for i in range(len(generator))])[:, 0]
+            seen.append(shard)
+            self.assertTrue(np.all(shard % 3 == index))
+
+            # both datasets read the same shard as the generator
+            dataset_labels = np.concatenate([y["output"].numpy() for _, y in generator.as_dataset()])[:, 0]
+            self.assertTrue(np.all(dataset_labels % 3 == index))
+            self.assertEqual(len(dataset_labels), len(shard))
+            generator_labels = np.concatenate([y["output"].numpy() for _, y in generator.as_generator_dataset()])
+            self.assertTrue(np.all(generator_labels % 3 == index))
+        # shards are disjoint
+        self.assertEqual(len(np.unique(np.concatenate(seen))), sum(len(shard) for shard in seen))
+
+    def test_file_backed_normalization(self):
+        import tempfile
+        import h5py
+        import numpy as np
+        from astroNN.config import MAGIC_NUMBER
+        from astroNN.models.base_cnn import CNNDataGenerator
+        from astroNN.nn.utilities import Normalizer
+        from astroNN.nn.utilities.file_backed import FileBackedArray, take_rows
+
+        data = np.random.normal(2., 3., size=(1000, 7)).astype(np.float32)
+        data[::13, 2] = MAGIC_NUMBER
+        data[::17, 5] = np.nan
+        with tempfile.TemporaryDirectory() as tmpdir:
+            memmap = np.lib.format.open_memmap(os.path.join(tmpdir, "data.npy"), mode="w+", dtype=np.float32,
+                                               shape=data.shape)
+            memmap[:] = data
+            with h5py.File(os.path.join(tmpdir, "data.h5"), "w") as f:
+                f.create_dataset("data", data=data, chunks=(100, 7))
+            with h5py.File(os.path.join(tmpdir, "data.h5"), "r") as f:
+                for mode in [1, 2, 3, 4, 255]:
+                    normalizer = Normalizer(mode=mode, verbose=0)
+                    expected = normalizer.normalize({"input": data.copy()})["input"]
+                    for file_backed in [memmap, f["data"]]:
+                        lazy_normalizer = Normalizer(mode=mode, verbose=0)
+                        # small chunks to test merging statistics of chunks
+                        norm_data = lazy_normalizer.normalize_lazy({"input": file_backed}, chunk_size=64)["input"]
+                        self.assertIsInstance(norm_data, FileBackedArray)
+                        npt.assert_allclose(lazy_normalizer.mean_labels["input"], normalizer.mean_labels["input"],
+                                            rtol=1e-5, atol=1e-5)
+                        npt.assert_allclose(lazy_normalizer.std_labels["input"], normalizer.std_labels["input"],
+                                            rtol=1e-5)
+                        # rows are read in any order and normalized per batch
+                        idx = np.random.permutation(1000)
+                        subset = take_rows(norm_data, idx[:500])
+                        self.assertEqual(subset.shape, (500, 7))
+                        npt.assert_allclose(subset[[3, 1, 3]], expected[idx[[3, 1, 3]]], rtol=1e-5, atol=1e-5)
+
+                # file-backed data can be read batch by batch by data generators
+                lazy_normalizer = Normalizer(mode=2, verbose=0)
+                norm_data = lazy_normalizer.normalize_lazy({"input": f["data"]})
+                generator = CNNDataGenerator(batch_size=64, shuffle=True, steps_per_epoch=1000 // 64,
+                                             data=[norm_data, {"output": np.arange(1000)}])
+                x, y = generator[0]
+                self.assertEqual(x["input"].shape, (64, 7, 1))
+                npt.assert_allclose(x["input"][:, :, 0], lazy_normalizer.normalize({"input": data[y["output"]]},
+                                                                                   calc=False)["input"],
+                                    rtol=1e-5, atol=1e-5)
+
+    def test_h5loader_lazy(self):
+        import tempfile
+        import h5py
+        import numpy as np
+        from astroNN.datasets import H5Loader
+        from astroNN.nn.utilities.file_backed import FileBackedArray
+
+        spectra = np.random.normal(size=(20, 7)).astype(np.float32)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with h5py.File(os.path.join(tmpdir, "lazy.h5"), "w") as f:
+                f.create_dataset("spectra", data=spectra)
+                f.create_dataset("spectra_err", data=np.ones_like(spectra))
+                f.create_dataset("in_flag", data=np.arange(20) % 2)
+                f.create_dataset("teff", data=np.arange(20, dtype=np.float32))
+            with H5Loader(os.path.join(tmpdir, "lazy.h5"), target=["teff"]) as loader:
+                loader.lazy = True
+                x, y = loader.load()
+                self.assertIsInstance(x, FileBackedArray)
+                npt.assert_array_equal(x[[1, 0]], spectra[::2][[1, 0]])
+                npt.assert_array_equal(y, np.arange(0, 20, 2))
+            # the h5 file is closed by the context manager and lazy spectra are no longer readable
+            self.assertIsNone(loader._h5file)
+            # h5py raises different errors depending on its version
+            self.assertRaises((RuntimeError, ValueError, OSError), x.__getitem__, [0])
+
+    def test_normalizer_partial_fit(self):
+        import numpy as np
+        from astroNN.config import MAGIC_NUMBER
+        from astroNN.nn.utilities import Normalizer
+
+        data = np.random.normal(2., 3., size=(500, 6)).astype(np.float32)
+        data[::11, 1] = MAGIC_NUMBER
+        data[::7, 4] = np.nan
+        aux = np.random.normal(-1., 2., size=500)
+        chunks = np.split(np.arange(500), [1, 37, 200, 201, 433])  # uneven chunks
+        for mode in [0, 1, 2, 3, "3s", 4, 255]:
+            expected_normalizer = Normalizer(mode=mode, verbose=0)
+            expected = expected_normalizer.normalize(data.copy())
+            normalizer = Normalizer(mode=mode, verbose=0)
+            for idx in chunks:
+                normalizer.partial_fit(data[idx])
+            normalizer.finalize()
+            npt.assert_allclose(normalizer.mean_labels, expected_normalizer.mean_labels, rtol=1e-5, atol=1e-5)
+            npt.assert_allclose(normalizer.std_labels, expected_normalizer.std_labels, rtol=1e-5)
+            npt.assert_allclose(normalizer.normalize(data, calc=False), expected, rtol=1e-4, atol=1e-4)
+
+        # named data with different modes
+        expected_normalizer = Normalizer(mode={"input": 2, "aux": 1}, verbose=0)
+        expected_normalizer.normalize({"input": data.copy(), "aux": aux.copy()})
+        normalizer = Normalizer(mode={"input": 2, "aux": 1}, verbose=0)
+        for idx in chunks:
+            normalizer.partial_fit({"input": data[idx], "aux": aux[idx]})
+        normalizer.finalize()
+        for name in ["input", "aux"]:
+            npt.assert_allclose(normalizer.mean_labels[name], expected_normalizer.mean_labels[name], rtol=1e-5,
+                                atol=1e-5)
+            npt.assert_allclose(normalizer.std_labels[name], expected_normalizer.std_labels[name], rtol=1e-5)
+
+    def test_normalization_cache(self):
+        import tempfile
+        import numpy as np
+        from astroNN.config import MAGIC_NUMBER
+        from astroNN.nn.utilities import Normalizer
+        from astroNN.nn.utilities.norm_cache import NormalizationCache
+
+        data = np.random.normal(2., 3., size=(200, 7)).astype(np.float32)
+        data[::13, 2] = MAGIC_NUMBER
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = NormalizationCache(cache_dir=tmpdir)
+            for mode in [1, 2, 3, "3s", 255]:
+                expected_normalizer = Normalizer(mode=mode, verbose=0)
+                expected = expected_normalizer.normalize({"input": data.copy()})["input"]
+                for i in range(2):  # miss then hit
+                    normalizer = Normalizer(mode=mode, verbose=0)
+                    norm_data = cache.normalize(normalizer, {"input": data})["input"]
+                    npt.assert_allclose(norm_data, expected, rtol=1e-6)
+                    npt.assert_allclose(normalizer.mean_labels["input"], expected_normalizer.mean_labels["input"])
+                    npt.assert_allclose(normalizer.std_labels["input"], expected_normalizer.std_labels["input"])
+                    # normalizer loaded from cache normalizes new data the same way
+                    npt.assert_allclose(normalizer.normalize({"input": data[:5]}, calc=False)["input"], expected[:5],
+                                        rtol=1e-6)
+                self.assertIsInstance(norm_data, np.memmap)
+            self.assertEqual(cache.stats["hits"], 5)
+            self.assertEqual(cache.stats["misses"], 5)
+
+            # different data is a different entry
+            changed = data.copy()
+            changed[0, 0] += 1.
+            cache.normalize(Normalizer(mode=2, verbose=0), {"input": changed})
+            self.assertEqual(cache.stats["misses"], 6)
+
+            # least recently used entries are evicted under size cap
+            entries = cache._entries()
+            cache.max_size = entries[-1][2] + entries[-2][2]
+            cache.evict()
+            self.assertLessEqual(cache.size(), cache.max_size)
+            self.assertEqual(len(cache._entries()), 2)
+            cache.normalize(Normalizer(mode=2, verbose=0), {"input": changed})
+            self.assertEqual(cache.stats["hits"], 6)
+
+    def test_chunk_shuffle(self):
+        import numpy as np
+        from astroNN.nn.utilities.file_backed import FileBackedArray
+        from astroNN.nn.utilities.generator import ChunkShuffleSampler
+
+        data = np.random.normal(size=(1000, 3)).astype(np.float32)
+        # a view of every other row like a training set splitted from a catalog
+        view = FileBackedArray(data).subset(np.arange(0, 1000, 2))
+        sampler = ChunkShuffleSampler(view.storage_rows, chunk_size=50, pool_size=3)
+        order = sampler.order(range(len(view)))
+        self.assertEqual(sorted(order.tolist()), list(range(500)))
+        self.assertNotEqual(order.tolist(), list(range(500)))
+        # every 75 data (3 chunks of 25 data in this view) only come from 3 chunks
+        for i in range(0, 500, 75):
+            self.assertLessEqual(len(np.unique(view.storage_rows[order[i:i + 75]] // 50)), 3)
+
+        # rows are gathered from in-memory pool of chunks, every chunk is read once if batches follow the sampler
+        view.set_chunk_pool(chunk_size=50, pool_size=3)
+        for i in range(0, 500, 25):
+            npt.assert_array_equal(view[order[i:i + 25]], data[view.storage_rows[order[i:i + 25]]])
+        stats = view.read_throughput()
+        self.assertEqual(stats["chunks_read"], 20)
+        self.assertEqual(stats["rows"], 1000)
+        self.assertGreater(stats["mb_per_sec"], 0.)
+
+    def test_noise_augmentation(self):
+        import numpy as np
+        from astroNN.config import MAGIC_NUMBER
+        from astroNN.nn.utilities.augmentation import GaussianNoiseAugmentation
+
+        data = np.ones((2000, 50, 1), dtype=np.float32)
+        data[:, 0] = MAGIC_NUMBER
+        err = np.full_like(data, 0.5)
+        err[:, 1] = 0.
+        sample_weight = np.ones(2000)
+        augmentation = GaussianNoiseAugmentation(seed=42)
+        x, y, sw = augmentation({"input": data, "input_err": err}, {"output": data}, sample_weight)
+        # inputs are not modified in place, only the input is perturbed
+        npt.assert_array_equal(data[:, 2:], 1.)
+        self.assertIs(x["input_err"], err)
+        self.assertIs(y["output"], data)
+        self.assertIs(sw, sample_weight)
+        self.assertEqual(x["input"].dtype, np.float32)
+        # magic number and data without uncertainty are not perturbed
+        npt.assert_array_equal(x["input"][:, 0], MAGIC_NUMBER)
+        npt.assert_array_equal(x["input"][:, 1], 1.)
+        npt.assert_allclose(np.mean(x["input"][:, 2:]), 1., atol=0.01)
+        npt.assert_allclose(np.std(x["input"][:, 2:]), 0.5, rtol=0.02)
+        # different noise every batch
+        self.assertFalse(np.array_equal(augmentation({"input": data, "input_err": err}, {})[0]["input"], x["input"]))
+
+    def test_shared_array(self):
+        import multiprocessing
+        import pickle
+        from concurrent.futures import ProcessPoolExecutor
+        import numpy as np
+        from astroNN.nn.utilities.generator import GeneratorMaster
+        from astroNN.nn.utilities.shared_array import SharedArray
+
+        data = np.random.normal(size=(1000, 100)).astype(np.float32)
+        shared = SharedArray.from_array(data)
+        npt.assert_array_equal(shared, data)
+        # pickled by name of shared memory, not by value
+        pickled = pickle.dumps(shared)
+        self.assertLess(len(pickled), 1000)
+        attached = pickle.loads(pickled)
+        self.assertEqual(attached.shm_name, shared.shm_name)
+        shared[0, 0] = 123.
+        self.assertEqual(attached[0, 0], 123.)
+        # views are pickled by value
+        npt.assert_array_equal(pickle.loads(pickle.dumps(shared[:10])), shared[:10])
+        del attached
+        # spawned worker processes attach to the same memory without taking over its ownership
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            self.assertAlmostEqual(executor.submit(np.sum, shared).result(), np.sum(shared), places=2)
+        npt.assert_array_equal(shared[1:], data[1:])
+
+        generator = GeneratorMaster(4, False, 5, [{"input": data}, {"output": data[:, 0]}], False)
+        generator.sample_weight = np.ones(1000)
+        generator.to_shared_memory()
+        self.assertIsInstance(generator.data[0]["input"], SharedArray)
+        self.assertIsInstance(generator.sample_weight, SharedArray)
+        self.assertLess(len(pickle.dumps(generator)), 10000)
+        npt.assert_array_equal(pickle.loads(pickle.dumps(generator)).data[0]["input"], data)
+        generator.release_shared_memory()
+        self.assertNotIsInstance(generator.data[0]["input"], SharedArray)
+        npt.assert_array_equal(generator.data[0]["input"], data)
+        shared.release()
+
     def test_cpu_gpu_management(self):
         from astroNN.shared.nn_tools import cpu_fallback
 